@@ -116,13 +116,11 @@ class Kernel:
     # agentLatency (or defaultLatency) and latencyNoise should be specified.
     # These should be considered deprecated and will be removed in the future.
 
-    # If agentLatency is not defined, define it using the defaultLatency.
-    # This matrix defines the communication delay between every pair of
-    # agents.
-    if agentLatency is None:
-      self.agentLatency = [[defaultLatency] * len(agents)] * len(agents)
-    else:
-      self.agentLatency = agentLatency
+    # If agentLatency is not defined, the defaultLatency applies to every
+    # pair of agents, without building a matrix of it.  Otherwise this
+    # matrix defines the communication delay between every pair of agents.
+    self.agentLatency = agentLatency
+    self.defaultLatency = defaultLatency
 
     # There is a noise model for latency, intended to be a one-sided
     # distribution with the peak at zero.  By default there is no noise
@@ -392,7 +390,7 @@ class Kernel:
                  latency, self.currentAgentAdditionalDelay, delay, self.agents[sender].name, self.agents[recipient].name,
                  self.fmtTime(deliverAt))
     else:
-      latency = self.agentLatency[sender][recipient]
+      latency = self.defaultLatency if self.agentLatency is None else self.agentLatency[sender][recipient]
       noise = self.random_state.choice(len(self.latencyNoise), 1, self.latencyNoise)[0]
       deliverAt = sentTime + pd.Timedelta(latency + noise)
       log_print ("Kernel applied latency {}, noise {}, accumulated delay {}, one-time delay {} on sendMessage from: {} to {}, scheduled for {}",
@@ -407,6 +405,45 @@ class Kernel:
 
 
 
+  def sendMessages(self, sender = None, recipients = None, msgs = None, delay = 0):
+    # Called by an agent to send one message to each of several recipients at once (e.g.
+    # market data to all subscribers), with the same effect as calling sendMessage for each
+    # recipient and message in order.  If an agentLatencyModel is defined, the latencies of
+    # all of the messages are sampled from it in a single call.
+
+    if self.agentLatencyModel is None or not hasattr(self.agentLatencyModel, 'get_latencies'):
+      for recipient, msg in zip(recipients, msgs): self.sendMessage(sender, recipient, msg, delay = delay)
+      return
+
+    if sender is None:
+      raise ValueError("sendMessages() called without valid sender ID",
+                       "sender:", sender, "recipients:", recipients,
+                       "msgs:", msgs)
+
+    if any(recipient is None for recipient in recipients) or any(msg is None for msg in msgs):
+      raise ValueError("sendMessages() called with invalid recipient ID or message == None",
+                       "sender:", sender, "recipients:", recipients,
+                       "msgs:", msgs)
+
+    if not recipients: return
+
+    # Message delay before latency is as in sendMessage.
+    sentTime = self.currentTime + pd.Timedelta(self.agentComputationDelays[sender] +
+                                               self.currentAgentAdditionalDelay + delay)
+
+    latencies = self.agentLatencyModel.get_latencies(sender, recipients)
+
+    for recipient, msg, latency in zip(recipients, msgs, latencies):
+      deliverAt = sentTime + pd.Timedelta(latency)
+      log_print ("Kernel applied latency {}, accumulated delay {}, one-time delay {} on sendMessages from: {} to {}, scheduled for {}",
+                 latency, self.currentAgentAdditionalDelay, delay, self.agents[sender].name, self.agents[recipient].name,
+                 self.fmtTime(deliverAt))
+
+      self.messages.put((deliverAt, (recipient, MessageType.MESSAGE, msg)))
+
+      log_print ("Message queued: {}", msg)
+
+
   def setWakeup(self, sender = None, requestedTime = None):
     # Called by an agent to receive a "wakeup call" from the kernel
     # at some requested future time.  Defaults to the next possible
@@ -520,19 +557,26 @@ class Kernel:
     # the Kernel will construct a filename based on the name of the Agent
     # requesting log archival.
 
+    # Numpy arrays are written uncompressed in .npy format, so they can later
+    # be memory-mapped with np.load(mmap_mode='r').
+
     if self.skip_log: return
 
     path = os.path.join(".", "log", self.log_dir)
 
+    ext = "npy" if isinstance(dfLog, np.ndarray) else "bz2"
+
     if filename:
-      file = "{}.bz2".format(filename)
+      file = "{}.{}".format(filename, ext)
     else:
-      file = "{}.bz2".format(self.agents[sender].name.replace(" ",""))
+      file = "{}.{}".format(self.agents[sender].name.replace(" ",""), ext)
 
     if not os.path.exists(path):
       os.makedirs(path)
 
-    if isinstance(dfLog, pd.DataFrame):
+    if isinstance(dfLog, np.ndarray):
+      np.save(os.path.join(path, file), dfLog)
+    elif isinstance(dfLog, pd.DataFrame):
       dfLog.to_pickle(os.path.join(path, file), compression='bz2')
     else:
       with open(os.path.join(path, file), "wb") as output_file:
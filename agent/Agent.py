@@ -150,6 +150,11 @@ class Agent:
   def sendMessage (self, recipientID, msg, delay = 0):
     self.kernel.sendMessage(self.id, recipientID, msg, delay = delay)
 
+  # Sends msgs[i] to recipientIDs[i] for each i, as a broadcast: equivalent to sending each
+  # in turn, but with the latencies of all of them sampled together.
+  def sendMessages (self, recipientIDs, msgs, delay = 0):
+    self.kernel.sendMessages(self.id, recipientIDs, msgs, delay = delay)
+
   def setWakeup (self, requestedTime):
     self.kernel.setWakeup(self.id, requestedTime)
 
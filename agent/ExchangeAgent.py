@@ -1,16 +1,24 @@
 # The ExchangeAgent expects a numeric agent id, printable name, agent type, timestamp to open and close trading,
 # a list of equity symbols for which it should create order books, a frequency at which to archive snapshots
-# of its order books, a pipeline delay (in ns) for order activity, the exchange computation delay (in ns),
+# of its order books, optionally a fixed number of levels to which those snapshots should be limited,
+# optionally whether those fixed-depth snapshots are sampled on a timer at book_freq or only when the top levels change,
+# a pipeline delay (in ns) for order activity, the exchange computation delay (in ns),
 # the levels of order stream history to maintain per symbol (maintains all orders that led to the last N trades),
-# whether to log all order activity to the agent log, and a random state object (already seeded) to use
-# for stochasticity.
+# the longest lookback period that transacted volume queries must support (None keeps all executions),
+# whether to log all order activity to the agent log, whether to also record order activity in a compact binary
+# journal (see util.OrderJournal), whether to aggregate the execution reports sent to the
+# aggressor of a sweeping order, whether to cancel every order still resting at the close,
+# and a random state object (already seeded) to use for stochasticity.
 from agent.FinancialAgent import FinancialAgent
 from message.Message import Message
 from util.OrderBook import OrderBook
+from util.OrderJournal import OrderJournal, CANCEL
+from util.MarketDataDelta import MarketDataDelta
 from util.util import log_print
 
 import datetime as dt
 
+import os
 import sys
 
 import warnings
@@ -25,8 +33,10 @@ from copy import deepcopy
 
 class ExchangeAgent(FinancialAgent):
 
-  def __init__(self, id, name, type, mkt_open, mkt_close, symbols, book_freq='S', wide_book=False, pipeline_delay = 40000,
-               computation_delay = 1, stream_history = 0, log_orders = False, random_state = None):
+  def __init__(self, id, name, type, mkt_open, mkt_close, symbols, book_freq='S', wide_book=False, book_log_depth=None,
+               book_sampling=None, pipeline_delay = 40000, computation_delay = 1, stream_history = 0, max_volume_lookback = None,
+               log_orders = False, journal_orders = False, aggregate_executions = False, cancel_at_close = False,
+               random_state = None):
 
     super().__init__(id, name, type, random_state)
 
@@ -49,14 +59,44 @@ class ExchangeAgent(FinancialAgent):
     # to support certain agents from the auction literature (GD, HBL, etc).
     self.stream_history = stream_history
 
+    # Executions are retained for QUERY_TRANSACTED_VOLUME up to this lookback period (e.g. '1h').
+    # None retains every execution.
+    self.max_volume_lookback = max_volume_lookback
+
     # Log all order activity?
     self.log_orders = log_orders
 
-    # Create an order book for each symbol.
-    self.order_books = {}
-
-    for symbol in symbols:
-      self.order_books[symbol] = OrderBook(self, symbol)
+    # Record order activity (adds, modifications, cancellations and executions) as fixed-size binary records
+    # in <log_dir>/<name>_ORDER_JOURNAL.bin?  This is independent of log_orders and much cheaper.
+    self.journal = OrderJournal() if journal_orders else None
+
+    # If not None, the order books are logged as fixed-width snapshots of only this many levels per side,
+    # written as memory-mappable .npy chunks (see util.BookSnapshotRecorder) instead of full-depth dictionaries.
+    self.book_log_depth = book_log_depth
+
+    # How fixed-depth snapshots are taken.  None records one after every change to the book.  'timer' records
+    # one at every book_freq interval after the open (e.g. each second for '1S') while the simulation runs,
+    # so nothing needs to be resampled afterwards.  'event' records one only when the top book_log_depth
+    # levels actually changed.
+    if book_log_depth is not None and book_freq is None:
+      raise ValueError("book_log_depth requires book_freq, as the order books are not logged when it is None")
+    if book_sampling not in (None, 'timer', 'event'):
+      raise ValueError("book_sampling must be None, 'timer' or 'event', not {}".format(book_sampling))
+    if book_sampling is not None and book_log_depth is None:
+      raise ValueError("book_sampling requires a fixed book_log_depth")
+    if book_sampling == 'timer' and (book_freq is None or str(book_freq).isdigit()):
+      raise ValueError("book_sampling='timer' requires a sampling frequency for book_freq, e.g. '1S'")
+    self.book_sampling = book_sampling
+
+    # Send the aggressor of an incoming order a single ORDER_EXECUTED report covering all of its fills
+    # (with the list of fills and their VWAP) instead of one report per matched resting order?  A market order
+    # gets one report, under its own order id, for all of the price levels it sweeps.  The owners of the
+    # resting orders always receive individual execution reports.
+    self.aggregate_executions = aggregate_executions
+
+    # Cancel every order still resting in the books at mkt_close (see closeBooks), notifying the owners?
+    # Otherwise the orders are left in the books.
+    self.cancel_at_close = cancel_at_close
 
     # At what frequency will we archive the order books for visualization and analysis?
     self.book_freq = book_freq
@@ -64,12 +104,26 @@ class ExchangeAgent(FinancialAgent):
     # Store orderbook in wide format? ONLY WORKS with book_freq == 0
     self.wide_book = wide_book
 
-    # The subscription dict is a dictionary with the key = agent ID,
-    # value = dict (key = symbol, value = list [levels (no of levels to recieve updates for),
-    # frequency (min number of ns between messages), last agent update timestamp]
-    # e.g. {101 : {'AAPL' : [1, 10, pd.Timestamp(10:00:00)}}
+    # Create an order book for each symbol.
+    self.order_books = {}
+
+    for symbol in symbols:
+      self.order_books[symbol] = OrderBook(self, symbol)
+
+    # The subscription dict is a dictionary with the key = symbol,
+    # value = dict (key = agent ID, value = list [levels (no of levels to recieve updates for),
+    # frequency (min number of ns between messages), last agent update timestamp,
+    # delta feed state (None for full snapshots, else a MarketDataDelta)]
+    # e.g. {'AAPL' : {101 : [1, 10, pd.Timestamp(10:00:00), None]}}
     self.subscription_dict = {}
 
+    # Most recent depth snapshot computed for each (symbol, depth), as (book version, bids, asks), so that
+    # queries and market data arriving between changes to a book share one immutable snapshot.
+    self.depth_cache = {}
+
+    # While a BATCH_ORDER is being processed, the orders accepted so far (otherwise None).
+    self.batch_acks = None
+
   # The exchange agent overrides this to obtain a reference to an oracle.
   # This is needed to establish a "last trade price" at open (i.e. an opening
   # price) in case agents query last trade before any simulated trades are made.
@@ -87,17 +141,76 @@ class ExchangeAgent(FinancialAgent):
       except AttributeError as e:
         log_print(str(e))
 
+    if self.journal is not None and not self.kernel.skip_log:
+      self.journal.open(os.path.join(".", "log", self.kernel.log_dir), self.name.replace(" ", "") + '_ORDER_JOURNAL')
+
+
+  # The exchange agent overrides this to also request a wakeup call at the close, if it is to
+  # cancel the orders still resting then.
+  def kernelStarting (self, startTime):
+    super().kernelStarting(startTime)
+
+    if self.cancel_at_close: self.setWakeup(self.mkt_close)
+
+
+  # The exchange agent's only scheduled wakeup call after the first is at the close.
+  def wakeup (self, currentTime):
+    super().wakeup(currentTime)
+
+    if self.cancel_at_close and currentTime >= self.mkt_close: self.closeBooks()
+
+
+  # End-of-day teardown: cancels every order still resting in each book, agent by agent through the
+  # open order index, and sends each owner a single ORDERS_CANCELLED message per book, as for CANCEL_ALL.
+  def closeBooks (self):
+    self.setComputationDelay(self.computation_delay)
+
+    for symbol, book in self.order_books.items():
+      agent_ids = list(book.open_orders)
+      if not agent_ids: continue
+
+      log_print("{} cancelling the orders of {} agents resting in {} at the close", self.name, len(agent_ids), symbol)
+
+      for agent_id in agent_ids:
+        cancelled = book.cancelAllOrders(agent_id)
+
+        for order in cancelled:
+          if self.log_orders: self.logEvent('ORDER_CANCELLED', order.to_dict())
+          if self.journal is not None: self.journal.record(CANCEL, self.currentTime, order)
+
+        self.sendMessage(agent_id, Message({"msg": "ORDERS_CANCELLED", "symbol": symbol, "orders": cancelled}))
+
+      self.publishOrderBookData(symbol)
+
+
+  # The exchange agent overrides this to log, from the open order index, how many orders
+  # each agent still had resting in each book at the end of the simulation, if order activity
+  # is logged or the books are torn down at the close.
+  def kernelStopping (self):
+    super().kernelStopping()
+
+    if not (self.log_orders or self.cancel_at_close): return
+
+    for symbol, book in self.order_books.items():
+      resting = {agent_id: len(orders) for agent_id, orders in book.open_orders.items()}
+      self.logEvent('OPEN_ORDERS_AT_CLOSE', {'symbol': symbol, 'orders_by_agent': resting})
+
 
   # The exchange agent overrides this to additionally log the full depth of its
   # order books for the entire day.
   def kernelTerminating (self):
     super().kernelTerminating()
 
+    if self.journal is not None: self.journal.close()
+
     # If the oracle supports writing the fundamental value series for its
     # symbols, write them to disk.
     if hasattr(self.oracle, 'f_log'):
       for symbol in self.oracle.f_log:
-        dfFund = pd.DataFrame(self.oracle.f_log[symbol])
+        if hasattr(self.oracle, 'get_fundamental_log'):
+          dfFund = self.oracle.get_fundamental_log(symbol)
+        else:
+          dfFund = pd.DataFrame(self.oracle.f_log[symbol])
         if not dfFund.empty:
           dfFund.set_index('FundamentalTime', inplace=True)
           self.writeLog(dfFund, filename='fundamental_{}'.format(symbol))
@@ -128,8 +241,9 @@ class ExchangeAgent(FinancialAgent):
     if currentTime > self.mkt_close:
       # Most messages after close will receive a 'MKT_CLOSED' message in response.  A few things
       # might still be processed, like requests for final trade prices or such.
-      if msg.body['msg'] in ['LIMIT_ORDER', 'MARKET_ORDER', 'CANCEL_ORDER', 'MODIFY_ORDER']:
-        log_print("{} received {}: {}", self.name, msg.body['msg'], msg.body['order'])
+      if msg.body['msg'] in ['LIMIT_ORDER', 'MARKET_ORDER', 'CANCEL_ORDER', 'MODIFY_ORDER', 'BATCH_ORDER', 'CANCEL_ALL',
+                             'REPLACE_ORDER']:
+        log_print("{} received {}: {}", self.name, msg.body['msg'], msg.body.get('order', msg.body.get('orders')))
         self.sendMessage(msg.body['sender'], Message({"msg": "MKT_CLOSED"}))
 
         # Don't do any further processing on these messages!
@@ -146,8 +260,14 @@ class ExchangeAgent(FinancialAgent):
         return
 
     # Log order messages only if that option is configured.  Log all other messages.
-    if msg.body['msg'] in ['LIMIT_ORDER', 'MARKET_ORDER', 'CANCEL_ORDER', 'MODIFY_ORDER']:
+    if msg.body['msg'] in ['LIMIT_ORDER', 'MARKET_ORDER', 'CANCEL_ORDER', 'MODIFY_ORDER', 'REPLACE_ORDER']:
       if self.log_orders: self.logEvent(msg.body['msg'], msg.body['order'].to_dict())
+      # Adds, market orders and modifications are journaled by the order book, once they pass its checks
+      # or are applied.
+    elif msg.body['msg'] == 'BATCH_ORDER':
+      # A batch is logged as its individual limit orders.
+      for order in msg.body['orders']:
+        if self.log_orders: self.logEvent('LIMIT_ORDER', order.to_dict())
     else:
       self.logEvent(msg.body['msg'], msg.body['sender'])
 
@@ -198,9 +318,10 @@ class ExchangeAgent(FinancialAgent):
 
         # Return the requested depth on both sides of the order book for the requested symbol.
         # Returns price levels and aggregated volume at each level (not individual orders).
+        bids, asks = self.getBookDepth(symbol, depth)
         self.sendMessage(msg.body['sender'], Message({"msg": "QUERY_SPREAD", "symbol": symbol, "depth": depth,
-                                                      "bids": self.order_books[symbol].getInsideBids(depth),
-                                                      "asks": self.order_books[symbol].getInsideAsks(depth),
+                                                      "bids": bids,
+                                                      "asks": asks,
                                                       "data": self.order_books[symbol].last_trade,
                                                       "mkt_closed": True if currentTime > self.mkt_close else False,
                                                       "book": ''}))
@@ -209,6 +330,28 @@ class ExchangeAgent(FinancialAgent):
         # of a large order book is very slow, so we should only do it with good reason.  We don't currently
         # have a configurable option for it.
         # "book": self.order_books[symbol].prettyPrint(silent=True) }))
+    elif msg.body['msg'] == "QUERY_LIQUIDITY":
+      symbol = msg.body['symbol']
+      within = msg.body['within']
+      relative = msg.body['relative']
+      if symbol not in self.order_books:
+        log_print("Liquidity request discarded.  Unknown symbol: {}", symbol)
+      else:
+        log_print("{} received QUERY_LIQUIDITY ({}:{}) request from agent {}", self.name, symbol, within,
+                  msg.body['sender'])
+
+        # Return the total volume on each side of the book within each requested distance of the best price,
+        # along with the inside quote, rather than the depth an agent would need to compute it itself.
+        book = self.order_books[symbol]
+        bids, asks = self.getBookDepth(symbol, 1)
+        self.sendMessage(msg.body['sender'], Message({"msg": "QUERY_LIQUIDITY", "symbol": symbol, "within": within,
+                                                      "relative": relative,
+                                                      "bid_liquidity": book.getLiquidity(True, within, relative),
+                                                      "ask_liquidity": book.getLiquidity(False, within, relative),
+                                                      "bids": bids,
+                                                      "asks": asks,
+                                                      "data": book.last_trade,
+                                                      "mkt_closed": True if currentTime > self.mkt_close else False}))
     elif msg.body['msg'] == "QUERY_ORDER_STREAM":
       symbol = msg.body['symbol']
       length = msg.body['length']
@@ -225,6 +368,38 @@ class ExchangeAgent(FinancialAgent):
                                                     "mkt_closed": True if currentTime > self.mkt_close else False,
                                                     "orders": self.order_books[symbol].history[1:length + 1]
                                                     }))
+    elif msg.body['msg'] == "QUERY_ORDER_STREAM_UPDATES":
+      symbol = msg.body['symbol']
+      length = msg.body['length']
+
+      if symbol not in self.order_books:
+        log_print("Order stream request discarded.  Unknown symbol: {}", symbol)
+      else:
+        log_print("{} received QUERY_ORDER_STREAM_UPDATES ({}:{}) request from agent {}", self.name, symbol, length,
+                  msg.body['sender'])
+
+        # As QUERY_ORDER_STREAM, but only the trade buckets and executions the agent has not seen yet, as
+        # compact records the agent applies to its own copy of the history.
+        update = self.order_books[symbol].history.getUpdates(length, msg.body['last_trade_seq'],
+                                                              msg.body['last_fill_seq'])
+        self.sendMessage(msg.body['sender'], Message({"msg": "QUERY_ORDER_STREAM_UPDATES", "symbol": symbol,
+                                                      "length": length, "update": update,
+                                                      "mkt_closed": True if currentTime > self.mkt_close else False}))
+    elif msg.body['msg'] == 'QUERY_OPEN_ORDERS':
+      # Report the sender's orders resting in the book for symbol (or in all books, if symbol is None), from the
+      # open order index.  Each order carries its unexecuted quantity.
+      symbol = msg.body.get('symbol')
+      if symbol is not None and symbol not in self.order_books:
+        log_print("Open orders request discarded.  Unknown symbol: {}", symbol)
+      else:
+        log_print("{} received QUERY_OPEN_ORDERS ({}) request from agent {}", self.name, symbol, msg.body['sender'])
+        orders = []
+        for book_symbol in (self.order_books if symbol is None else [symbol]):
+          orders.extend(self.order_books[book_symbol].getOpenOrders(msg.body['sender']))
+
+        self.sendMessage(msg.body['sender'], Message({"msg": "QUERY_OPEN_ORDERS", "symbol": symbol, "orders": orders,
+                                                      "request_id": msg.body.get('request_id'),
+                                                      "mkt_closed": True if currentTime > self.mkt_close else False}))
     elif msg.body['msg'] == 'QUERY_TRANSACTED_VOLUME':
       symbol = msg.body['symbol']
       lookback_period = msg.body['lookback_period']
@@ -245,7 +420,29 @@ class ExchangeAgent(FinancialAgent):
       else:
         # Hand the order to the order book for processing.
         self.order_books[order.symbol].handleLimitOrder(deepcopy(order))
-        self.publishOrderBookData()
+        self.publishOrderBookData(order.symbol)
+    elif msg.body['msg'] == "BATCH_ORDER":
+      # Process several limit orders from one agent in a single pass.  Their ORDER_ACCEPTED notifications are
+      # collected (see sendMessage) and returned as one BATCH_ORDER_ACCEPTED message, and market data for each
+      # affected symbol is published once, after the whole batch.
+      orders = msg.body['orders']
+      log_print("{} received BATCH_ORDER of {} orders", self.name, len(orders))
+
+      self.batch_acks = []
+      symbols = []
+      for order in orders:
+        if order.symbol not in self.order_books:
+          log_print("Limit Order discarded.  Unknown symbol: {}", order.symbol)
+          continue
+        self.order_books[order.symbol].handleLimitOrder(deepcopy(order))
+        if order.symbol not in symbols: symbols.append(order.symbol)
+
+      accepted, self.batch_acks = self.batch_acks, None
+      if accepted:
+        self.sendMessage(msg.body['sender'], Message({"msg": "BATCH_ORDER_ACCEPTED", "orders": accepted}))
+
+      for symbol in symbols:
+        self.publishOrderBookData(symbol)
     elif msg.body['msg'] == "MARKET_ORDER":
       order = msg.body['order']
       log_print("{} received MARKET_ORDER: {}", self.name, order)
@@ -254,7 +451,7 @@ class ExchangeAgent(FinancialAgent):
       else:
         # Hand the market order to the order book for processing.
         self.order_books[order.symbol].handleMarketOrder(deepcopy(order))
-        self.publishOrderBookData()
+        self.publishOrderBookData(order.symbol)
     elif msg.body['msg'] == "CANCEL_ORDER":
       # Note: this is somewhat open to abuse, as in theory agents could cancel other agents' orders.
       # An agent could also become confused if they receive a (partial) execution on an order they
@@ -267,7 +464,38 @@ class ExchangeAgent(FinancialAgent):
       else:
         # Hand the order to the order book for processing.
         self.order_books[order.symbol].cancelOrder(deepcopy(order))
-        self.publishOrderBookData()
+        self.publishOrderBookData(order.symbol)
+    elif msg.body['msg'] == "CANCEL_ALL":
+      # Cancel all of the sender's resting orders, optionally only for one symbol and/or one side of the book.
+      # The cancelled orders are reported in a single ORDERS_CANCELLED message.
+      agent_id, symbol, is_buy_order = msg.body['sender'], msg.body.get('symbol'), msg.body.get('is_buy_order')
+      log_print("{} received CANCEL_ALL ({}:{}) from agent {}", self.name, symbol, is_buy_order, agent_id)
+      if symbol is not None and symbol not in self.order_books:
+        log_print("Cancellation request discarded.  Unknown symbol: {}", symbol)
+      else:
+        cancelled = []
+        for book_symbol in (self.order_books if symbol is None else [symbol]):
+          book_cancelled = self.order_books[book_symbol].cancelAllOrders(agent_id, is_buy_order)
+          if book_cancelled:
+            cancelled.extend(book_cancelled)
+            self.publishOrderBookData(book_symbol)
+
+        for order in cancelled:
+          if self.log_orders: self.logEvent('ORDER_CANCELLED', order.to_dict())
+          if self.journal is not None: self.journal.record(CANCEL, currentTime, order)
+
+        self.sendMessage(agent_id, Message({"msg": "ORDERS_CANCELLED", "symbol": symbol, "orders": cancelled}))
+    elif msg.body['msg'] == 'REPLACE_ORDER':
+      # Atomically change the price and/or size of a resting order.  See OrderBook.replacementKeepsPriority
+      # for the time priority rules.
+      order = msg.body['order']
+      new_order = msg.body['new_order']
+      log_print("{} received REPLACE_ORDER: {}, new order: {}", self.name, order, new_order)
+      if order.symbol not in self.order_books:
+        log_print("Replacement request discarded.  Unknown symbol: {}", order.symbol)
+      else:
+        self.order_books[order.symbol].replaceOrder(deepcopy(order), deepcopy(new_order))
+        self.publishOrderBookData(order.symbol)
     elif msg.body['msg'] == 'MODIFY_ORDER':
       # Replace an existing order with a modified order.  There could be some timing issues
       # here.  What if an order is partially executed, but the submitting agent has not
@@ -282,45 +510,92 @@ class ExchangeAgent(FinancialAgent):
         log_print("Modification request discarded.  Unknown symbol: {}".format(order.symbol))
       else:
         self.order_books[order.symbol].modifyOrder(deepcopy(order), deepcopy(new_order))
-        self.publishOrderBookData()
+        self.publishOrderBookData(order.symbol)
 
   def updateSubscriptionDict(self, msg, currentTime):
-    # The subscription dict is a dictionary with the key = agent ID,
-    # value = dict (key = symbol, value = list [levels (no of levels to recieve updates for),
-    # frequency (min number of ns between messages), last agent update timestamp]
-    # e.g. {101 : {'AAPL' : [1, 10, pd.Timestamp(10:00:00)}}
+    # Subscriptions are indexed by symbol (see __init__), so that an update to one order book only
+    # visits the agents subscribed to that symbol.
     if msg.body['msg'] == "MARKET_DATA_SUBSCRIPTION_REQUEST":
       agent_id, symbol, levels, freq = msg.body['sender'], msg.body['symbol'], msg.body['levels'], msg.body['freq']
-      self.subscription_dict[agent_id] = {symbol: [levels, freq, currentTime]}
+      delta = MarketDataDelta(msg.body.get('refresh', 100)) if msg.body.get('delta') else None
+      self.subscription_dict.setdefault(symbol, {})[agent_id] = [levels, freq, currentTime, delta]
     elif msg.body['msg'] == "MARKET_DATA_SUBSCRIPTION_CANCELLATION":
       agent_id, symbol = msg.body['sender'], msg.body['symbol']
-      del self.subscription_dict[agent_id][symbol]
+      self.subscription_dict.get(symbol, {}).pop(agent_id, None)
 
-  def publishOrderBookData(self):
+  def publishOrderBookData(self, symbol=None):
     '''
-    The exchange agents sends an order book update to the agents using the subscription API if one of the following
-    conditions are met:
+    The exchange agents sends an order book update for symbol (or for every symbol, if None) to the agents using
+    the subscription API if one of the following conditions are met:
     1) agent requests ALL order book updates (freq == 0)
     2) order book update timestamp > last time agent was updated AND the orderbook update time stamp is greater than
     the last agent update time stamp by a period more than that specified in the freq parameter.
+
+    The book depth is computed once per update for each distinct number of levels requested, and the same
+    bids and asks tuples are sent to every recipient of that depth (see getBookDepth).
+
+    Subscribers to the delta feed instead receive only the levels that changed since their previous update
+    (see MarketDataDelta), and nothing at all if their levels did not change.
     '''
-    for agent_id, params in self.subscription_dict.items():
-      for symbol, values in params.items():
-        levels, freq, last_agent_update = values[0], values[1], values[2]
-        orderbook_last_update = self.order_books[symbol].last_update_ts
+    for symbol in (self.subscription_dict if symbol is None else [symbol]):
+      subscribers = self.subscription_dict.get(symbol)
+      if not subscribers: continue
+
+      book = self.order_books[symbol]
+      orderbook_last_update = book.last_update_ts
+
+      # The updates for all subscribers are sent together as one broadcast.
+      recipients, messages = [], []
+
+      for agent_id, values in subscribers.items():
+        levels, freq, last_agent_update, delta = values[0], values[1], values[2], values[3]
         if (freq == 0) or \
            ((orderbook_last_update > last_agent_update) and ((orderbook_last_update - last_agent_update).delta >= freq)):
-          self.sendMessage(agent_id, Message({"msg": "MARKET_DATA",
-                                              "symbol": symbol,
-                                              "bids": self.order_books[symbol].getInsideBids(levels),
-                                              "asks": self.order_books[symbol].getInsideAsks(levels),
-                                              "last_transaction": self.order_books[symbol].last_trade,
-                                              "exchange_ts": self.currentTime}))
-          self.subscription_dict[agent_id][symbol][2] = orderbook_last_update
+          bids, asks = self.getBookDepth(symbol, levels)
+
+          if delta is not None:
+            update = delta.update(bids, asks)
+            if update is None: continue
+
+            update.update({"msg": "MARKET_DATA", "symbol": symbol, "delta": True,
+                           "last_transaction": book.last_trade, "exchange_ts": self.currentTime})
+            recipients.append(agent_id)
+            messages.append(Message(update))
+            values[2] = orderbook_last_update
+            continue
+
+          recipients.append(agent_id)
+          messages.append(Message({"msg": "MARKET_DATA",
+                                   "symbol": symbol,
+                                   "bids": bids,
+                                   "asks": asks,
+                                   "last_transaction": book.last_trade,
+                                   "exchange_ts": self.currentTime}))
+          values[2] = orderbook_last_update
+
+      if recipients: self.sendMessages(recipients, messages)
+
+  def getBookDepth(self, symbol, depth):
+    """ Returns the inside bids and asks of symbol to the given depth as tuples of (price, size).  The result is
+        cached until the book next changes, and the same tuples are shared by every caller in the meantime.
+    """
+    book = self.order_books[symbol]
+    cached = self.depth_cache.get((symbol, depth))
+
+    if cached is None or cached[0] != book.version:
+      cached = (book.version, tuple(book.getInsideBids(depth)), tuple(book.getInsideAsks(depth)))
+      self.depth_cache[(symbol, depth)] = cached
+
+    return cached[1], cached[2]
 
   def logOrderBookSnapshots(self, symbol):
     book = self.order_books[symbol]
 
+    if book.snapshot_recorder is not None:
+      # Take any timer samples still due between the last book event and the close.
+      if book.next_sample_time is not None: book.sampleSnapshots(self.mkt_close, inclusive=True)
+      book.snapshot_recorder.flush(self)
+
     if book.book_log:
 
       print("Logging order book to file...")
@@ -332,11 +607,24 @@ class ExchangeAgent(FinancialAgent):
     # TODO: probably organize the order types into categories once there are more, so we can
     # take action by category (e.g. ORDER-related messages) instead of enumerating all message
     # types to be affected.
-    if msg.body['msg'] in ['ORDER_ACCEPTED', 'ORDER_CANCELLED', 'ORDER_EXECUTED']:
+    if msg.body['msg'] == 'ORDER_ACCEPTED' and self.batch_acks is not None:
+      # Acceptances of orders within a BATCH_ORDER are collected and sent together once the batch is processed.
+      self.batch_acks.append(msg.body['order'])
+      if self.log_orders: self.logEvent(msg.body['msg'], msg.body['order'].to_dict())
+    elif msg.body['msg'] in ['BATCH_ORDER_ACCEPTED', 'ORDERS_CANCELLED']:
+      # Aggregated reports.  The individual orders were logged as they were processed.
+      super().sendMessage(recipientID, msg, delay = self.pipeline_delay)
+    elif msg.body['msg'] in ['ORDER_REPLACED', 'ORDER_REPLACE_REJECTED']:
+      super().sendMessage(recipientID, msg, delay = self.pipeline_delay)
+      if self.log_orders: self.logEvent(msg.body['msg'], msg.body['new_order'].to_dict())
+    elif msg.body['msg'] in ['ORDER_ACCEPTED', 'ORDER_CANCELLED', 'ORDER_EXECUTED']:
       # Messages that require order book modification (not simple queries) incur the additional
       # parallel processing delay as configured.
       super().sendMessage(recipientID, msg, delay = self.pipeline_delay)
       if self.log_orders: self.logEvent(msg.body['msg'], msg.body['order'].to_dict())
+      # Executions are journaled by the order book, fill by fill, as they are matched.
+      if self.journal is not None and msg.body['msg'] == 'ORDER_CANCELLED':
+        self.journal.record(CANCEL, self.currentTime, msg.body['order'])
     else:
       # Other message types incur only the currently-configured computation delay for this agent.
       super().sendMessage(recipientID, msg)
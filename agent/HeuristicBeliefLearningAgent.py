@@ -35,8 +35,9 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
         # trading strategy.
         if self.state != 'ACTIVE': return
 
-        # To make trade decisions, the HBL agent requires recent order stream information.
-        self.getOrderStream(self.symbol, length=self.L)
+        # To make trade decisions, the HBL agent requires recent order stream information.  The exchange
+        # only sends what changed since the last wakeup.
+        self.getOrderStreamUpdates(self.symbol, length=self.L)
         self.state = 'AWAITING_STREAM'
 
     def placeOrder(self):
@@ -69,8 +70,7 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
 
         # Find the lowest and highest observed prices in the order history.
         for h in self.stream_history[self.symbol]:
-            for id, order in h.items():
-                p = order['limit_price']
+            for id, (is_buy_order, p, quantity, executed) in h.items():
                 if p < low_p: low_p = p
                 if p > high_p: high_p = p
 
@@ -82,21 +82,20 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
         for h in self.stream_history[self.symbol]:
             # h follows increasing "transactions into the past", with index zero being orders
             # after the most recent transaction.
-            for id, order in h.items():
-                p = order['limit_price']
+            for id, (is_buy_order, p, quantity, executed) in h.items():
                 if p < low_p: low_p = p
                 if p > high_p: high_p = p
 
                 # For now if there are any transactions, consider the order successful.  For single
                 # unit orders, this is sufficient.  For multi-unit orders,
                 # we may wish to switch to a proportion of shares executed.
-                if order['is_buy_order']:
-                    if order['transactions']:
+                if is_buy_order:
+                    if executed:
                         nd[p - low_p, 1] += 1
                     else:
                         nd[p - low_p, 3] += 1
                 else:
-                    if order['transactions']:
+                    if executed:
                         nd[p - low_p, 0] += 1
                     else:
                         nd[p - low_p, 2] += 1
@@ -164,7 +163,7 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
         # Do our special stuff.
         if self.state == 'AWAITING_STREAM':
             # We were waiting to receive the recent order stream.
-            if msg.body['msg'] == 'QUERY_ORDER_STREAM':
+            if msg.body['msg'] == 'QUERY_ORDER_STREAM_UPDATES':
                 # This is what we were waiting for.
 
                 # But if the market is now closed, don't advance.
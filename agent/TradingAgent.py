@@ -3,6 +3,8 @@ from agent.ExchangeAgent import ExchangeAgent
 from message.Message import Message
 from util.order.LimitOrder import LimitOrder
 from util.order.MarketOrder import MarketOrder
+from util.MarketDataDelta import BookMirror
+from util.OrderHistory import OrderStreamWindow
 from util.util import log_print
 
 from copy import deepcopy
@@ -73,11 +75,31 @@ class TradingAgent(FinancialAgent):
     self.known_bids = {}
     self.known_asks = {}
 
+    # The last known total bid and ask volume near the inside, as (bid, ask), from a response to QUERY_LIQUIDITY.
+    self.known_liquidity = {}
+
+    # Local copies of the book for each symbol with a delta market data subscription.
+    self.book_mirrors = {}
+
+    # The replacement requested for each order with a REPLACE_ORDER awaiting the exchange's reply, by order id.
+    self.pending_replaces = {}
+
+    # The ids of orders with a CANCEL_ORDER awaiting the exchange's ORDER_CANCELLED (or their final execution).
+    self.pending_cancels = set()
+
+    # When each pending QUERY_OPEN_ORDERS request was sent, by the request id the exchange echoes in its reply,
+    # and the id of the next request.
+    self.open_orders_query_time = {}
+    self.next_open_orders_request_id = 0
+
     # The agent remembers the order history communicated by the exchange
     # when such is requested by an agent (for example, a heuristic belief
     # learning agent).
     self.stream_history = {}
 
+    # Local copies of the order history for each symbol queried with getOrderStreamUpdates.
+    self.order_stream_windows = {}
+
     # The agent records the total transacted volume in the exchange for a given symbol and lookback period
     self.transacted_volume = {}
 
@@ -167,10 +189,14 @@ class TradingAgent(FinancialAgent):
     # the market open and closed times, and is the market not already closed.
     return (self.mkt_open and self.mkt_close) and not self.mkt_closed
 
-  def requestDataSubscription(self, symbol, levels, freq):
+  # Used by any Trading Agent subclass to subscribe to market data from the Exchange Agent.  With delta=True, the
+  # exchange sends only the levels that changed since the previous update (with a full refresh every refresh
+  # messages), which are applied to a local mirror of the book so known_bids and known_asks stay current.
+  def requestDataSubscription(self, symbol, levels, freq, delta=False, refresh=100):
       self.sendMessage(recipientID = self.exchangeID,
                        msg = Message({"msg": "MARKET_DATA_SUBSCRIPTION_REQUEST",
-                                      "sender": self.id, "symbol": symbol, "levels": levels, "freq": freq}))
+                                      "sender": self.id, "symbol": symbol, "levels": levels, "freq": freq,
+                                      "delta": delta, "refresh": refresh}))
 
   # Used by any Trading Agent subclass to cancel subscription to market data from the Exchange Agent
   def cancelDataSubscription(self, symbol):
@@ -199,10 +225,10 @@ class TradingAgent(FinancialAgent):
     elif msg.body['msg'] == "ORDER_EXECUTED":
       # Call the orderExecuted method, which subclasses should extend.  This parent
       # class could implement default "portfolio tracking" or "returns tracking"
-      # behavior.
+      # behavior.  An exchange aggregating execution reports also attaches the individual fills.
       order = msg.body['order']
 
-      self.orderExecuted(order)
+      self.orderExecuted(order, msg.body.get('fills'))
 
     elif msg.body['msg'] == "ORDER_ACCEPTED":
       # Call the orderAccepted method, which subclasses should extend.
@@ -210,12 +236,30 @@ class TradingAgent(FinancialAgent):
 
       self.orderAccepted(order)
 
+    elif msg.body['msg'] == "BATCH_ORDER_ACCEPTED":
+      # A batched acknowledgement covers every accepted order of a BATCH_ORDER.
+      for order in msg.body['orders']:
+        self.orderAccepted(order)
+
     elif msg.body['msg'] == "ORDER_CANCELLED":
       # Call the orderCancelled method, which subclasses should extend.
       order = msg.body['order']
 
       self.orderCancelled(order)
 
+    elif msg.body['msg'] == "ORDER_REPLACED":
+      # Call the orderReplaced method, which subclasses may extend.
+      self.orderReplaced(msg.body['old_order'], msg.body['new_order'])
+
+    elif msg.body['msg'] == "ORDER_REPLACE_REJECTED":
+      # Call the orderReplaceRejected method, which subclasses may extend.
+      self.orderReplaceRejected(msg.body['order'], msg.body['new_order'], msg.body['resting'])
+
+    elif msg.body['msg'] == "ORDERS_CANCELLED":
+      # An aggregated report of the orders cancelled by a CANCEL_ALL request.
+      for order in msg.body['orders']:
+        self.orderCancelled(order)
+
     elif msg.body['msg'] == "MKT_CLOSED":
       # We've tried to ask the exchange for something after it closed.  Remember this
       # so we stop asking for things that can't happen.
@@ -236,6 +280,14 @@ class TradingAgent(FinancialAgent):
 
       self.querySpread(msg.body['symbol'], msg.body['data'], msg.body['bids'], msg.body['asks'], msg.body['book'])
 
+    elif msg.body['msg'] == 'QUERY_LIQUIDITY':
+      # Call the queryLiquidity method, which subclasses may extend.
+      # Also note if the market is closed.
+      if msg.body['mkt_closed']: self.mkt_closed = True
+
+      self.queryLiquidity(msg.body['symbol'], msg.body['data'], msg.body['bid_liquidity'], msg.body['ask_liquidity'],
+                          msg.body['bids'], msg.body['asks'])
+
     elif msg.body['msg'] == 'QUERY_ORDER_STREAM':
       # Call the queryOrderStream method, which subclasses may extend.
       # Also note if the market is closed.
@@ -243,10 +295,21 @@ class TradingAgent(FinancialAgent):
 
       self.queryOrderStream(msg.body['symbol'], msg.body['orders'])
 
+    elif msg.body['msg'] == 'QUERY_ORDER_STREAM_UPDATES':
+      # Call the queryOrderStreamUpdates method, which subclasses may extend.
+      # Also note if the market is closed.
+      if msg.body['mkt_closed']: self.mkt_closed = True
+
+      self.queryOrderStreamUpdates(msg.body['symbol'], msg.body['length'], msg.body['update'])
+
     elif msg.body['msg'] == 'QUERY_TRANSACTED_VOLUME':
       if msg.body['mkt_closed']: self.mkt_closed = True
       self.query_transacted_volume(msg.body['symbol'], msg.body['transacted_volume'])
 
+    elif msg.body['msg'] == 'QUERY_OPEN_ORDERS':
+      if msg.body['mkt_closed']: self.mkt_closed = True
+      self.queryOpenOrders(msg.body['symbol'], msg.body['orders'], msg.body.get('request_id'))
+
     elif msg.body['msg'] == 'MARKET_DATA':
       self.handleMarketData(msg)
 
@@ -278,11 +341,40 @@ class TradingAgent(FinancialAgent):
                                                 "symbol" : symbol, "depth" : depth }))
 
 
+  # Used by any Trading Agent subclass to query the total bid and ask volume within some distance of the
+  # inside for a symbol, without fetching the book depth.  The distance is in cents, or a proportion of the
+  # best price if relative (as for getKnownLiquidity), or None for the whole book.  A list of distances
+  # returns a list of volumes per side.  This activity is not logged.
+  def getCurrentLiquidity (self, symbol, within=None, relative=False):
+    self.sendMessage(self.exchangeID, Message({ "msg" : "QUERY_LIQUIDITY", "sender": self.id,
+                                                "symbol" : symbol, "within" : within, "relative" : relative }))
+
+
   # Used by any Trading Agent subclass to query the recent order stream for a symbol.
   def getOrderStream (self, symbol, length=1):
     self.sendMessage(self.exchangeID, Message({ "msg" : "QUERY_ORDER_STREAM", "sender": self.id,
                                                 "symbol" : symbol, "length" : length }))
 
+  # Used by any Trading Agent subclass to keep a local copy of the recent order stream for a symbol: the exchange
+  # sends only what changed since the previous such request.  The reply is handled by queryOrderStreamUpdates.
+  def getOrderStreamUpdates (self, symbol, length=1):
+    window = self.order_stream_windows.get(symbol)
+    if window is not None and window.length != length: window = None
+    self.sendMessage(self.exchangeID, Message({ "msg" : "QUERY_ORDER_STREAM_UPDATES", "sender": self.id,
+                                                "symbol" : symbol, "length" : length,
+                                                "last_trade_seq" : window.trade_seq if window else None,
+                                                "last_fill_seq" : window.fill_seq if window else None }))
+
+  # Used by any Trading Agent subclass to ask the exchange which of its orders are still resting, for one
+  # symbol or (if None) all symbols.  The reply is handled by queryOpenOrders.
+  def getOpenOrders (self, symbol=None):
+    request_id = self.next_open_orders_request_id
+    self.next_open_orders_request_id += 1
+
+    self.open_orders_query_time[request_id] = self.currentTime
+    self.sendMessage(self.exchangeID, Message({ "msg" : "QUERY_OPEN_ORDERS", "sender": self.id,
+                                                "symbol" : symbol, "request_id" : request_id }))
+
   def get_transacted_volume(self, symbol, lookback_period='10min'):
     """ Used by any trading agent subclass to query the total transacted volume in a given lookback period """
     self.sendMessage(self.exchangeID, Message({ "msg": "QUERY_TRANSACTED_VOLUME", "sender": self.id,
@@ -293,6 +385,33 @@ class TradingAgent(FinancialAgent):
   # The call may optionally specify an order_id (otherwise global autoincrement is used) and
   # whether cash or risk limits should be enforced or ignored for the order.
   def placeLimitOrder (self, symbol, quantity, is_buy_order, limit_price, order_id=None, ignore_risk = True, tag = None):
+    order = self.createLimitOrder(symbol, quantity, is_buy_order, limit_price, order_id, ignore_risk, tag)
+
+    if order is not None:
+      self.sendMessage(self.exchangeID, Message({ "msg" : "LIMIT_ORDER", "sender": self.id,
+                                                  "order" : order }))
+
+  # Used by any Trading Agent subclass to place several limit orders at once, e.g. a ladder of quotes.  Each item
+  # of orders is a tuple of the leading arguments of placeLimitOrder: (symbol, quantity, is_buy_order, limit_price)
+  # optionally followed by order_id and tag.  The orders are sent in a single BATCH_ORDER message, which the exchange
+  # processes in one pass, acknowledging them all with a single BATCH_ORDER_ACCEPTED message.
+  def placeLimitOrders (self, orders, ignore_risk = True):
+    batch = []
+    for args in orders:
+      symbol, quantity, is_buy_order, limit_price = args[:4]
+      order_id = args[4] if len(args) > 4 else None
+      tag = args[5] if len(args) > 5 else None
+
+      order = self.createLimitOrder(symbol, quantity, is_buy_order, limit_price, order_id, ignore_risk, tag)
+      if order is not None: batch.append(order)
+
+    if batch:
+      self.sendMessage(self.exchangeID, Message({ "msg" : "BATCH_ORDER", "sender": self.id,
+                                                  "orders" : batch }))
+
+  # Creates a limit order and records it as an open order, unless it has zero quantity or (when not ignoring
+  # risk) would exceed our at-risk limits, in which case None is returned.  The caller sends it to the exchange.
+  def createLimitOrder (self, symbol, quantity, is_buy_order, limit_price, order_id=None, ignore_risk = True, tag = None):
     order = LimitOrder(self.id, self.currentTime, symbol, quantity, is_buy_order, limit_price, order_id, tag)
 
     if quantity > 0:
@@ -312,7 +431,7 @@ class TradingAgent(FinancialAgent):
 
         if (new_at_risk > at_risk) and (new_at_risk > self.starting_cash):
           log_print ("TradingAgent ignored limit order due to at-risk constraints: {}\n{}", order, self.fmtHoldings(self.holdings))
-          return
+          return None
 
       # Copy the intended order for logging, so any changes made to it elsewhere
       # don't retroactively alter our "as placed" log of the order.  Eventually
@@ -320,14 +439,15 @@ class TradingAgent(FinancialAgent):
       # objects inside the order (we're halfway there) so there CAN be just a single
       # object per order, that never alters its original state, and eliminate all these copies.
       self.orders[order.order_id] = deepcopy(order)
-      self.sendMessage(self.exchangeID, Message({ "msg" : "LIMIT_ORDER", "sender": self.id,
-                                                  "order" : order })) 
 
       # Log this activity.
       if self.log_orders: self.logEvent('ORDER_SUBMITTED', order.to_dict())
 
+      return order
+
     else:
       log_print ("TradingAgent ignored limit order of quantity zero: {}", order)
+      return None
 
   def placeMarketOrder(self, symbol, quantity, is_buy_order, order_id=None, ignore_risk = True, tag=None):
     """
@@ -367,6 +487,7 @@ class TradingAgent(FinancialAgent):
     """Used by any Trading Agent subclass to cancel any order.  The order must currently
     appear in the agent's open orders list."""
     if isinstance(order, LimitOrder):
+      self.pending_cancels.add(order.order_id)
       self.sendMessage(self.exchangeID, Message({"msg": "CANCEL_ORDER", "sender": self.id,
                                                  "order": order}))
       # Log this activity.
@@ -374,6 +495,31 @@ class TradingAgent(FinancialAgent):
     else:
       log_print("order {} of type, {} cannot be cancelled", order, type(order))
 
+  def cancelAll(self, symbol=None, is_buy_order=None):
+    """Used by any Trading Agent subclass to cancel all of its orders resting at the exchange, or only those for
+    symbol and/or on one side (is_buy_order True for bids, False for asks).  The exchange confirms with a single
+    ORDERS_CANCELLED message, and orderCancelled is called for each cancelled order."""
+    self.sendMessage(self.exchangeID, Message({"msg": "CANCEL_ALL", "sender": self.id, "symbol": symbol,
+                                               "is_buy_order": is_buy_order}))
+    # Log this activity.
+    if self.log_orders: self.logEvent('CANCEL_ALL_SUBMITTED', {'symbol': symbol, 'is_buy_order': is_buy_order})
+
+  def replaceOrder (self, order, quantity=None, limit_price=None):
+    """ Used by any Trading Agent subclass to atomically change the open quantity and/or limit price of one of its
+        resting limit orders, keeping its order id.  Reducing the size at the same price keeps the order's time
+        priority; any other change sends it to the back of the queue at the new price.  The agent receives
+        ORDER_REPLACED (see orderReplaced) once the exchange has applied the change, or ORDER_REPLACE_REJECTED (see
+        orderReplaceRejected) if the order was no longer resting.  Until then, the order is in pending_replaces."""
+    new_order = LimitOrder(self.id, self.currentTime, order.symbol, order.quantity if quantity is None else quantity,
+                           order.is_buy_order, order.limit_price if limit_price is None else limit_price,
+                           order_id=order.order_id, tag=order.tag)
+    self.pending_replaces[order.order_id] = new_order
+    self.sendMessage(self.exchangeID, Message({ "msg" : "REPLACE_ORDER", "sender": self.id,
+                                                "order" : order, "new_order" : new_order}))
+
+    # Log this activity.
+    if self.log_orders: self.logEvent('REPLACE_SUBMITTED', new_order.to_dict())
+
   def modifyOrder (self, order, newOrder):
     """ Used by any Trading Agent subclass to modify any existing limit order.  The order must currently
         appear in the agent's open orders list.  Some additional tests might be useful here
@@ -386,8 +532,10 @@ class TradingAgent(FinancialAgent):
 
 
   # Handles ORDER_EXECUTED messages from an exchange agent.  Subclasses may wish to extend,
-  # but should still call parent method for basic portfolio/returns tracking.
-  def orderExecuted (self, order):
+  # but should still call parent method for basic portfolio/returns tracking.  If the exchange
+  # aggregated several executions into this report, order holds the total filled quantity at
+  # the VWAP fill price and fills is the list of (quantity, price) tuples actually executed.
+  def orderExecuted (self, order, fills = None):
     log_print ("Received notification of execution for: {}", order)
 
     # Log this activity.
@@ -404,8 +552,13 @@ class TradingAgent(FinancialAgent):
 
     if self.holdings[sym] == 0: del self.holdings[sym]
 
-    # As with everything else, CASH holdings are in CENTS.
-    self.holdings['CASH'] -= (qty * order.fill_price)
+    # As with everything else, CASH holdings are in CENTS.  Aggregated reports are settled fill by
+    # fill, because the VWAP fill price has been rounded to whole cents.
+    if fills is None:
+      self.holdings['CASH'] -= (qty * order.fill_price)
+    else:
+      sign = 1 if order.is_buy_order else -1
+      self.holdings['CASH'] -= sum(sign * q * p for q, p in fills)
     
     # If this original order is now fully executed, remove it from the open orders list.
     # Otherwise, decrement by the quantity filled just now.  It is _possible_ that due
@@ -414,7 +567,9 @@ class TradingAgent(FinancialAgent):
     if order.order_id in self.orders:
       o = self.orders[order.order_id]
 
-      if order.quantity >= o.quantity: del self.orders[order.order_id]
+      if order.quantity >= o.quantity:
+        del self.orders[order.order_id]
+        self.pending_cancels.discard(order.order_id)
       else: o.quantity -= order.quantity
 
     else:
@@ -426,6 +581,36 @@ class TradingAgent(FinancialAgent):
     self.logEvent('HOLDINGS_UPDATED', self.holdings)
 
 
+  # Handles ORDER_REPLACED messages from an exchange agent.  Subclasses may wish to extend.
+  def orderReplaced (self, old_order, new_order):
+    log_print ("Received notification of replacement of {} by {}", old_order, new_order)
+
+    # Log this activity.
+    if self.log_orders: self.logEvent('ORDER_REPLACED', new_order.to_dict())
+
+    # The open order now has the new price and open quantity reported by the exchange.
+    self.pending_replaces.pop(new_order.order_id, None)
+    self.orders[new_order.order_id] = new_order
+
+
+  # Handles ORDER_REPLACE_REJECTED messages from an exchange agent.  Subclasses may wish to extend.  resting is
+  # the order as it is resting at the exchange, or None if it is no longer resting (it was filled or cancelled,
+  # which the agent has already been told of).
+  def orderReplaceRejected (self, order, new_order, resting):
+    log_print ("Received notification of rejected replacement of {} by {}", order, new_order)
+
+    # Log this activity.
+    if self.log_orders: self.logEvent('ORDER_REPLACE_REJECTED', new_order.to_dict())
+
+    # Bring the open orders list in line with the exchange.
+    self.pending_replaces.pop(order.order_id, None)
+    if resting is not None:
+      self.orders[resting.order_id] = resting
+    else:
+      self.pending_cancels.discard(order.order_id)
+      if order.order_id in self.orders: del self.orders[order.order_id]
+
+
   # Handles ORDER_ACCEPTED messages from an exchange agent.  Subclasses may wish to extend.
   def orderAccepted (self, order):
     log_print ("Received notification of acceptance for: {}", order)
@@ -448,6 +633,7 @@ class TradingAgent(FinancialAgent):
     # Remove the cancelled order from the open orders list.  We may of course wish to have
     # additional logic here later, so agents can easily "look for" cancelled orders.  Of
     # course they can just override this method.
+    self.pending_cancels.discard(order.order_id)
     if order.order_id in self.orders:
       del self.orders[order.order_id]
     else:
@@ -500,13 +686,32 @@ class TradingAgent(FinancialAgent):
 
     self.book = book
 
+  # Handles QUERY_LIQUIDITY messages from an exchange agent.  The response also carries the last trade
+  # price and the inside bid and ask, which replace the known bids and asks as a depth 1 spread would.
+  def queryLiquidity (self, symbol, price, bid_liquidity, ask_liquidity, bids, asks):
+    self.queryLastTrade(symbol, price)
+
+    self.known_bids[symbol] = bids
+    self.known_asks[symbol] = asks
+    self.known_liquidity[symbol] = (bid_liquidity, ask_liquidity)
+
+    log_print ("Received liquidity of {} / {} for {}", bid_liquidity, ask_liquidity, symbol)
+
   def handleMarketData(self, msg):
     '''
     Handles Market Data messages for agents using subscription mechanism
     '''
     symbol = msg.body['symbol']
-    self.known_asks[symbol] = msg.body['asks']
-    self.known_bids[symbol] = msg.body['bids']
+    if msg.body.get('delta'):
+      mirror = self.book_mirrors.setdefault(symbol, BookMirror())
+      if not mirror.apply(msg.body):
+        log_print("{} missed a market data update for {}, awaiting refresh", self.name, symbol)
+        return
+      self.known_asks[symbol] = mirror.getAsks()
+      self.known_bids[symbol] = mirror.getBids()
+    else:
+      self.known_asks[symbol] = msg.body['asks']
+      self.known_bids[symbol] = msg.body['bids']
     self.last_trade[symbol] = msg.body['last_transaction']
     self.exchange_ts[symbol] = msg.body['exchange_ts']
 
@@ -519,6 +724,36 @@ class TradingAgent(FinancialAgent):
     # trade).
     self.stream_history[self.symbol] = orders
 
+  # Handles QUERY_ORDER_STREAM_UPDATES messages from an exchange agent.  The update is applied to the local
+  # copy of the order history, and the stream history is then a list (index 0 for the orders that led up to the
+  # most recent trade, and so on) of dictionaries from order id to [is_buy_order, limit_price, quantity,
+  # executed quantity].
+  def queryOrderStreamUpdates (self, symbol, length, update):
+    window = self.order_stream_windows.get(symbol)
+    if window is None or window.length != length:
+      window = self.order_stream_windows[symbol] = OrderStreamWindow(length)
+
+    window.apply(update)
+    self.stream_history[symbol] = window.getHistory()
+
+  # Handles QUERY_OPEN_ORDERS messages from an exchange agent.  By default, the open orders list is reconciled
+  # with the exchange: for the queried symbol (or all symbols), orders placed before the query are replaced by
+  # the orders actually resting, which repairs state after missed cancel/execute races.  Orders placed since the
+  # query was sent are kept, as the exchange may not have received them yet.  request_id identifies the query
+  # being answered, so overlapping queries are each reconciled against their own send time.  Subclasses may extend.
+  def queryOpenOrders (self, symbol, orders, request_id = None):
+    query_time = self.open_orders_query_time.pop(request_id, None)
+    stale = [order_id for order_id, order in self.orders.items() if (symbol is None or order.symbol == symbol)
+             and (query_time is None or order.time_placed < query_time)]
+    resting = {order.order_id: order for order in orders}
+
+    removed = [order_id for order_id in stale if order_id not in resting]
+    if removed: log_print ("Open orders not resting at the exchange, removed: {}", removed)
+
+    for order_id in stale: del self.orders[order_id]
+    self.orders.update(resting)
+    self.pending_cancels.intersection_update(self.orders)
+
   def query_transacted_volume(self, symbol, transacted_volume):
     """ Handles the QUERY_TRANSACTED_VOLUME messages from the exchange agent"""
     self.transacted_volume[symbol] = transacted_volume
@@ -249,8 +249,7 @@ class ValueAgent(TradingAgent):
     def cancelOrders(self):
         if not self.orders: return False
 
-        for id, order in self.orders.items():
-            self.cancelOrder(order)
+        self.cancelAll(self.symbol)
 
         return True
 
@@ -90,9 +90,9 @@ class QLearningAgent(TradingAgent):
     # Cancel unfilled orders (but don't exit positions).
     self.cancelOrders()
 
-    # Get the order book or whatever else we need for the state.
-    self.getCurrentSpread(self.symbol, depth=1000)
-    self.state = 'AWAITING_SPREAD'
+    # Get the order book volume (and inside quote) we need for the state.
+    self.getCurrentLiquidity(self.symbol)
+    self.state = 'AWAITING_LIQUIDITY'
 
 
 
@@ -100,8 +100,7 @@ class QLearningAgent(TradingAgent):
     # Called when it is time for the agent to determine a limit price and place an order.
 
     # Compute the order imbalance feature.
-    bid_vol = sum([ v[1] for v in self.known_bids[self.symbol] ])
-    ask_vol = sum([ v[1] for v in self.known_asks[self.symbol] ])
+    bid_vol, ask_vol = self.known_liquidity[self.symbol]
     imba = bid_vol - ask_vol
 
     # A unit of stock is now 100 shares instead of one.
@@ -179,12 +178,12 @@ class QLearningAgent(TradingAgent):
     # If our internal state indicates we were waiting for a particular event,
     # check if we can transition to a new state.
 
-    if self.state == 'AWAITING_SPREAD':
-      # We were waiting to receive the current spread/book.  Since we don't currently
+    if self.state == 'AWAITING_LIQUIDITY':
+      # We were waiting to receive the current book volume.  Since we don't currently
       # track timestamps on retained information, we rely on actually seeing a
-      # QUERY_SPREAD response message.
+      # QUERY_LIQUIDITY response message.
 
-      if msg.body['msg'] == 'QUERY_SPREAD':
+      if msg.body['msg'] == 'QUERY_LIQUIDITY':
         # This is what we were waiting for.
 
         # But if the market is now closed, don't advance to placing orders.
@@ -9,11 +9,13 @@ class SubscriptionAgent(TradingAgent):
     Simple agent to demonstrate subscription to order book market data.
     """
 
-    def __init__(self, id, name, type, symbol, starting_cash, levels, freq, log_orders=False, random_state=None):
+    def __init__(self, id, name, type, symbol, starting_cash, levels, freq, delta=False, log_orders=False,
+                 random_state=None):
         super().__init__(id, name, type, starting_cash=starting_cash, log_orders=log_orders, random_state=random_state)
         self.symbol = symbol  # symbol traded
         self.levels = levels  # number of price levels to subscribe to/recieve updates for
         self.freq = freq  # minimum number of nanoseconds between market data messages
+        self.delta = delta  # receive only the changed price levels (incremental feed) instead of full snapshots
         self.subscribe = True  # Flag to determine whether to subscribe to data or use polling mechanism
         self.subscription_requested = False
         self.last_update_ts = None  # timestamp of the last agent update.
@@ -28,14 +30,14 @@ class SubscriptionAgent(TradingAgent):
     def wakeup(self, currentTime):
         super().wakeup(currentTime)
         if self.subscribe and not self.subscription_requested:
-            super().requestDataSubscription(self.symbol, levels=self.levels, freq=self.freq)
+            super().requestDataSubscription(self.symbol, levels=self.levels, freq=self.freq, delta=self.delta)
             self.subscription_requested = True
             self.last_update_ts = currentTime
 
     def receiveMessage(self, currentTime, msg):
         super().receiveMessage(currentTime, msg)
         if self.subscribe and self.state == 'AWAITING_MARKET_DATA' and msg.body['msg'] == 'MARKET_DATA':
-            bids, asks = msg.body['bids'], msg.body['asks']
+            bids, asks = self.known_bids[self.symbol], self.known_asks[self.symbol]
             log_print("--------------------")
             log_print("seconds elapsed since last update: {}", (currentTime - self.last_update_ts).delta / 1e9)
             log_print("number of bid levels: {}", len(bids))
@@ -50,7 +50,7 @@ class ExecutionAgent(TradingAgent):
             except IndexError:
                 pass
 
-            self.getCurrentSpread(self.symbol, depth=1000)
+            self.getCurrentSpread(self.symbol, depth=1)
             self.state = 'AWAITING_SPREAD'
 
     def receiveMessage(self, currentTime, msg):
@@ -99,8 +99,7 @@ class ExecutionAgent(TradingAgent):
             log_print('[---- {} - {} ----]: LIMIT ORDER PLACED - {} @ {}'.format(self.name, currentTime, qty, price))
 
     def cancelOrders(self):
-        for _, order in self.orders.items():
-            self.cancelOrder(order)
+        if self.orders: self.cancelAll(self.symbol)
 
     def getWakeFrequency(self):
         return self.execution_time_horizon[0] - self.mkt_open
\ No newline at end of file
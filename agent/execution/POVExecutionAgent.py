@@ -1,4 +1,3 @@
-import sys
 import warnings
 import pandas as pd
 
@@ -43,7 +42,7 @@ class POVExecutionAgent(TradingAgent):
         if not can_trade: return
         if self.trade and self.rem_quantity > 0 and self.start_time < currentTime < self.end_time:
             self.cancelOrders()
-            self.getCurrentSpread(self.symbol, depth=sys.maxsize)
+            self.getCurrentSpread(self.symbol, depth=1)
             self.get_transacted_volume(self.symbol, lookback_period=self.look_back_period)
             self.state = 'AWAITING_TRANSACTED_VOLUME'
 
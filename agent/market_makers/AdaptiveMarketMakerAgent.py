@@ -28,7 +28,7 @@ class AdaptiveMarketMakerAgent(TradingAgent):
 
     def __init__(self, id, name, type, symbol, starting_cash, pov=0.05, min_order_size=20, window_size=5, anchor=ANCHOR_MIDDLE_STR,
                  num_ticks=20, level_spacing=0.5, wake_up_freq='1s', subscribe=False, subscribe_freq=10e9, subscribe_num_levels=1, cancel_limit_delay=50,
-                 skew_beta=0, spread_alpha=0.85, backstop_quantity=None, log_orders=False, random_state=None):
+                 skew_beta=0, spread_alpha=0.85, backstop_quantity=None, requote=False, log_orders=False, random_state=None):
 
         super().__init__(id, name, type, starting_cash=starting_cash, log_orders=log_orders, random_state=random_state)
         self.is_adaptive = False
@@ -50,6 +50,7 @@ class AdaptiveMarketMakerAgent(TradingAgent):
         self.skew_beta = skew_beta  # parameter for determining order placement imbalance
         self.spread_alpha = spread_alpha  # parameter for exponentially weighted moving average of spread. 1 corresponds to ignoring old values, 0 corresponds to no updates
         self.backstop_quantity = backstop_quantity  # how many orders to place at outside order level, to prevent liquidity dropouts. If None then place same as at other levels.
+        self.requote = requote  # if True, only send the cancels, replaces and new orders that turn the resting ladder into the new one, instead of cancelling and re-placing the whole ladder each wake
         self.log_orders = log_orders
 
         ## Internal variables
@@ -120,7 +121,7 @@ class AdaptiveMarketMakerAgent(TradingAgent):
             self.state = self.initialiseState()
 
         elif can_trade and not self.subscribe:
-            self.cancelAllOrders()
+            if not self.requote: self.cancelAllOrders()
             self.delay(self.cancel_limit_delay)
             self.getCurrentSpread(self.symbol, depth=self.subscribe_num_levels)
             self.get_transacted_volume(self.symbol, lookback_period=self.wake_up_freq)
@@ -260,25 +261,71 @@ class AdaptiveMarketMakerAgent(TradingAgent):
         """
 
         bid_orders, ask_orders = self.computeOrdersToPlace(mid)
+        orders = []
 
         if self.backstop_quantity is not None:
             bid_price = bid_orders[0]
             log_print('{}: Placing BUY limit order of size {} @ price {}', self.name, self.backstop_quantity, bid_price)
-            self.placeLimitOrder(self.symbol, self.backstop_quantity, True, bid_price)
+            orders.append((self.symbol, self.backstop_quantity, True, bid_price))
             bid_orders = bid_orders[1:]
 
             ask_price = ask_orders[-1]
             log_print('{}: Placing SELL limit order of size {} @ price {}', self.name, self.backstop_quantity, ask_price)
-            self.placeLimitOrder(self.symbol, self.backstop_quantity, False, ask_price)
+            orders.append((self.symbol, self.backstop_quantity, False, ask_price))
             ask_orders = ask_orders[:-1]
 
         for bid_price in bid_orders:
             log_print('{}: Placing BUY limit order of size {} @ price {}', self.name, self.buy_order_size, bid_price)
-            self.placeLimitOrder(self.symbol, self.buy_order_size, True, bid_price)
+            orders.append((self.symbol, self.buy_order_size, True, bid_price))
 
         for ask_price in ask_orders:
             log_print('{}: Placing SELL limit order of size {} @ price {}', self.name, self.sell_order_size, ask_price)
-            self.placeLimitOrder(self.symbol, self.sell_order_size, False, ask_price)
+            orders.append((self.symbol, self.sell_order_size, False, ask_price))
+
+        # Send the whole ladder to the exchange as a single batch, or only the changes to the resting ladder.
+        if self.requote: self.requoteOrders(orders)
+        else: self.placeLimitOrders(orders)
+
+    def requoteOrders(self, orders):
+        """ Diffs the desired ladder against the resting orders in self.orders and sends only the messages needed to
+            turn one into the other.  Resting orders at a desired price with the desired size are left alone, those
+            at a desired price with another size are resized, and those at prices no longer wanted are moved to the
+            new prices (with REPLACE_ORDER).  Any remaining resting orders are cancelled and any remaining new prices
+            are placed in a single batch.  Orders with a replacement still awaiting the exchange's reply are left
+            alone until it arrives, and hold the price they are being moved to.  Orders already being cancelled are
+            skipped.
+
+            :param orders: desired orders, as tuples (symbol, quantity, is_buy_order, limit_price)
+            :type orders: list
+        """
+        new_orders = []
+
+        for is_buy_order in (True, False):
+            desired = {price: quantity for symbol, quantity, is_buy, price in orders if is_buy == is_buy_order}
+
+            stale = []
+            for order in list(self.orders.values()):
+                if order.symbol != self.symbol or order.is_buy_order != is_buy_order: continue
+                if order.order_id in self.pending_cancels: continue
+                if order.order_id in self.pending_replaces:
+                    desired.pop(self.pending_replaces[order.order_id].limit_price, None)
+                    continue
+                quantity = desired.pop(order.limit_price, None)
+                if quantity is None:
+                    stale.append(order)
+                elif quantity != order.quantity:
+                    self.replaceOrder(order, quantity=quantity)
+
+            # Move stale orders to the new prices, nearest the inside first, then cancel or add the remainder.
+            levels = sorted(desired.items(), reverse=is_buy_order)
+            for order, (price, quantity) in zip(stale, levels):
+                self.replaceOrder(order, quantity=quantity, limit_price=price)
+            for order in stale[len(levels):]:
+                self.cancelOrder(order)
+            new_orders.extend((self.symbol, quantity, is_buy_order, price) for price, quantity in levels[len(stale):])
+
+        log_print('{}: requote sends {} new orders', self.name, len(new_orders))
+        self.placeLimitOrders(new_orders)
 
     def getWakeFrequency(self):
         """ Get time increment corresponding to wakeup period. """
@@ -286,5 +333,4 @@ class AdaptiveMarketMakerAgent(TradingAgent):
 
     def cancelAllOrders(self):
         """ Cancels all resting limit orders placed by the market maker """
-        for _, order in self.orders.items():
-            self.cancelOrder(order)
+        if self.orders: self.cancelAll(self.symbol)
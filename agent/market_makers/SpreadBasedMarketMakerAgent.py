@@ -231,13 +231,17 @@ class SpreadBasedMarketMakerAgent(TradingAgent):
         """
 
         bid_orders, ask_orders = self.computeOrdersToPlace(mid)
+        orders = []
         for bid_order in bid_orders:
             log_print(f'{self.name}: Placing BUY limit order of size {self.order_size} @ price {bid_order.price}')
-            self.placeLimitOrder(self.symbol, self.order_size, True, bid_order.price, order_id=bid_order.id)
+            orders.append((self.symbol, self.order_size, True, bid_order.price, bid_order.id))
 
         for ask_order in ask_orders:
             log_print(f'{self.name}: Placing SELL limit order of size {self.order_size} @ price {ask_order.price}')
-            self.placeLimitOrder(self.symbol, self.order_size, False, ask_order.price, order_id=ask_order.id)
+            orders.append((self.symbol, self.order_size, False, ask_order.price, ask_order.id))
+
+        # Send all new quotes to the exchange as a single batch.
+        self.placeLimitOrders(orders)
 
     def initialiseBidsAsksDeques(self, mid):
         """ Initialise the current_bids and current_asks object attributes, which internally keep track of the limit
@@ -11,6 +11,7 @@ from util.order import LimitOrder
 from util.oracle.SparseMeanRevertingOracle import SparseMeanRevertingOracle
 from util.oracle.ExternalFileOracle import ExternalFileOracle
 from model.LatencyModel import LatencyModel
+from model.LatencyTopology import LineTopology
 
 from agent.ExchangeAgent import ExchangeAgent
 from agent.NoiseAgent import NoiseAgent
@@ -312,9 +313,9 @@ pairwise = (agent_count, agent_count)
 
 # All agents sit on line from Seattle to NYC
 nyc_to_seattle_meters = 3866660
-pairwise_distances = util.generate_uniform_random_pairwise_dist_on_line(0.0, nyc_to_seattle_meters, agent_count,
-                                                                        random_state=latency_rstate)
-pairwise_latencies = util.meters_to_light_ns(pairwise_distances)
+agent_positions = util.generate_uniform_random_points_on_line(0.0, nyc_to_seattle_meters, agent_count,
+                                                              random_state=latency_rstate)
+pairwise_latencies = LineTopology(agent_positions)
 
 model_args = {
     'connected': True,
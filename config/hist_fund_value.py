@@ -10,6 +10,7 @@ from util import util
 from util.order import LimitOrder
 from util.oracle.ExternalFileOracle import ExternalFileOracle
 from model.LatencyModel import LatencyModel
+from model.LatencyTopology import LineTopology
 
 from agent.ExchangeAgent import ExchangeAgent
 from agent.NoiseAgent import NoiseAgent
@@ -52,6 +53,13 @@ parser.add_argument('-v',
 parser.add_argument('--config_help',
                     action='store_true',
                     help='Print argument options for this config file')
+parser.add_argument('--fundamental-log-policy',
+                    choices=['all', 'dedup', 'decimate'],
+                    default='all',
+                    help='Which fundamental values to log: all, deduplicated by time or decimated to a grid')
+parser.add_argument('--fundamental-log-freq',
+                    default='1s',
+                    help='Grid frequency of the decimate fundamental log policy')
 
 args, remaining_args = parser.parse_known_args()
 
@@ -93,7 +101,7 @@ symbols = {
         'random_state': np.random.RandomState(seed=np.random.randint(low=0, high=2 ** 32, dtype='uint64'))
     }
 }
-oracle = ExternalFileOracle(symbols)
+oracle = ExternalFileOracle(symbols, log_policy=args.fundamental_log_policy, log_freq=args.fundamental_log_freq)
 
 r_bar = oracle.fundamentals[symbol].values[0]
 sigma_n = r_bar / 10
@@ -164,9 +172,9 @@ pairwise = (agent_count, agent_count)
 
 # All agents sit on line from Seattle to NYC
 nyc_to_seattle_meters = 3866660
-pairwise_distances = util.generate_uniform_random_pairwise_dist_on_line(0.0, nyc_to_seattle_meters, agent_count,
-                                                                        random_state=latency_rstate)
-pairwise_latencies = util.meters_to_light_ns(pairwise_distances)
+agent_positions = util.generate_uniform_random_points_on_line(0.0, nyc_to_seattle_meters, agent_count,
+                                                              random_state=latency_rstate)
+pairwise_latencies = LineTopology(agent_positions)
 
 model_args = {
     'connected': True,
@@ -6,12 +6,14 @@ import datetime as dt
 import numpy as np
 
 
-def run_in_parallel(num_simulations, num_parallel, config, log_folder, verbose):
+def run_in_parallel(num_simulations, num_parallel, config, log_folder, verbose, config_args=()):
 
     global_seeds = np.random.randint(0, 2 ** 32, num_simulations)
     print(f'Global Seeds: {global_seeds}')
 
-    processes = [f'python -u abides.py -c {config} -l {log_folder}_seed_{seed} {"-v" if verbose else ""} -s {seed}'
+    # Arguments not recognized here are passed on to the config, e.g. a shared --fundamental-cache.
+    config_args = ' '.join(config_args)
+    processes = [f'python -u abides.py -c {config} -l {log_folder}_seed_{seed} {"-v" if verbose else ""} -s {seed} {config_args}'
                  for seed in global_seeds]
 
     pool = Pool(processes=num_parallel)
@@ -58,7 +60,8 @@ if __name__ == "__main__":
                     num_parallel=num_parallel,
                     config=config,
                     log_folder=log_folder,
-                    verbose=verbose)
+                    verbose=verbose,
+                    config_args=remaining_args)
 
     end_time = dt.datetime.now()
     print(f'Total time taken to run in parallel: {end_time - start_time}')
\ No newline at end of file
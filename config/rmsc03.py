@@ -17,6 +17,7 @@ from Kernel import Kernel
 from util import util
 from util.order import LimitOrder
 from util.oracle.SparseMeanRevertingOracle import SparseMeanRevertingOracle
+from util.oracle.FundamentalPathCache import FundamentalPathCache
 
 from agent.ExchangeAgent import ExchangeAgent
 from agent.NoiseAgent import NoiseAgent
@@ -25,6 +26,7 @@ from agent.market_makers.AdaptiveMarketMakerAgent import AdaptiveMarketMakerAgen
 from agent.examples.MomentumAgent import MomentumAgent
 from agent.execution.POVExecutionAgent import POVExecutionAgent
 from model.LatencyModel import LatencyModel
+from model.LatencyTopology import LineTopology
 
 ########################################################################################################################
 ############################################### GENERAL CONFIG #########################################################
@@ -121,6 +123,27 @@ parser.add_argument('--fund-vol',
                     default=1e-8,
                     help='Volatility of fundamental time series.'
                     )
+parser.add_argument('--oracle-seed',
+                    type=int,
+                    default=None,
+                    help='Seed for the fundamental time series, so that runs with different seeds share one path')
+parser.add_argument('--fundamental-path-freq',
+                    default=None,
+                    help='Precompute the fundamental path at this frequency (e.g. 100ms)')
+parser.add_argument('--fundamental-cache',
+                    default=None,
+                    help='Directory caching precomputed fundamental paths across runs (implies --fundamental-path-freq)')
+parser.add_argument('--fundamental-cache-max-mb',
+                    type=float,
+                    default=None,
+                    help='Size limit of the fundamental path cache, beyond which least recently used paths are evicted')
+parser.add_argument('--fundamental-log-policy',
+                    choices=['all', 'dedup', 'decimate'],
+                    default='all',
+                    help='Which fundamental values to log: all, deduplicated by time or decimated to a grid')
+parser.add_argument('--fundamental-log-freq',
+                    default='1s',
+                    help='Grid frequency of the decimate fundamental log policy')
 
 args, remaining_args = parser.parse_known_args()
 
@@ -162,6 +185,9 @@ kappa = 1.67e-15
 lambda_a = 7e-11
 
 # Oracle
+oracle_seed = np.random.randint(low=0, high=2 ** 32, dtype='uint64')
+if args.oracle_seed is not None: oracle_seed = args.oracle_seed
+
 symbols = {symbol: {'r_bar': r_bar,
                     'kappa': 1.67e-16,
                     'sigma_s': 0,
@@ -169,9 +195,16 @@ symbols = {symbol: {'r_bar': r_bar,
                     'megashock_lambda_a': 2.77778e-18,
                     'megashock_mean': 1e3,
                     'megashock_var': 5e4,
-                    'random_state': np.random.RandomState(seed=np.random.randint(low=0, high=2 ** 32, dtype='uint64'))}}
+                    'random_state': np.random.RandomState(seed=oracle_seed)}}
+
+path_freq, path_cache = args.fundamental_path_freq, None
+if args.fundamental_cache:
+    if path_freq is None: path_freq = '100ms'
+    max_bytes = None if args.fundamental_cache_max_mb is None else int(args.fundamental_cache_max_mb * 2 ** 20)
+    path_cache = FundamentalPathCache(args.fundamental_cache, max_bytes=max_bytes)
 
-oracle = SparseMeanRevertingOracle(mkt_open, mkt_close, symbols)
+oracle = SparseMeanRevertingOracle(mkt_open, mkt_close, symbols, path_freq=path_freq, path_cache=path_cache,
+                                   log_policy=args.fundamental_log_policy, log_freq=args.fundamental_log_freq)
 
 # 1) Exchange Agent
 
@@ -343,9 +376,9 @@ pairwise = (agent_count, agent_count)
 
 # All agents sit on line from Seattle to NYC
 nyc_to_seattle_meters = 3866660
-pairwise_distances = util.generate_uniform_random_pairwise_dist_on_line(0.0, nyc_to_seattle_meters, agent_count,
-                                                                        random_state=latency_rstate)
-pairwise_latencies = util.meters_to_light_ns(pairwise_distances)
+agent_positions = util.generate_uniform_random_points_on_line(0.0, nyc_to_seattle_meters, agent_count,
+                                                              random_state=latency_rstate)
+pairwise_latencies = LineTopology(agent_positions)
 
 model_args = {
     'connected': True,
@@ -1,6 +1,8 @@
 import numpy as np
 import sys
 
+from model.LatencyTopology import LatencyTopology
+
 class LatencyModel:
 
   """
@@ -19,11 +21,15 @@ class LatencyModel:
   pairwise values, row index is the sending agent and column index is the receiving agent.
   These do not have to be symmetric.
   
+  Any parameter that accepts a 2-D numpy array also accepts a LatencyTopology (see model/LatencyTopology.py),
+  which computes the pairwise values on demand from agent coordinates, region membership, or per-agent
+  vectors, rather than storing all N x N of them.  This is recommended for large numbers of agents.
+  
   'connected' must be either scalar True or a 2-D numpy array.  A False array entry prohibits
   communication regardless of values in other parameters.  Boolean.  Default is scalar True.
   
-  'min_latency' requires a 2-D numpy array of pairwise minimum latency.  Integer nanoseconds.
-  No default value.
+  'min_latency' requires a 2-D numpy array (or LatencyTopology) of pairwise minimum latency.  Integer
+  nanoseconds.  No default value.
   
   'jitter' requires a scalar, a 1-D numpy vector, or a 2-D numpy array.  Controls shape of cubic
   curve for per-message additive latency noise.  This is the 'a' parameter in the cubic equation above.
@@ -71,7 +77,7 @@ class LatencyModel:
   """
  
 
-  def __init__(self, latency_model = 'cubic', random_state = None, **kwargs):
+  def __init__(self, latency_model = 'cubic', random_state = None, block_size = 65536, **kwargs):
     """
     Model-specific parameters may be specified as keyword args or a dictionary with key 'kwargs'.
 
@@ -80,10 +86,17 @@ class LatencyModel:
 
     Optional keyword parameters:
       'random_state'  : an initialized np.random.RandomState object.
+      'block_size'    : the number of uniform draws pre-generated at a time for jitter.
+
+    The form of each parameter (scalar, 1-D or 2-D) is resolved here, once, and get_latency is
+    specialized to the forms in use.  Jitter draws are taken from blocks of block_size uniform
+    samples, consumed in order: the n-th message (counting each recipient of get_latencies as
+    one message) uses the n-th sample of random_state, exactly as if it had been drawn alone.
     """
 
     self.latency_model = latency_model.lower()
     self.random_state = random_state
+    self.block_size = block_size
 
     # This permits either keyword args or a dictionary of kwargs.  The two cannot be mixed.
     if 'kwargs' in kwargs: kwargs = kwargs['kwargs']
@@ -91,7 +104,7 @@ class LatencyModel:
     # Check required parameters and apply defaults for the selected model.
     if (latency_model.lower() == 'cubic'):
       if 'min_latency' not in kwargs:
-        print ("Config error: cubic latency model requires parameter 'min_latency' as 2-D ndarray.")
+        print ("Config error: cubic latency model requires parameter 'min_latency' as 2-D ndarray or LatencyTopology.")
         sys.exit()
 
       # Set defaults.
@@ -101,7 +114,7 @@ class LatencyModel:
       kwargs.setdefault('jitter_unit', 10.0)
     elif (latency_model.lower() == 'deterministic'):
       if 'min_latency' not in kwargs:
-        print("Config error: deterministic latency model requires parameter 'min_latency' as 2-D ndarray.")
+        print("Config error: deterministic latency model requires parameter 'min_latency' as 2-D ndarray or LatencyTopology.")
         sys.exit()
     else:
       print (f"Config error: unknown latency model requested ({latency_model.lower()})")
@@ -110,59 +123,158 @@ class LatencyModel:
     # Remember the kwargs for use generating jitter (latency noise).
     self.kwargs = kwargs
 
+    # Pre-generated uniform [0,1) samples for jitter, and the position of the next one to use.
+    self.uniforms = np.empty(0)
+    self.next_uniform = 0
+
+    # Per-pair accessors for each parameter, and the specialized get_latency.
+    self.min_latency = self._accessor(kwargs['min_latency'])
+
+    if self.latency_model == 'deterministic':
+      self.get_latency = self.min_latency
+      return
+
+    self.connected = self._accessor(kwargs['connected'])
+    self.jitter = self._accessor(kwargs['jitter'])
+    self.jitter_clip = self._accessor(kwargs['jitter_clip'])
+    self.jitter_unit = self._accessor(kwargs['jitter_unit'])
+
+    if all(np.isscalar(kwargs[k]) for k in ['connected', 'jitter', 'jitter_clip', 'jitter_unit']):
+      if not kwargs['connected']:
+        self.get_latency = lambda sender_id = None, recipient_id = None: -1
+      else:
+        self.get_latency = self._get_cubic_latency_scalar_jitter
+
   def get_latency(self, sender_id = None, recipient_id = None):
     """
     LatencyModel.get_latency() samples and returns the final latency for a single Message according to the
-    model specified during initialization.
+    model specified during initialization.  (This general version is replaced at initialization by one
+    specialized to the parameters in use, where possible.)
 
     Required parameters:
       'sender_id'    : simulation agent_id for the agent sending the message
       'recipient_id' : simulation agent_id for the agent receiving the message
     """
 
+    min_latency = self.min_latency(sender_id, recipient_id)
+
+    # Generate latency for a single message using the cubic model.
+
+    # If agents cannot communicate in this direction, return special latency -1.
+    if not self.connected(sender_id, recipient_id): return -1
+
+    # Extract the cubic parameters and compute the final latency.
+    a = self.jitter(sender_id, recipient_id)
+    clip = self.jitter_clip(sender_id, recipient_id)
+    unit = self.jitter_unit(sender_id, recipient_id)
+    # Jitter requires a uniform random draw from (clip, 1].
+    x = clip + (1.0 - clip) * self._uniform()
+
+    # Now apply the cubic model to compute jitter and the final message latency.
+    latency = min_latency + ((a / x**3) * (min_latency / unit))
+
+    return latency
+
+  def _get_cubic_latency_scalar_jitter(self, sender_id = None, recipient_id = None):
+    # get_latency for the cubic model when every parameter except min_latency is a scalar.
+    min_latency = self.min_latency(sender_id, recipient_id)
+
+    kw = self.kwargs
+    clip = kw['jitter_clip']
+    x = clip + (1.0 - clip) * self._uniform()
+
+    return min_latency + ((kw['jitter'] / x**3) * (min_latency / kw['jitter_unit']))
+
+  def get_latencies(self, sender_id, recipient_ids):
+    """
+    LatencyModel.get_latencies() samples and returns the final latencies for Messages from one sender to each of
+    several recipients (e.g. a broadcast), as a numpy array.  The latencies are those that the same sequence of
+    get_latency() calls would return.
+
+    Required parameters:
+      'sender_id'     : simulation agent_id for the agent sending the messages
+      'recipient_ids' : sequence of simulation agent_ids of the agents receiving the messages
+    """
+
+    rids = np.asarray(recipient_ids, dtype=np.int64)
     kw = self.kwargs
-    min_latency = self._extract(kw['min_latency'], sender_id, recipient_id)
 
-    if self.latency_model == 'cubic':
-      # Generate latency for a single message using the cubic model.
+    min_latency = self._values(kw['min_latency'], sender_id, rids)
+    if self.latency_model == 'deterministic': return np.broadcast_to(min_latency, rids.shape).copy()
 
-      # If agents cannot communicate in this direction, return special latency -1.
-      if not self._extract( kw['connected'], sender_id, recipient_id ): return -1
+    a = self._values(kw['jitter'], sender_id, rids)
+    clip = self._values(kw['jitter_clip'], sender_id, rids)
+    unit = self._values(kw['jitter_unit'], sender_id, rids)
 
-      # Extract the cubic parameters and compute the final latency.
-      a = self._extract( kw['jitter'], sender_id, recipient_id )
-      clip = self._extract( kw['jitter_clip'], sender_id, recipient_id )
-      unit = self._extract( kw['jitter_unit'], sender_id, recipient_id )
-      # Jitter requires a uniform random draw.
-      x = self.random_state.uniform( low = clip, high = 1.0 )
+    # Jitter draws are consumed by connected pairs only, in recipient order.
+    connected = np.broadcast_to(self._values(kw['connected'], sender_id, rids), rids.shape).astype(bool)
+    u = np.zeros(len(rids))
+    u[connected] = self._uniforms(int(np.count_nonzero(connected)))
 
-      # Now apply the cubic model to compute jitter and the final message latency.
-      latency = min_latency + ((a / x**3) * (min_latency / unit))
+    # The cubes are taken one at a time, as in get_latency: the vectorized power can differ from it in the
+    # last bit, which could shift a delivery time by one nanosecond.
+    x = np.broadcast_to(clip + (1.0 - clip) * u, rids.shape)
+    x3 = np.fromiter((v ** 3 for v in x.tolist()), dtype=float, count=len(rids))
+    with np.errstate(divide='ignore'):
+      latency = min_latency + ((a / x3) * (min_latency / unit))
 
-    elif self.latency_model == 'deterministic':
-      return min_latency
+    return np.where(connected, latency, -1)
 
-    return latency
+  def _uniform(self):
+    # Returns the next pre-generated uniform [0,1) sample, generating a new block if necessary.
+    if self.next_uniform == len(self.uniforms):
+      self.uniforms = self.random_state.random_sample(self.block_size)
+      self.next_uniform = 0
+
+    u = self.uniforms[self.next_uniform]
+    self.next_uniform += 1
+
+    return u
 
+  def _uniforms(self, n):
+    # Returns the next n pre-generated uniform [0,1) samples as an array.
+    available = len(self.uniforms) - self.next_uniform
+    if n <= available:
+      u = self.uniforms[self.next_uniform:self.next_uniform + n]
+      self.next_uniform += n
+      return u
 
-  def _extract(self, param, sid, rid):
+    u = np.concatenate((self.uniforms[self.next_uniform:],
+                        self.random_state.random_sample(n - available + self.block_size)))
+    self.uniforms, self.next_uniform = u[n:], 0
+
+    return u[:n]
+
+
+  def _accessor(self, param):
     """
-    Internal function to extract correct values for a sender->recipient pair from parameters that can
-    be specified as scalar, 1-D ndarray, or 2-D ndarray.
+    Internal function returning a function of (sender_id, recipient_id) that extracts the correct value for a sender->recipient
+    pair from a parameter that can be specified as scalar, 1-D ndarray, 2-D ndarray, or LatencyTopology.
 
     Required parameters:
-      'param' : the parameter (not parameter name) from which to extract a value
-      'sid'   : the simulation sender agent id
-      'rid'   : the simulation recipient agent id
+      'param' : the parameter (not parameter name) from which to extract values
     """
 
-    if np.isscalar(param): return param
+    if np.isscalar(param): return lambda sender_id = None, recipient_id = None: param
+
+    if isinstance(param, LatencyTopology): return param.latency
 
     if type(param) is np.ndarray:
-      if param.ndim == 1: return param[sid]
-      elif param.ndim == 2: return param[sid, rid]
+      if param.ndim == 1: return lambda sender_id = None, recipient_id = None: param[sender_id]
+      elif param.ndim == 2: return lambda sender_id = None, recipient_id = None: param[sender_id, recipient_id]
 
-    print("Config error: LatencyModel parameter is not scalar, 1-D ndarray, or 2-D ndarray.")
+    print("Config error: LatencyModel parameter is not scalar, 1-D ndarray, 2-D ndarray, or LatencyTopology.")
     sys.exit()
 
 
+  def _values(self, param, sid, rids):
+    """
+    Internal function to extract the values for the pairs of sender sid and each recipient in the array rids
+    from a parameter that can be specified as scalar, 1-D ndarray, 2-D ndarray, or LatencyTopology.  A scalar
+    or 1-D parameter yields a scalar.
+    """
+
+    if np.isscalar(param): return param
+    if isinstance(param, LatencyTopology): return param.latencies(sid, rids)
+    if param.ndim == 1: return param[sid]
+    return param[sid, rids]
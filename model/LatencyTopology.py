@@ -0,0 +1,143 @@
+import numpy as np
+
+# Meters travelled by light in one nanosecond, as in util.meters_to_light_ns.
+LIGHT_METERS_PER_NS = 299792458e-9
+
+
+class LatencyTopology:
+
+  """
+  A LatencyTopology computes the pairwise values of a LatencyModel parameter (typically min_latency) on demand
+  from a compact description of the network, instead of holding a dense 2-D array of N x N values.  It may be
+  passed to LatencyModel anywhere a 2-D ndarray is accepted:
+
+    latency = LatencyModel('deterministic', min_latency = LineTopology(agent_positions))
+
+  Subclasses implement latency(sender_id, recipient_id), returning the value for one directional pair, and
+  latencies(sender_id, recipient_ids), returning a numpy array of the values from one sender to each of an
+  array of recipients.  The memory they require is proportional to the number of agents (or regions).
+  """
+
+  def latency(self, sender_id, recipient_id):
+    raise NotImplementedError
+
+  def latencies(self, sender_id, recipient_ids):
+    raise NotImplementedError
+
+  def to_matrix(self):
+    """
+    Returns the equivalent dense 2-D array, indexed [sender_id, recipient_id].  Intended for inspection and
+    small agent counts only.
+    """
+    ids = np.arange(len(self))
+    return np.array([self.latencies(sid, ids) for sid in ids])
+
+
+class CoordinateTopology(LatencyTopology):
+
+  """
+  Agents are points in space (1-D on a line, or 2-D on a plane, etc.) with coordinates in meters, and the
+  latency between two agents is the time light takes to travel the straight line between them, truncated
+  to integer nanoseconds.  This matches util.meters_to_light_ns applied to the scipy pdist/squareform pairwise
+  distances of the same points, so a config may switch from the dense matrix without changing any latency.
+
+  Required parameters:
+    'coords' : array of agent coordinates indexed by agent_id, of shape (N,) for a line or (N, D) otherwise.
+  """
+
+  def __init__(self, coords):
+    self.coords = np.asarray(coords, dtype=float)
+    if self.coords.ndim not in (1, 2):
+      raise ValueError("CoordinateTopology coords must be of shape (N,) or (N, D)")
+
+  def __len__(self):
+    return len(self.coords)
+
+  def latency(self, sender_id, recipient_id):
+    d = self.coords[sender_id] - self.coords[recipient_id]
+    distance = abs(d) if self.coords.ndim == 1 else np.sqrt(np.sum(d * d))
+    return int(distance / LIGHT_METERS_PER_NS)
+
+  def latencies(self, sender_id, recipient_ids):
+    d = self.coords[recipient_ids] - self.coords[sender_id]
+    distance = np.abs(d) if self.coords.ndim == 1 else np.sqrt(np.sum(d * d, axis=1))
+    return (distance / LIGHT_METERS_PER_NS).astype(int)
+
+
+class LineTopology(CoordinateTopology):
+
+  """ A CoordinateTopology of agents on a line, at positions (in meters) given by a 1-D array. """
+
+  def __init__(self, positions):
+    super().__init__(np.ravel(positions))
+
+
+class PlaneTopology(CoordinateTopology):
+
+  """ A CoordinateTopology of agents on a plane, at (x, y) coordinates (in meters) given by an (N, 2) array. """
+
+  def __init__(self, coords):
+    super().__init__(coords)
+    if self.coords.ndim != 2 or self.coords.shape[1] != 2:
+      raise ValueError("PlaneTopology coords must be of shape (N, 2)")
+
+
+class RegionTopology(LatencyTopology):
+
+  """
+  Agents are members of regions (e.g. data centers or cities), and the value between two agents is that
+  between their regions.
+
+  Required parameters:
+    'regions'        : integer array of the region of each agent, indexed by agent_id.
+    'region_latency' : 2-D array indexed [sender region, recipient region].  The diagonal gives the value
+                       within a region.  Need not be symmetric.
+  """
+
+  def __init__(self, regions, region_latency):
+    self.regions = np.asarray(regions, dtype=np.int64)
+    self.region_latency = np.asarray(region_latency)
+
+    if self.region_latency.ndim != 2:
+      raise ValueError("RegionTopology region_latency must be a 2-D array")
+    if len(self.regions) and (self.regions.min() < 0 or self.regions.max() >= min(self.region_latency.shape)):
+      raise ValueError("RegionTopology regions must index region_latency")
+
+  def __len__(self):
+    return len(self.regions)
+
+  def latency(self, sender_id, recipient_id):
+    return self.region_latency[self.regions[sender_id], self.regions[recipient_id]]
+
+  def latencies(self, sender_id, recipient_ids):
+    return self.region_latency[self.regions[sender_id], self.regions[recipient_ids]]
+
+
+class HubTopology(LatencyTopology):
+
+  """
+  Every message passes through a central hub (e.g. an exchange co-location switch), and the value between two
+  agents is the sum of the sender's uplink value and the recipient's downlink value.
+
+  Required parameters:
+    'uplink'   : array of the value from each agent to the hub, indexed by agent_id.
+
+  Optional parameters:
+    'downlink' : array of the value from the hub to each agent, indexed by agent_id.  Default is uplink.
+  """
+
+  def __init__(self, uplink, downlink = None):
+    self.uplink = np.asarray(uplink)
+    self.downlink = self.uplink if downlink is None else np.asarray(downlink)
+
+    if self.uplink.shape != self.downlink.shape or self.uplink.ndim != 1:
+      raise ValueError("HubTopology uplink and downlink must be 1-D arrays of the same length")
+
+  def __len__(self):
+    return len(self.uplink)
+
+  def latency(self, sender_id, recipient_id):
+    return self.uplink[sender_id] + self.downlink[recipient_id]
+
+  def latencies(self, sender_id, recipient_ids):
+    return self.uplink[sender_id] + self.downlink[recipient_ids]
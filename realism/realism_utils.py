@@ -5,7 +5,7 @@ from pathlib import Path
 p = str(Path(__file__).resolve().parents[1])  # directory one level up from this file
 sys.path.append(p)
 from util.formatting.convert_order_book import process_orderbook, is_wide_book
-from util.formatting.convert_order_stream import convert_stream_to_format
+from util.formatting.convert_order_stream import convert_stream_to_format, convert_journal_to_format
 import itertools
 from bisect import bisect
 from matplotlib.cm import get_cmap
@@ -105,6 +105,7 @@ def make_orderbook_for_analysis(stream_path, orderbook_path, num_levels=5, ignor
     """  Make orderbook amenable to mid-price + liquidity plots from ABIDES input.
 
          :param stream_path: path to ABIDES Exchange output, e.g. ExchangeAgent0.bz2. Note ABIDES must have been run with --log-orders=True
+                             Alternatively the exchange's binary order journal, e.g. EXCHANGE_AGENT_ORDER_JOURNAL.bin
          :param orderbook_path: path to ABIDES order book output, e.g. ORDERBOOK_TICKER_FULL.bz2. Note ABIDES must have been run with --book-freq not set to None
          :param num_levels: number of levels of orderbook to keep in DataFrame.
          :param ignore_cancellations: flag to only include executed trades
@@ -118,10 +119,13 @@ def make_orderbook_for_analysis(stream_path, orderbook_path, num_levels=5, ignor
 
     """
 
-    stream_df = pd.read_pickle(stream_path)
     orderbook_df = pd.read_pickle(orderbook_path)
 
-    stream_processed = convert_stream_to_format(stream_df.reset_index(), fmt='plot-scripts')
+    if stream_path.endswith('.bin'):
+        stream_processed = convert_journal_to_format(stream_path, fmt='plot-scripts')
+    else:
+        stream_df = pd.read_pickle(stream_path)
+        stream_processed = convert_stream_to_format(stream_df.reset_index(), fmt='plot-scripts')
     stream_processed = stream_processed.set_index('TIMESTAMP')
 
     ob_processed = process_orderbook(orderbook_df, num_levels)
@@ -0,0 +1,96 @@
+# Columnar recorder of fixed-depth (L2) order book snapshots for one symbol.
+#
+# Each snapshot is one int64 row of width 1 + 4 * depth laid out as:
+#
+#   time (ns since epoch), bid_px[depth], bid_sz[depth], ask_px[depth], ask_sz[depth]
+#
+# with level 1 (the inside quote) first on each side.  Missing levels are padded as in the LOBSTER
+# specification: price -9999999999 (bids) or 9999999999 (asks) with size zero.  Rows are written into
+# a preallocated chunk that is saved as a .npy file each time it fills, so the simulation never holds
+# more than one chunk in memory and the chunks can later be opened with np.load(mmap_mode='r').
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# LOBSTER dummy prices for empty book levels.
+EMPTY_BID_PRICE = -9999999999
+EMPTY_ASK_PRICE = 9999999999
+
+
+class BookSnapshotRecorder:
+
+    def __init__(self, symbol, depth, chunk_size=100000):
+        self.symbol = symbol
+        self.depth = depth
+        self.chunk_size = chunk_size
+
+        self.buffer = np.empty((chunk_size, 1 + 4 * depth), dtype=np.int64)
+        self.rows = 0
+        self.chunk = 0
+        self.files = []
+
+        # Column offsets of each block within a row.
+        self.bid_px = 1
+        self.bid_sz = 1 + depth
+        self.ask_px = 1 + 2 * depth
+        self.ask_sz = 1 + 3 * depth
+
+    def record(self, time, bids, asks):
+        """ Appends a snapshot taken at time (pd.Timestamp) from lists of (price, size) tuples, best level first,
+            of at most depth levels per side.  Returns True if the current chunk is now full and must be flushed.
+        """
+        row = self.buffer[self.rows]
+        row[0] = time.value
+
+        row[self.bid_px:self.ask_px] = 0
+        row[self.bid_px:self.bid_sz] = EMPTY_BID_PRICE
+        if bids:
+            bids = np.array(bids, dtype=np.int64)
+            row[self.bid_px:self.bid_px + len(bids)] = bids[:, 0]
+            row[self.bid_sz:self.bid_sz + len(bids)] = bids[:, 1]
+
+        row[self.ask_px:] = 0
+        row[self.ask_px:self.ask_sz] = EMPTY_ASK_PRICE
+        if asks:
+            asks = np.array(asks, dtype=np.int64)
+            row[self.ask_px:self.ask_px + len(asks)] = asks[:, 0]
+            row[self.ask_sz:self.ask_sz + len(asks)] = asks[:, 1]
+
+        self.rows += 1
+        return self.rows == self.chunk_size
+
+    def flush(self, owner):
+        """ Writes any recorded snapshots as the next chunk file via the owning agent's log writer. """
+        if self.rows == 0: return
+
+        filename = owner.writeLog(self.buffer[:self.rows], f'BOOK_SNAPSHOTS_{self.symbol}_CHUNK_{self.chunk}')
+        if filename: self.files.append(filename)
+        self.rows = 0
+        self.chunk += 1
+
+
+def load_book_snapshots(log_dir, symbol, mmap_mode='r'):
+    """ Returns the list of (memory-mapped) snapshot chunk arrays written for symbol in log_dir, in order. """
+    prefix = f'BOOK_SNAPSHOTS_{symbol}_CHUNK_'
+    chunks = sorted((int(f[len(prefix):-len('.npy')]), f) for f in os.listdir(log_dir)
+                    if f.startswith(prefix) and f.endswith('.npy'))
+
+    return [np.load(os.path.join(log_dir, f), mmap_mode=mmap_mode) for _, f in chunks]
+
+
+def book_snapshots_to_lobster(log_dir, symbol, level=None):
+    """ Returns the recorded snapshots for symbol as a DataFrame indexed by time, with columns in LOBSTER order
+        (ask_price_1, ask_size_1, bid_price_1, bid_size_1, ask_price_2, ...), optionally clipped to level levels.
+    """
+    data = np.concatenate(load_book_snapshots(log_dir, symbol))
+    depth = (data.shape[1] - 1) // 4
+    level = depth if level is None else min(level, depth)
+
+    columns, blocks = [], []
+    for i in range(level):
+        columns.extend([f'ask_price_{i + 1}', f'ask_size_{i + 1}', f'bid_price_{i + 1}', f'bid_size_{i + 1}'])
+        blocks.extend([1 + 2 * depth + i, 1 + 3 * depth + i, 1 + i, 1 + depth + i])
+
+    return pd.DataFrame(data[:, blocks], index=pd.to_datetime(data[:, 0]), columns=columns)
@@ -0,0 +1,88 @@
+# Incremental (delta) L2 market data, as published by the ExchangeAgent to subscribers that request it and
+# applied by the TradingAgent to its mirror of the book.
+#
+# Instead of the full top-N bids and asks, each MARKET_DATA message of the delta feed carries:
+#
+#   seq          the number of messages sent before this one on the subscription
+#   full         True if the message is a full refresh, i.e. the receiver should first clear its book mirror
+#   bid_updates  list of (price, size) for each bid level that changed, size 0 meaning the level was removed
+#   ask_updates  the same for the asks
+#
+# A full refresh is sent as the first message and then every refresh messages, so a mirror that missed an
+# update (detected by a gap in seq) resynchronizes at the next refresh.
+
+
+class MarketDataDelta:
+    """ Exchange side state of one delta subscription: the levels last sent and the sequence number. """
+
+    def __init__(self, refresh=100):
+        self.refresh = refresh
+        self.seq = 0
+        self.bids = {}
+        self.asks = {}
+
+    def update(self, bids, asks):
+        """ Returns the body of the next delta message for the given top-N bids and asks (lists of (price, size)),
+            or None if no level changed and no refresh is due.
+        """
+        full = self.seq == 0 or bool(self.refresh and self.seq % self.refresh == 0)
+        if full:
+            bid_updates, ask_updates = list(bids), list(asks)
+        else:
+            bid_updates, ask_updates = levelChanges(self.bids, bids), levelChanges(self.asks, asks)
+            if not bid_updates and not ask_updates: return None
+
+        self.bids, self.asks = dict(bids), dict(asks)
+        body = {"seq": self.seq, "full": full, "bid_updates": bid_updates, "ask_updates": ask_updates}
+        self.seq += 1
+
+        return body
+
+
+def levelChanges(old, new):
+    """ Returns the (price, size) changes that turn the levels in dict old into the list of levels new, with
+        size 0 for levels that are no longer present.
+    """
+    changes = [(price, size) for price, size in new if old.get(price) != size]
+    current = {price for price, _ in new}
+    changes.extend((price, 0) for price in old if price not in current)
+
+    return changes
+
+
+class BookMirror:
+    """ Client side copy of the top-N levels of one symbol, maintained from delta MARKET_DATA messages. """
+
+    def __init__(self):
+        self.bids = {}
+        self.asks = {}
+        self.seq = None
+        self.synchronized = False
+
+    def apply(self, body):
+        """ Applies a delta message body.  Returns False if the mirror is out of sync (an update was missed) and
+            will remain so until the next full refresh.
+        """
+        if body['full']:
+            self.bids, self.asks = {}, {}
+            self.synchronized = True
+        elif self.seq is None or body['seq'] != self.seq + 1:
+            self.synchronized = False
+        self.seq = body['seq']
+
+        if not self.synchronized: return False
+
+        for side, updates in ((self.bids, body['bid_updates']), (self.asks, body['ask_updates'])):
+            for price, size in updates:
+                if size: side[price] = size
+                else: side.pop(price, None)
+
+        return True
+
+    def getBids(self):
+        """ Returns the mirrored bids as a list of (price, size), best first. """
+        return sorted(self.bids.items(), reverse=True)
+
+    def getAsks(self):
+        """ Returns the mirrored asks as a list of (price, size), best first. """
+        return sorted(self.asks.items())
@@ -5,6 +5,10 @@ import sys
 
 from message.Message import Message
 from util.order.LimitOrder import LimitOrder
+from util.OrderHistory import OrderHistory
+from util.OrderJournal import ADD, MARKET, MODIFY, EXECUTE
+from util.TransactedVolumeTracker import TransactedVolumeTracker
+from util.BookSnapshotRecorder import BookSnapshotRecorder
 from util.util import log_print, be_silent
 
 from copy import deepcopy
@@ -36,23 +40,45 @@ class OrderBook:
         self.book_log_chunk = 0
         self.quotes_seen = set()
 
+        # If a fixed logging depth is configured, the book is instead logged as columnar top-N snapshots.
+        self.snapshot_recorder = None
+        if self.owner.book_log_depth is not None:
+            self.snapshot_recorder = BookSnapshotRecorder(symbol, self.owner.book_log_depth)
+
+        # With timer sampling, snapshots are taken at each multiple of book_freq after the market open: the
+        # sample for a time is recorded when the first book event after that time arrives, before it is applied.
+        # With event sampling, the last recorded levels are kept so unchanged snapshots can be skipped.
+        self.next_sample_time = None
+        if self.owner.book_sampling == 'timer':
+            self.sample_freq = pd.tseries.frequencies.to_offset(self.owner.book_freq)
+            self.next_sample_time = self.owner.mkt_open + self.sample_freq
+        self.last_snapshot = None
+
         # Create an order history for the exchange to report to certain agent types.
-        self.history = [{}]
+        self.history = OrderHistory(self.owner.stream_history)
 
         # Last timestamp the orderbook for that symbol was updated
         self.last_update_ts = None
 
-        # Internal variable used for computing transacted volumes
-        self._transacted_volume = {
-            "unrolled_transactions": None,
-            "self.history_previous_length": 0
-        }
+        # Incremented on every update, so that views of the book (e.g. depth snapshots) can be cached until it changes.
+        self.version = 0
+
+        # Index of the orders resting in the book by owner: agent_id -> {order_id: resting order}.
+        self.open_orders = {}
+
+        # Rolling record of executed volume, used for computing transacted volumes.
+        self.volume_tracker = TransactedVolumeTracker(self.owner.max_volume_lookback)
 
-    def handleLimitOrder(self, order):
+    def handleLimitOrder(self, order, fills=None, notify_acceptance=True, journal_add=True):
         # Matches a limit order or adds it to the order book.  Handles partial matches piecewise,
         # consuming all possible shares at the best price before moving on, without regard to
         # order size "fit" or minimizing number of transactions.  Sends one notification per
-        # match.
+        # match.  If a fills list is given (for one part of a larger order, e.g. a level of a
+        # market order), the aggressor's (quantity, price) fills are appended to it, and when
+        # aggregating executions the caller sends the aggregated report.  If notify_acceptance is
+        # False (an order re-entered by a replacement, which the owner already knows is resting),
+        # no ORDER_ACCEPTED is sent when the order enters the book.  A valid order is journaled as
+        # an add unless journal_add is False (it is part of another order already journaled).
         if order.symbol != self.symbol:
             log_print("{} order discarded.  Does not match OrderBook symbol: {}", order.symbol, self.symbol)
             return
@@ -61,12 +87,12 @@ class OrderBook:
             log_print("{} order discarded.  Quantity ({}) must be a positive integer.", order.symbol, order.quantity)
             return
 
+        if journal_add and self.owner.journal is not None: self.owner.journal.record(ADD, self.owner.currentTime, order)
+
+        if self.next_sample_time is not None: self.sampleSnapshots(self.owner.currentTime)
+
         # Add the order under index 0 of history: orders since the most recent trade.
-        self.history[0][order.order_id] = {'entry_time': self.owner.currentTime,
-                                           'quantity': order.quantity, 'is_buy_order': order.is_buy_order,
-                                           'limit_price': order.limit_price, 'transactions': [],
-                                           'modifications': [],
-                                           'cancellations': []}
+        self.history.addOrder(order, self.owner.currentTime)
 
         matching = True
 
@@ -86,10 +112,17 @@ class OrderBook:
                 order.quantity -= filled_order.quantity
 
                 log_print("MATCHED: new order {} vs old order {}", filled_order, matched_order)
+
+                # Journal both sides of each fill as it happens, whatever reports are sent to the agents.
+                if self.owner.journal is not None:
+                    self.owner.journal.record(EXECUTE, self.owner.currentTime, filled_order, filled_order.fill_price)
+                    self.owner.journal.record(EXECUTE, self.owner.currentTime, matched_order, matched_order.fill_price)
                 log_print("SENT: notifications of order execution to agents {} and {} for orders {} and {}",
                           filled_order.agent_id, matched_order.agent_id, filled_order.order_id, matched_order.order_id)
 
-                self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_EXECUTED", "order": filled_order}))
+                # When aggregating, the aggressor is notified once for all of its fills after matching completes.
+                if not self.owner.aggregate_executions:
+                    self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_EXECUTED", "order": filled_order}))
                 self.owner.sendMessage(matched_order.agent_id,
                                        Message({"msg": "ORDER_EXECUTED", "order": matched_order}))
 
@@ -97,9 +130,14 @@ class OrderBook:
                 executed.append((filled_order.quantity, filled_order.fill_price))
 
                 if order.quantity <= 0:
+                    if self.owner.aggregate_executions and fills is None:
+                        self.sendAggregatedExecution(order, executed)
                     matching = False
 
             else:
+                if executed and self.owner.aggregate_executions and fills is None:
+                    self.sendAggregatedExecution(order, executed)
+
                 # No matching order was found, so the new order enters the order book.  Notify the agent.
                 self.enterOrder(deepcopy(order))
 
@@ -107,10 +145,13 @@ class OrderBook:
                 log_print("SENT: notifications of order acceptance to agent {} for order {}",
                           order.agent_id, order.order_id)
 
-                self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_ACCEPTED", "order": order}))
+                if notify_acceptance:
+                    self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_ACCEPTED", "order": order}))
 
                 matching = False
 
+        if fills is not None: fills.extend(executed)
+
         if not matching:
             # Now that we are done executing or accepting this order, log the new best bid and ask.
             if self.bids:
@@ -138,15 +179,15 @@ class OrderBook:
 
                 self.last_trade = avg_price
 
-                # Transaction occurred, so advance indices.
-                self.history.insert(0, {})
-
-                # Truncate history to required length.
-                self.history = self.history[:self.owner.stream_history + 1]
+                # Transaction occurred, so advance indices.  This also drops the oldest trade's orders
+                # once the history holds the required length.
+                self.history.advance()
 
             # Finally, log the full depth of the order book, ONLY if we have been requested to store the order book
-            # for later visualization.  (This is slow.)
-            if self.owner.book_freq is not None:
+            # for later visualization.  (This is slow, unless only a fixed depth is being recorded.)
+            if self.owner.book_freq is not None and self.snapshot_recorder is not None:
+                self.recordSnapshot()
+            elif self.owner.book_freq is not None:
                 row = {'QuoteTime': self.owner.currentTime}
                 for quote, volume in self.getInsideBids():
                     row[quote] = -volume
@@ -165,8 +206,25 @@ class OrderBook:
                     self.book_log = []
                     self.book_log_chunk += 1
         self.last_update_ts = self.owner.currentTime
+        self.version += 1
         self.prettyPrint()
 
+    def sendAggregatedExecution(self, order, executed):
+        # Sends the aggressor of an incoming order a single ORDER_EXECUTED report covering all of the
+        # executions in the list of (quantity, price) tuples.  The reported order carries the total filled
+        # quantity and the volume-weighted average fill price (rounded to whole cents, as for LAST_TRADE),
+        # while the exact individual fills are attached under 'fills'.
+        filled_qty = sum(q for q, _ in executed)
+        filled_order = deepcopy(order)
+        filled_order.quantity = filled_qty
+        filled_order.fill_price = int(round(sum(q * p for q, p in executed) / filled_qty))
+
+        log_print("SENT: aggregated notification of {} executions to agent {} for order {}",
+                  len(executed), order.agent_id, order.order_id)
+
+        self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_EXECUTED", "order": filled_order,
+                                                        "fills": list(executed)}))
+
     def handleMarketOrder(self, order):
 
         if order.symbol != self.symbol:
@@ -177,6 +235,8 @@ class OrderBook:
             log_print("{} order discarded.  Quantity ({}) must be a positive integer.", order.symbol, order.quantity)
             return
 
+        if self.owner.journal is not None: self.owner.journal.record(MARKET, self.owner.currentTime, order)
+
         orderbook_side = self.getInsideAsks() if order.is_buy_order else self.getInsideBids()
 
         limit_orders = {} # limit orders to be placed (key=price, value=quantity)
@@ -192,10 +252,15 @@ class OrderBook:
                 order_quantity -= size
                 continue
         log_print("{} placing market order as multiple limit orders", order.symbol, order.quantity)
+
+        # When aggregating executions, the fills at every level are reported together, under the market order.
+        fills = [] if self.owner.aggregate_executions else None
         for lo in limit_orders.items():
             p, q = lo[0], lo[1]
             limit_order = LimitOrder(order.agent_id, order.time_placed, order.symbol, q, order.is_buy_order, p)
-            self.handleLimitOrder(limit_order)
+            self.handleLimitOrder(limit_order, fills=fills, journal_add=False)
+
+        if fills: self.sendAggregatedExecution(order, fills)
 
     def executeOrder(self, order):
         # Finds a single best match for this order, without regard for quantity.
@@ -232,6 +297,7 @@ class OrderBook:
             if order.quantity >= book[0][0].quantity:
                 # Consumed entire matched order.
                 matched_order = book[0].pop(0)
+                self.removeOpenOrder(matched_order)
 
                 # If the matched price now has no orders, remove it completely.
                 if not book[0]:
@@ -248,19 +314,18 @@ class OrderBook:
             # was being "advertised" in the order book.
             matched_order.fill_price = matched_order.limit_price
 
+            # Record the executed volume for transacted volume queries.
+            self.volume_tracker.addExecution(self.owner.currentTime, matched_order.quantity)
+
             # Record the transaction in the order history and push the indices
             # out one, possibly truncating to the maximum history length.
 
             # The incoming order is guaranteed to exist under index 0.
-            self.history[0][order.order_id]['transactions'].append((self.owner.currentTime, order.quantity))
-
-            # The pre-existing order may or may not still be in the recent history.
-            for idx, orders in enumerate(self.history):
-                if matched_order.order_id not in orders: continue
+            self.history.addTransaction(order.order_id, self.owner.currentTime, order.quantity)
 
-                # Found the matched order in history.  Update it with this transaction.
-                self.history[idx][matched_order.order_id]['transactions'].append(
-                    (self.owner.currentTime, matched_order.quantity))
+            # The pre-existing order may or may not still be in the recent history.  If it is, update it
+            # with this transaction.
+            self.history.addTransaction(matched_order.order_id, self.owner.currentTime, matched_order.quantity)
 
             # Return (only the executed portion of) the matched order.
             return matched_order
@@ -284,6 +349,8 @@ class OrderBook:
         # This does not test for matching/executing orders -- this function
         # should only be called after a failed match/execution attempt.
 
+        self.open_orders.setdefault(order.agent_id, {})[order.order_id] = order
+
         if order.is_buy_order:
             book = self.bids
         else:
@@ -316,6 +383,8 @@ class OrderBook:
         # order as the message body, with the cancelled quantity correctly represented as the
         # number of shares that had not already been executed.
 
+        if self.next_sample_time is not None: self.sampleSnapshots(self.owner.currentTime)
+
         if order.is_buy_order:
             book = self.bids
         else:
@@ -334,19 +403,21 @@ class OrderBook:
                     if order.order_id == co.order_id:
                         # Cancel this order.
                         cancelled_order = book[i].pop(ci)
+                        self.removeOpenOrder(cancelled_order)
 
                         # Record cancellation of the order if it is still present in the recent history structure.
-                        for idx, orders in enumerate(self.history):
-                            if cancelled_order.order_id not in orders: continue
-
+                        cancelled_entry = self.history.getOrder(cancelled_order.order_id)
+                        if cancelled_entry is not None:
                             # Found the cancelled order in history.  Update it with the cancelation.
-                            self.history[idx][cancelled_order.order_id]['cancellations'].append(
-                                (self.owner.currentTime, cancelled_order.quantity))
+                            cancelled_entry['cancellations'].append((self.owner.currentTime, cancelled_order.quantity))
 
                         # If the cancelled price now has no orders, remove it completely.
                         if not book[i]:
                             del book[i]
 
+                        if self.owner.book_freq is not None and self.snapshot_recorder is not None:
+                            self.recordSnapshot()
+
                         log_print("CANCELLED: order {}", order)
                         log_print("SENT: notifications of order cancellation to agent {} for order {}",
                                   cancelled_order.agent_id, cancelled_order.order_id)
@@ -355,32 +426,190 @@ class OrderBook:
                                                Message({"msg": "ORDER_CANCELLED", "order": cancelled_order}))
                         # We found the order and cancelled it, so stop looking.
                         self.last_update_ts = self.owner.currentTime
+                        self.version += 1
                         return
 
     def modifyOrder(self, order, new_order):
         # Modifies the quantity of an existing limit order in the order book
         if not self.isSameOrder(order, new_order): return
+        if self.next_sample_time is not None: self.sampleSnapshots(self.owner.currentTime)
         book = self.bids if order.is_buy_order else self.asks
         if not book: return
+        modified = False
         for i, o in enumerate(book):
             if self.isEqualPrice(order, o[0]):
                 for mi, mo in enumerate(book[i]):
                     if order.order_id == mo.order_id:
-                        book[i][0] = new_order
-                        for idx, orders in enumerate(self.history):
-                            if new_order.order_id not in orders: continue
-                            self.history[idx][new_order.order_id]['modifications'].append(
-                                (self.owner.currentTime, new_order.quantity))
+                        book[i][mi] = new_order
+                        modified = True
+                        if self.owner.journal is not None:
+                            self.owner.journal.record(MODIFY, self.owner.currentTime, mo, new_order.limit_price,
+                                                      new_order.quantity)
+                        self.removeOpenOrder(mo)
+                        self.open_orders.setdefault(new_order.agent_id, {})[new_order.order_id] = new_order
+                        modified_entry = self.history.getOrder(new_order.order_id)
+                        if modified_entry is not None:
+                            modified_entry['modifications'].append((self.owner.currentTime, new_order.quantity))
                             log_print("MODIFIED: order {}", order)
                             log_print("SENT: notifications of order modification to agent {} for order {}",
                                       new_order.agent_id, new_order.order_id)
                             self.owner.sendMessage(order.agent_id,
                                                    Message({"msg": "ORDER_MODIFIED", "new_order": new_order}))
+        # If no resting order matched, the book is unchanged: keep its version (and any cached depth).
+        if not modified: return
         if order.is_buy_order:
             self.bids = book
         else:
             self.asks = book
+        if self.owner.book_freq is not None and self.snapshot_recorder is not None:
+            self.recordSnapshot()
         self.last_update_ts = self.owner.currentTime
+        self.version += 1
+
+    @staticmethod
+    def replacementKeepsPriority(resting, new_order):
+        """ The time priority rules for REPLACE_ORDER (see replaceOrder).  A replacement keeps the resting order's
+            place in the queue only if it is a pure size reduction: the same limit price and an open quantity no
+            larger than the resting quantity.  Any other replacement (a new price, or a larger size) loses time
+            priority: the order is removed and re-entered as a newly arrived limit order, at the back of the queue at
+            its price, and executes at once if it crosses the spread.
+        """
+        return new_order.limit_price == resting.limit_price and new_order.quantity <= resting.quantity
+
+    def replaceOrder(self, order, new_order):
+        """ Atomically replaces a resting order with new_order, which has the same order_id and side but may have a
+            different limit price and/or quantity (the new open quantity), under the time priority rules of
+            replacementKeepsPriority.  The owner receives ORDER_REPLACED with the order as it was before and after
+            the replacement, followed by ORDER_EXECUTED for any fills of a re-entered order (but no ORDER_ACCEPTED,
+            as the order id is already resting).  If the order is no longer resting (it was filled or cancelled) or
+            the replacement is invalid, the owner instead receives ORDER_REPLACE_REJECTED with the order as
+            currently resting, or None if it is gone.
+        """
+        resting = self.open_orders.get(order.agent_id, {}).get(order.order_id)
+        if resting is None:
+            self.rejectReplacement(order, new_order, None, "Order {} is not resting in the book.".format(order.order_id))
+            return
+        if new_order.order_id != resting.order_id or new_order.is_buy_order != resting.is_buy_order:
+            self.rejectReplacement(order, new_order, resting, "New order must keep the order id and side.")
+            return
+        if (new_order.quantity <= 0) or (int(new_order.quantity) != new_order.quantity):
+            self.rejectReplacement(order, new_order, resting,
+                                   "Quantity ({}) must be a positive integer.".format(new_order.quantity))
+            return
+
+        if self.next_sample_time is not None: self.sampleSnapshots(self.owner.currentTime)
+
+        old_order = deepcopy(resting)
+        log_print("REPLACED: order {} with {}", old_order, new_order)
+
+        # The replacement is valid, so journal it, ahead of any fills of a re-entered order.
+        if self.owner.journal is not None:
+            self.owner.journal.record(MODIFY, self.owner.currentTime, old_order, new_order.limit_price,
+                                      new_order.quantity)
+
+        if self.replacementKeepsPriority(resting, new_order):
+            resting.quantity = new_order.quantity
+
+            entry = self.history.getOrder(resting.order_id)
+            if entry is not None:
+                entry['modifications'].append((self.owner.currentTime, resting.quantity))
+
+            self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_REPLACED", "old_order": old_order,
+                                                            "new_order": deepcopy(resting)}))
+
+            if self.owner.book_freq is not None and self.snapshot_recorder is not None:
+                self.recordSnapshot()
+            self.last_update_ts = self.owner.currentTime
+            self.version += 1
+        else:
+            # Price change or size increase: cancel and re-enter at the back of the queue.
+            self.removeRestingOrder(resting)
+
+            entry = self.history.getOrder(resting.order_id)
+            if entry is not None:
+                entry['cancellations'].append((self.owner.currentTime, resting.quantity))
+
+            self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_REPLACED", "old_order": old_order,
+                                                            "new_order": deepcopy(new_order)}))
+            self.handleLimitOrder(new_order, notify_acceptance=False, journal_add=False)
+
+    def rejectReplacement(self, order, new_order, resting, reason):
+        # Notifies the owner that the replacement of order by new_order was not applied, with a copy of the order
+        # as it is resting in the book (None if it is not).
+        log_print("Replacement discarded.  {}", reason)
+        self.owner.sendMessage(order.agent_id, Message({"msg": "ORDER_REPLACE_REJECTED", "order": order,
+                                                        "new_order": new_order, "reason": reason,
+                                                        "resting": deepcopy(resting)}))
+
+    def removeRestingOrder(self, order):
+        # Removes the given resting order object from its price level (and the level, if now empty) and from the
+        # open order index.
+        book = self.bids if order.is_buy_order else self.asks
+        for i, level in enumerate(book):
+            if level[0].limit_price == order.limit_price:
+                for oi, o in enumerate(level):
+                    if o is order:
+                        del level[oi]
+                        break
+                if not level: del book[i]
+                break
+
+        self.removeOpenOrder(order)
+
+    def cancelAllOrders(self, agent_id, is_buy_order=None):
+        """ Cancels all orders of agent_id resting in the book, or only its bids (is_buy_order True) or asks (False),
+            using the open order index.  Returns the list of cancelled orders, each with its unexecuted quantity.
+            Unlike cancelOrder, no notifications are sent: the caller reports the cancellations.
+        """
+        orders = self.open_orders.get(agent_id)
+        if not orders: return []
+
+        if self.next_sample_time is not None: self.sampleSnapshots(self.owner.currentTime)
+
+        cancelled = [o for o in orders.values() if is_buy_order is None or o.is_buy_order == is_buy_order]
+        if not cancelled: return []
+
+        # Group the orders by price level, so each affected level is found and filtered only once.
+        levels = {}
+        for o in cancelled:
+            levels.setdefault((o.is_buy_order, o.limit_price), set()).add(id(o))
+            self.removeOpenOrder(o)
+
+            cancelled_entry = self.history.getOrder(o.order_id)
+            if cancelled_entry is not None:
+                cancelled_entry['cancellations'].append((self.owner.currentTime, o.quantity))
+
+        for (is_buy, price), ids in levels.items():
+            book = self.bids if is_buy else self.asks
+            for i, level in enumerate(book):
+                if level[0].limit_price == price:
+                    level[:] = [o for o in level if id(o) not in ids]
+                    if not level: del book[i]
+                    break
+
+        log_print("CANCELLED: {} orders of agent {}", len(cancelled), agent_id)
+
+        if self.owner.book_freq is not None and self.snapshot_recorder is not None:
+            self.recordSnapshot()
+        self.last_update_ts = self.owner.currentTime
+        self.version += 1
+
+        return cancelled
+
+    def getOpenOrderIds(self, agent_id):
+        """ Returns the set of ids of the orders agent_id has resting in the book. """
+        return set(self.open_orders.get(agent_id, ()))
+
+    def getOpenOrders(self, agent_id):
+        """ Returns copies of the orders agent_id has resting in the book, each with its unexecuted quantity. """
+        return [deepcopy(o) for o in self.open_orders.get(agent_id, {}).values()]
+
+    def removeOpenOrder(self, order):
+        # Removes an order that has left the book from the open order index.
+        orders = self.open_orders.get(order.agent_id)
+        if orders is not None and orders.get(order.order_id) is order:
+            del orders[order.order_id]
+            if not orders: del self.open_orders[order.agent_id]
 
     # Get the inside bid price(s) and share volume available at each price, to a limit
     # of "depth".  (i.e. inside price, inside 2 prices)  Returns a list of tuples:
@@ -408,77 +637,35 @@ class OrderBook:
 
         return book
 
-    def _get_recent_history(self):
-        """ Gets portion of self.history that has arrived since last call of self.get_transacted_volume.
-
-            Also updates self._transacted_volume[self.history_previous_length]
-        :return:
-        """
-        if self._transacted_volume["self.history_previous_length"] == 0:
-            self._transacted_volume["self.history_previous_length"] = len(self.history)
-            return self.history
-        elif self._transacted_volume["self.history_previous_length"] == len(self.history):
-            return {}
-        else:
-            idx = len(self.history) - self._transacted_volume["self.history_previous_length"] - 1
-            recent_history = self.history[0:idx]
-            self._transacted_volume["self.history_previous_length"] = len(self.history)
-            return recent_history
-
-    def _update_unrolled_transactions(self, recent_history):
-        """ Updates self._transacted_volume["unrolled_transactions"] with data from recent_history
-
-        :return:
-        """
-        new_unrolled_txn = self._unrolled_transactions_from_order_history(recent_history)
-        old_unrolled_txn = self._transacted_volume["unrolled_transactions"]
-        total_unrolled_txn = pd.concat([old_unrolled_txn, new_unrolled_txn], ignore_index=True)
-        self._transacted_volume["unrolled_transactions"] = total_unrolled_txn
-
-    def _unrolled_transactions_from_order_history(self, history):
-        """ Returns a DataFrame with columns ['execution_time', 'quantity'] from a dictionary with same format as
-            self.history, describing executed transactions.
+    def getLiquidity(self, is_buy_order, within, relative=False):
+        """ Returns the total shares resting on one side of the book within distance within of the best price on
+            that side, walking the price levels only as far as needed.  The distance is in cents (ticks), or a
+            proportion of the best price if relative, as for TradingAgent.getKnownLiquidity.  None means the whole
+            side.  A list of distances returns a list of totals, one per distance, from a single walk.
         """
-        # Load history into DataFrame
-        unrolled_history = []
-        for elem in history:
-            for _, val in elem.items():
-                unrolled_history.append(val)
+        book = self.bids if is_buy_order else self.asks
+        distances = within if isinstance(within, (list, tuple)) else [within]
+        liquidity = [0] * len(distances)
 
-        unrolled_history_df = pd.DataFrame(unrolled_history, columns=[
-            'entry_time', 'quantity', 'is_buy_order', 'limit_price', 'transactions', 'modifications', 'cancellations'
-        ])
+        best = book[0][0].limit_price if book else 0
+        limits = [sys.maxsize if d is None else int(round(best * d)) if relative else d for d in distances]
+        widest = max(limits, default=0)
 
-        if unrolled_history_df.empty:
-            return pd.DataFrame(columns=['execution_time', 'quantity'])
+        for level in book:
+            distance = abs(level[0].limit_price - best)
+            if distance > widest: break
 
-        executed_transactions = unrolled_history_df[unrolled_history_df['transactions'].map(lambda d: len(d)) > 0]  # remove cells that are an empty list
+            qty = sum(o.quantity for o in level)
+            for i, limit in enumerate(limits):
+                if distance <= limit: liquidity[i] += qty
 
-        #  Reshape into DataFrame with columns ['execution_time', 'quantity']
-        transaction_list = [element for list_ in executed_transactions['transactions'].values for element in list_]
-        unrolled_transactions = pd.DataFrame(transaction_list, columns=['execution_time', 'quantity'])
-        unrolled_transactions = unrolled_transactions.sort_values(by=['execution_time'])
-        unrolled_transactions = unrolled_transactions.drop_duplicates(keep='last')
-
-        return unrolled_transactions
+        return liquidity if isinstance(within, (list, tuple)) else liquidity[0]
 
     def get_transacted_volume(self, lookback_period='10min'):
         """ Method retrieves the total transacted volume for a symbol over a lookback period finishing at the current
-            simulation time.
+            simulation time.  A list of lookback periods returns a list of volumes, one per period.
         """
-
-        # Update unrolled transactions DataFrame
-        recent_history = self._get_recent_history()
-        self._update_unrolled_transactions(recent_history)
-        unrolled_transactions = self._transacted_volume["unrolled_transactions"]
-
-        #  Get transacted volume in time window
-        lookback_pd = pd.to_timedelta(lookback_period)
-        window_start = self.owner.currentTime - lookback_pd
-        executed_within_lookback_period = unrolled_transactions[unrolled_transactions['execution_time'] >= window_start]
-        transacted_volume = executed_within_lookback_period['quantity'].sum()
-
-        return transacted_volume
+        return self.volume_tracker.getVolume(self.owner.currentTime, lookback_period)
 
     # These could be moved to the LimitOrder class.  We could even operator overload them
     # into >, <, ==, etc.
@@ -503,6 +690,34 @@ class OrderBook:
     def isSameOrder(self, order, new_order):
         return order.order_id == new_order.order_id
 
+    def recordSnapshot(self):
+        # Records the top book_log_depth levels of both sides in the columnar snapshot log after a change to
+        # the book, writing out the current chunk whenever it fills.  Timer sampling records in sampleSnapshots
+        # instead, and event sampling skips changes that did not reach the top book_log_depth levels.
+        if self.owner.book_sampling == 'timer': return
+
+        depth = self.snapshot_recorder.depth
+        bids, asks = self.getInsideBids(depth), self.getInsideAsks(depth)
+        if self.owner.book_sampling == 'event':
+            if (bids, asks) == self.last_snapshot: return
+            self.last_snapshot = (bids, asks)
+
+        if self.snapshot_recorder.record(self.owner.currentTime, bids, asks):
+            self.snapshot_recorder.flush(self.owner)
+
+    def sampleSnapshots(self, time, inclusive=False):
+        """ Records a timer snapshot of the current book for every sampling time before time (or up to and
+            including it, if inclusive), i.e. the state of the book at each of those times.
+        """
+        if self.next_sample_time > time or (self.next_sample_time == time and not inclusive): return
+
+        depth = self.snapshot_recorder.depth
+        bids, asks = self.getInsideBids(depth), self.getInsideAsks(depth)
+        while self.next_sample_time < time or (self.next_sample_time == time and inclusive):
+            if self.snapshot_recorder.record(self.next_sample_time, bids, asks):
+                self.snapshot_recorder.flush(self.owner)
+            self.next_sample_time += self.sample_freq
+
     def book_log_to_df(self):
         filename = self.owner.writeLog(self.book_log, f'BOOK_LOG_{self.symbol}_CHUNK_{self.book_log_chunk}')
         self.book_log_files.append(filename)
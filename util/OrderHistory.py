@@ -0,0 +1,170 @@
+# Order stream history for one symbol, as maintained by an OrderBook.  Orders are grouped into
+# buckets by trade: bucket 0 holds the orders received since the most recent trade, bucket 1 the
+# orders that led up to the most recent trade, and so on, back to a maximum number of trades.
+#
+# The buckets live in a fixed-capacity ring indexed by trade sequence number, so advancing to a
+# new trade does not shift the whole history, and an order_id -> trade sequence number index
+# finds the entry for an order without scanning every bucket.  Indexing, slicing, len() and
+# iteration behave as they did for the plain list of dictionaries this replaces, with index
+# zero being the most recent bucket.
+#
+# The history can also be sent incrementally (see getUpdates): a client that remembers the trade
+# sequence number of the newest bucket it holds and the number of executions it has seen is sent
+# only the buckets completed since, as compact records, plus the executions since of orders in the
+# buckets it already holds.  OrderStreamWindow maintains the client side copy from these updates.
+# A compact record is the tuple (order_id, is_buy_order, limit_price, quantity, executed quantity).
+
+class OrderHistory:
+
+    def __init__(self, max_trades):
+        # The history keeps the bucket of orders since the last trade plus one bucket for each of
+        # the last max_trades trades.  The ring grows on demand up to that capacity, so a very
+        # large max_trades (e.g. sys.maxsize) does not preallocate anything.
+        self.capacity = max_trades + 1
+        self.buckets = [{}]
+
+        # Sequence number of the current bucket, i.e. the number of trades seen so far.
+        self.trade_seq = 0
+
+        # Maps each order_id in the history to the sequence number of the bucket holding it.
+        self.index = {}
+
+        # Executions of orders in the history as (trade_seq when recorded, bucket trade_seq, order_id, quantity).
+        # Those recorded before the oldest bucket was started are forgotten: fills_start is the index of the
+        # first live one, and fill_base the execution sequence number (count of executions before) of fills[0].
+        self.fills = []
+        self.fills_start = 0
+        self.fill_base = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.buckets[(self.trade_seq - i) % self.capacity] for i in range(*key.indices(len(self)))]
+
+        if key < 0: key += len(self)
+        if not 0 <= key < len(self): raise IndexError("OrderHistory index out of range")
+
+        return self.buckets[(self.trade_seq - key) % self.capacity]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.buckets[(self.trade_seq - i) % self.capacity]
+
+    def addOrder(self, order, entry_time):
+        """ Records a newly received order in the current bucket (orders since the most recent trade). """
+        self.buckets[self.trade_seq % self.capacity][order.order_id] = {'entry_time': entry_time,
+                                                                        'quantity': order.quantity,
+                                                                        'is_buy_order': order.is_buy_order,
+                                                                        'limit_price': order.limit_price,
+                                                                        'transactions': [],
+                                                                        'modifications': [],
+                                                                        'cancellations': []}
+        self.index[order.order_id] = self.trade_seq
+
+    def getOrder(self, order_id):
+        """ Returns the history entry for order_id, or None if the order is no longer (or never was) in the
+            history.  If an order_id was reused, the entry in the most recent bucket is returned.
+        """
+        seq = self.index.get(order_id)
+        if seq is None: return None
+        return self.buckets[seq % self.capacity].get(order_id)
+
+    def addTransaction(self, order_id, time, quantity):
+        """ Records an execution of quantity shares of order_id (if it is still in the history) at time. """
+        seq = self.index.get(order_id)
+        if seq is None: return
+
+        self.buckets[seq % self.capacity][order_id]['transactions'].append((time, quantity))
+        self.fills.append((self.trade_seq, seq, order_id, quantity))
+
+    def getUpdates(self, length, last_trade_seq=None, last_fill_seq=None):
+        """ Returns the changes to history[1:length + 1] since a client last saw it, given the trade_seq and
+            fill_seq of the previous update (None for a first request).  The result has keys:
+
+              trade_seq  sequence number of the most recent completed bucket (history[1])
+              first_seq  sequence number of the oldest bucket in history[1:length + 1]
+              fill_seq   number of executions recorded so far
+              full       True if the client must discard what it holds (first request, or executions it
+                         has not seen have been forgotten)
+              buckets    list of (bucket trade_seq, list of compact records), oldest first, of the buckets
+                         the client does not hold yet
+              fills      list of (bucket trade_seq, order_id, quantity) for executions since last_fill_seq of
+                         orders in buckets the client already holds
+        """
+        live_fill_seq = self.fill_base + self.fills_start
+        full = last_trade_seq is None or last_fill_seq < live_fill_seq
+
+        oldest = min(length, len(self) - 1)
+        first_seq = self.trade_seq - oldest
+        if not full: oldest = min(oldest, self.trade_seq - last_trade_seq - 1)
+
+        buckets = []
+        for i in range(oldest, 0, -1):
+            bucket = self.buckets[(self.trade_seq - i) % self.capacity]
+            buckets.append((self.trade_seq - i, [(order_id, o['is_buy_order'], o['limit_price'], o['quantity'],
+                                                  sum(q for _, q in o['transactions']))
+                                                 for order_id, o in bucket.items()]))
+
+        fills = []
+        if not full:
+            fills = [(seq, order_id, quantity) for _, seq, order_id, quantity in self.fills[last_fill_seq - self.fill_base:]
+                     if first_seq <= seq <= last_trade_seq]
+
+        return {"trade_seq": self.trade_seq - 1, "first_seq": first_seq, "fill_seq": self.fill_base + len(self.fills),
+                "full": full, "buckets": buckets, "fills": fills}
+
+    def advance(self):
+        """ Starts a new bucket after a trade, evicting the oldest bucket if the history is at capacity. """
+        self.trade_seq += 1
+        slot = self.trade_seq % self.capacity
+
+        if slot < len(self.buckets):
+            evicted_seq = self.trade_seq - self.capacity
+            for order_id in self.buckets[slot]:
+                if self.index.get(order_id) == evicted_seq: del self.index[order_id]
+            self.buckets[slot] = {}
+
+            # Executions recorded before the evicted bucket was started can only concern evicted orders.
+            # Forget them, compacting the list once more than half of it is forgotten.
+            while self.fills_start < len(self.fills) and self.fills[self.fills_start][0] <= evicted_seq:
+                self.fills_start += 1
+            if self.fills_start > len(self.fills) // 2:
+                del self.fills[:self.fills_start]
+                self.fill_base += self.fills_start
+                self.fills_start = 0
+        else:
+            self.buckets.append({})
+
+
+class OrderStreamWindow:
+    """ Client side copy of the last length completed buckets of one symbol's order history, maintained from
+        OrderHistory.getUpdates() results.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.trade_seq = None
+        self.fill_seq = None
+
+        # Bucket trade_seq -> {order_id: [is_buy_order, limit_price, quantity, executed quantity]}.
+        self.buckets = {}
+
+    def apply(self, update):
+        """ Applies an update, then drops the buckets that have left the window. """
+        if update['full']: self.buckets = {}
+
+        for seq, records in update['buckets']:
+            self.buckets[seq] = {record[0]: list(record[1:]) for record in records}
+
+        for seq, order_id, quantity in update['fills']:
+            entry = self.buckets.get(seq, {}).get(order_id)
+            if entry is not None: entry[3] += quantity
+
+        self.trade_seq, self.fill_seq = update['trade_seq'], update['fill_seq']
+        for seq in [seq for seq in self.buckets if seq < update['first_seq']]: del self.buckets[seq]
+
+    def getHistory(self):
+        """ Returns the buckets as a list, most recent first, like OrderHistory[1:length + 1]. """
+        return [self.buckets[seq] for seq in sorted(self.buckets, reverse=True)]
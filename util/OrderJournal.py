@@ -0,0 +1,100 @@
+# Compact binary journal of exchange order events, in the spirit of NASDAQ ITCH.
+#
+# Each event is one fixed-size little-endian record (see JOURNAL_DTYPE) carrying a sequence number,
+# the event time in integer ns since epoch, a single-character message type, the order id, agent id,
+# side (+1 buy, -1 sell), price (integer cents) and size (shares):
+#
+#   'A'  add: a valid limit order was received (one the order book accepted for matching, not discarded)
+#   'M'  market order: a valid market order was received (price 0)
+#   'U'  modify: a modification or replacement was applied to a resting order (new quantity and price)
+#   'X'  cancel: an order was cancelled (the cancelled quantity)
+#   'E'  execute: an order was executed (the executed quantity and fill price).  Each fill is recorded once for
+#        each of its two orders, the incoming and the resting one, whether or not execution reports are
+#        aggregated, so the volume traded is half the total size of the 'E' records.
+#
+# Records are accumulated in a preallocated buffer and appended to the journal file whenever the buffer
+# fills, so logging an event costs a few array stores instead of a deep copy and a dictionary.  Order ids
+# must be integers to fit a record; any other order id (e.g. a string) is replaced by a negative surrogate
+# id, and the surrogate -> original mapping is saved next to the journal.  The journal can be read back
+# with read_order_journal(), which memory-maps the file as a NumPy structured array.
+
+import os
+import pickle
+
+import numpy as np
+
+JOURNAL_DTYPE = np.dtype([('seq', '<u8'), ('time', '<i8'), ('type', 'S1'), ('side', '<i1'),
+                          ('order_id', '<i8'), ('agent_id', '<i8'), ('price', '<i8'), ('size', '<i8')])
+
+ADD = b'A'
+MARKET = b'M'
+MODIFY = b'U'
+CANCEL = b'X'
+EXECUTE = b'E'
+
+
+class OrderJournal:
+
+    def __init__(self, buffer_size=65536):
+        self.buffer = np.zeros(buffer_size, dtype=JOURNAL_DTYPE)
+        self.rows = 0
+        self.seq = 0
+
+        # The journal file is opened once the log directory is known.  Until then (or if logging is
+        # skipped entirely), events are counted but not written.
+        self.path = None
+        self.file = None
+
+        # Surrogate ids for order ids that are not integers.
+        self.surrogate_ids = {}
+
+    def open(self, log_dir, filename='ORDER_JOURNAL'):
+        """ Opens the journal file (and creates log_dir if necessary).  Events are appended to it from now on. """
+        os.makedirs(log_dir, exist_ok=True)
+        self.path = os.path.join(log_dir, '{}.bin'.format(filename))
+        self.file = open(self.path, 'wb')
+
+    def record(self, event_type, time, order, price=None, size=None):
+        """ Appends one event for order at time (pd.Timestamp).  Price and size default to the order's limit
+            price and quantity.
+        """
+        order_id = order.order_id
+        if not isinstance(order_id, (int, np.integer)):
+            order_id = self.surrogate_ids.setdefault(order_id, -1 - len(self.surrogate_ids))
+
+        if price is None: price = getattr(order, 'limit_price', 0)
+        if size is None: size = order.quantity
+
+        self.buffer[self.rows] = (self.seq, time.value, event_type, 1 if order.is_buy_order else -1,
+                                  order_id, order.agent_id, price, size)
+        self.seq += 1
+        self.rows += 1
+
+        if self.rows == len(self.buffer): self.flush()
+
+    def flush(self):
+        """ Writes buffered records to the journal file. """
+        if self.file is not None and self.rows > 0:
+            self.file.write(self.buffer[:self.rows].tobytes())
+        self.rows = 0
+
+    def close(self):
+        """ Flushes and closes the journal, saving the surrogate order id mapping if any were assigned. """
+        self.flush()
+        if self.file is None: return
+
+        self.file.close()
+        self.file = None
+
+        if self.surrogate_ids:
+            with open(self.path[:-len('.bin')] + '_ORDER_IDS.pkl', 'wb') as f:
+                pickle.dump({v: k for k, v in self.surrogate_ids.items()}, f)
+
+
+def read_order_journal(path, mmap=True):
+    """ Returns the journal at path as a NumPy structured array with dtype JOURNAL_DTYPE (memory-mapped by
+        default).
+    """
+    if os.path.getsize(path) == 0: return np.zeros(0, dtype=JOURNAL_DTYPE)
+    if mmap: return np.memmap(path, dtype=JOURNAL_DTYPE, mode='r')
+    return np.fromfile(path, dtype=JOURNAL_DTYPE)
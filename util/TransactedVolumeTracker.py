@@ -0,0 +1,94 @@
+# Rolling-window record of the executions in one OrderBook, used to answer QUERY_TRANSACTED_VOLUME.
+# Each execution is appended as (time in integer ns, shares) to a time-ordered buffer that also
+# keeps the running total of shares transacted, so the volume over any lookback period is one
+# binary search plus one subtraction.  Executions older than the maximum lookback (if one is
+# configured) are dropped as new ones arrive; the storage is compacted in place or doubled when
+# it fills, so appends are amortized O(1).
+
+import numpy as np
+import pandas as pd
+
+from util.util import log_print
+
+
+class TransactedVolumeTracker:
+
+    def __init__(self, max_lookback=None, initial_capacity=4096):
+        # Executions older than max_lookback before the most recent execution may be discarded.
+        # None keeps every execution for the whole simulation.
+        self.max_lookback = None if max_lookback is None else pd.to_timedelta(max_lookback).value
+
+        self.times = np.zeros(initial_capacity, dtype=np.int64)
+        self.cum_volume = np.zeros(initial_capacity, dtype=np.int64)
+
+        # Live executions occupy [start, end) of the arrays.  cum_volume[i] is the total volume
+        # transacted up to and including execution i, and base_volume is the total transacted
+        # before the first live execution.
+        self.start = 0
+        self.end = 0
+        self.base_volume = 0
+
+        # Lookback periods arrive as strings or Timedelta-compatible numbers.  Convert each only once.
+        self.lookback_ns = {}
+
+    def addExecution(self, time, quantity):
+        """ Records an execution of quantity shares at time (a pd.Timestamp or integer ns). """
+        time = time.value if isinstance(time, pd.Timestamp) else int(time)
+
+        if self.end == len(self.times): self._makeRoom()
+
+        total = self.cum_volume[self.end - 1] if self.end > self.start else self.base_volume
+        self.times[self.end] = time
+        self.cum_volume[self.end] = total + quantity
+        self.end += 1
+
+        # Discard executions that can no longer fall within the maximum lookback.
+        if self.max_lookback is not None and self.times[self.start] < time - self.max_lookback:
+            cutoff = self.start + np.searchsorted(self.times[self.start:self.end], time - self.max_lookback)
+            self.base_volume = int(self.cum_volume[cutoff - 1])
+            self.start = int(cutoff)
+
+    def getVolume(self, current_time, lookback_period='10min'):
+        """ Returns the total volume transacted from current_time - lookback_period (inclusive) up to
+            current_time.  If lookback_period is a list, returns a list with one volume per lookback,
+            all answered with a single vectorized search.
+        """
+        lookbacks = lookback_period if isinstance(lookback_period, (list, tuple)) else [lookback_period]
+        window_starts = current_time.value - np.array([self._lookbackNs(lb) for lb in lookbacks], dtype=np.int64)
+
+        if self.end == self.start:
+            volumes = [0] * len(lookbacks)
+        else:
+            first = self.start + np.searchsorted(self.times[self.start:self.end], window_starts)
+            before = np.where(first > self.start, self.cum_volume[np.maximum(first - 1, 0)], self.base_volume)
+            volumes = (self.cum_volume[self.end - 1] - before).tolist()
+
+        return volumes if isinstance(lookback_period, (list, tuple)) else volumes[0]
+
+    def _lookbackNs(self, lookback_period):
+        # Converts (and caches) a lookback period to integer nanoseconds.
+        if lookback_period not in self.lookback_ns:
+            lookback = pd.to_timedelta(lookback_period).value
+            if self.max_lookback is not None and lookback > self.max_lookback:
+                log_print("Transacted volume lookback {} exceeds the maximum of {} ns, volume will be truncated",
+                          lookback_period, self.max_lookback)
+            self.lookback_ns[lookback_period] = lookback
+
+        return self.lookback_ns[lookback_period]
+
+    def _makeRoom(self):
+        # Called when the arrays are full.  Slide the live executions to the front if at least half
+        # of the arrays has been discarded, otherwise double the capacity.
+        live = self.end - self.start
+
+        if self.start >= len(self.times) // 2:
+            self.times[:live] = self.times[self.start:self.end]
+            self.cum_volume[:live] = self.cum_volume[self.start:self.end]
+        else:
+            times = np.zeros(2 * len(self.times), dtype=np.int64)
+            cum_volume = np.zeros(2 * len(self.cum_volume), dtype=np.int64)
+            times[:live] = self.times[self.start:self.end]
+            cum_volume[:live] = self.cum_volume[self.start:self.end]
+            self.times, self.cum_volume = times, cum_volume
+
+        self.start, self.end = 0, live
@@ -0,0 +1,24 @@
+import argparse
+import pandas as pd
+
+import sys
+from pathlib import Path
+p = str(Path(__file__).resolve().parents[2])  # directory two levels up from this file
+sys.path.append(p)
+
+from util.oracle.DataOracle import convert_historical_data
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Converts the historical trades and 1m OHLC bars read by the '
+                                                 'DataOracle into its binary cache, one directory per date.')
+    parser.add_argument('data_dir', type=str, help='Historical data directory, containing trades/ and 1m_ohlc/')
+    parser.add_argument('cache_dir', type=str, help='Cache directory, to pass to the DataOracle as cache_dir')
+    parser.add_argument('dates', type=str, nargs='+', help='Historical dates to convert, in format YYYYMMDD')
+    args, remaining_args = parser.parse_known_args()
+
+    for date in args.dates:
+        historical_date = pd.to_datetime(date)
+        print(f'Converting {historical_date.date()}...')
+        convert_historical_data(args.data_dir, historical_date, args.cache_dir)
@@ -3,6 +3,14 @@ import pandas as pd
 from pandas.io.json import json_normalize
 import json
 import os
+import numpy as np
+
+import sys
+from pathlib import Path
+p = str(Path(__file__).resolve().parents[2])  # directory two levels up from this file
+sys.path.append(p)
+
+from util.OrderJournal import read_order_journal, ADD, CANCEL, EXECUTE
 
 
 def extract_events_from_stream(stream_df, event_type):
@@ -55,7 +63,6 @@ def convert_stream_to_format(stream_df, fmt="LOBSTER"):
         "ORDER_CANCELLED": 3,
         "ORDER_EXECUTED": 4
     }
-    reversed_market_events = {val: key for key, val in market_events.items()}
 
     for event_name, lobster_code in market_events.items():
         event_df = extract_events_from_stream(stream_df, event_name)
@@ -69,6 +76,38 @@ def convert_stream_to_format(stream_df, fmt="LOBSTER"):
     print(event_dfs)
     lobster_df = pd.concat(event_dfs)
 
+    return format_events(lobster_df, fmt)
+
+
+def convert_journal_to_format(journal, fmt="LOBSTER"):
+    """ Converts an ABIDES binary order journal (see util.OrderJournal), or the path to one, into LOBSTER or
+        plot-scripts format.  Equivalent to convert_stream_to_format, except that executions carry their fill price.
+    """
+    if isinstance(journal, str):
+        journal = read_order_journal(journal)
+
+    market_events = {ADD: 1, CANCEL: 3, EXECUTE: 4}
+    journal = journal[np.isin(journal['type'], list(market_events))]
+
+    lobster_df = pd.DataFrame({
+        'TIMESTAMP': pd.to_datetime(journal['time']),
+        'ORDER_ID': journal['order_id'],
+        'PRICE': journal['price'],
+        'SIZE': journal['size'],
+        'BUY_SELL_FLAG': journal['side'] > 0,
+        'Type': pd.Series(journal['type']).map(market_events).values
+    })
+    lobster_df["Time"] = seconds_since_midnight(lobster_df["TIMESTAMP"])
+
+    return format_events(lobster_df, fmt)
+
+
+def format_events(lobster_df, fmt):
+    """ Formats a DataFrame of market events (TIMESTAMP, ORDER_ID, PRICE, SIZE, BUY_SELL_FLAG, Time and LOBSTER
+        event code Type) as plot-scripts or LOBSTER output.
+    """
+    reversed_market_events = {1: "LIMIT_ORDER", 3: "ORDER_CANCELLED", 4: "ORDER_EXECUTED"}
+
     if fmt == "plot-scripts":
 
         lobster_df["Type"].replace(reversed_market_events, inplace=True)
@@ -125,7 +164,7 @@ def get_start_end_time(df, fmt):
 def save_formatted_order_stream(stream_bz2, ticker, level, fmt, suffix, out_dir='.'):
     """ Saves ABIDES logged order stream into csv in requested format.
 
-        :param stream_bz2: file path of Exchange Agent bz2 output file.
+        :param stream_bz2: file path of Exchange Agent bz2 output file, or of its binary order journal (.bin).
         :type stream_bz2: str
         :param ticker: label of security
         :type ticker: str
@@ -207,11 +246,15 @@ def save_formatted_order_stream(stream_bz2, ticker, level, fmt, suffix, out_dir=
 
     """
 
-    stream_df = pd.read_pickle(stream_bz2).reset_index()
-    write_df = convert_stream_to_format(stream_df, fmt=fmt)
+    if stream_bz2.endswith('.bin'):
+        write_df = convert_journal_to_format(stream_bz2, fmt=fmt)
+        trading_day = get_year_month_day(write_df['TIMESTAMP'])
+    else:
+        stream_df = pd.read_pickle(stream_bz2).reset_index()
+        write_df = convert_stream_to_format(stream_df, fmt=fmt)
+        trading_day = get_year_month_day(stream_df['EventTime'])
 
     # Save to file
-    trading_day = get_year_month_day(stream_df['EventTime'])
     start_time, end_time = get_start_end_time(write_df, fmt)
 
 
@@ -249,8 +292,9 @@ def check_positive(value):
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Process ABIDES stream data into either plotting or LOBSTER formats.')
-    parser.add_argument('stream', type=str, help='ABIDES order stream in bz2 format. '
-                                                 'Typical example is `ExchangeAgent.bz2`')
+    parser.add_argument('stream', type=str, help='ABIDES order stream in bz2 format, or binary order journal. '
+                                                 'Typical examples are `ExchangeAgent.bz2` and '
+                                                 '`EXCHANGE_AGENT_ORDER_JOURNAL.bin`')
     parser.add_argument('-o', '--output-dir', default='.', help='Path to output directory', type=dir_path)
     parser.add_argument('ticker', type=str, help="Ticker label")
     parser.add_argument('level', type=check_positive, help="Maximum orderbook level.")
@@ -0,0 +1,233 @@
+### The CorrelatedMeanRevertingOracle advances the fundamental values of all of its
+### stock symbols together, as one vector of the same discrete mean-reverting
+### processes used by the MeanRevertingOracle:
+###
+###   r[t] = kappa * r_bar + (1 - kappa) * r[t-1] + shock[t]
+###
+### with one r_bar, kappa and sigma_s (shock variance, NOT STANDARD DEVIATION) per
+### symbol, except that the shocks of different symbols may be correlated through
+### a correlation matrix.  ETF (or basket) symbols are valued as the weighted sum
+### of their portfolio, so a basket costs one state update rather than one per
+### constituent.
+
+### As in the MeanRevertingOracle, the nanoseconds of simulation time are the time
+### steps, and the series is never materialized one value per step: the process
+### has closed-form multi-step transition moments, so the whole state vector is
+### sampled at each requested time from the latest one, using a Cholesky factor of
+### the covariance of the shocks accumulated over the elapsed steps.  Requests for
+### a time earlier than the latest sampled time return the state at the latest
+### sampled time no later than it.
+
+import datetime as dt
+import numpy as np
+import pandas as pd
+from util import util
+
+from math import sqrt
+from util.util import log_print
+from util.oracle.FundamentalLog import FundamentalLog
+
+
+class CorrelatedMeanRevertingOracle:
+
+  def __init__(self, mkt_open, mkt_close, symbols, correlation=None, random_state=None, log_policy='all',
+               log_freq=None):
+    # Symbols must be a dictionary of dictionaries with outer keys as symbol names and inner keys:
+    # r_bar, kappa (0 <= kappa < 1), sigma_s, and optionally type (default stock).  ETF symbols
+    # instead require a portfolio: a list of stock symbols whose values they sum, or a dictionary
+    # of stock symbols to weights.
+    #
+    # correlation is the correlation matrix of the shocks of the stock symbols, in the order in
+    # which they appear in symbols (or a DataFrame indexed by symbol in both dimensions).  The
+    # shocks are independent if it is None.  The whole process is driven by random_state, which is
+    # seeded from the global np.random PRNG if not given, so the oracle should be created BEFORE
+    # the agents.
+    #
+    # The fundamental log of each symbol holds the values sampled at each requested time, subject
+    # to log_policy and log_freq (see FundamentalLog).
+    self.mkt_open = mkt_open
+    self.mkt_close = mkt_close
+    self.symbols = symbols
+
+    then = dt.datetime.now()
+
+    self.stocks = [symbol for symbol, s in symbols.items()
+                   if s.get('type', util.SymbolType.Stock) == util.SymbolType.Stock]
+    self.index = {symbol: i for i, symbol in enumerate(self.stocks)}
+
+    # Each symbol's value is a weighted sum of the stock values: row weights[i] for symbol i of
+    # symbols (a unit row for a stock).
+    self.weights = np.zeros((len(symbols), len(self.stocks)))
+    self.rows = {}
+    for row, (symbol, s) in enumerate(symbols.items()):
+      self.rows[symbol] = row
+      symbol_type = s.get('type', util.SymbolType.Stock)
+      if symbol_type == util.SymbolType.Stock:
+        self.weights[row, self.index[symbol]] = 1
+      elif symbol_type == util.SymbolType.ETF:
+        portfolio = s['portfolio']
+        items = portfolio.items() if isinstance(portfolio, dict) else ((p, 1) for p in portfolio)
+        for p, w in items: self.weights[row, self.index[p]] += w
+      else:
+        raise NameError('Type  ' + str(symbol_type) + " is unkwonw")
+
+    self.r_bar = np.array([symbols[s]['r_bar'] for s in self.stocks], dtype=float)
+    kappa = np.array([symbols[s]['kappa'] for s in self.stocks], dtype=float)
+    sigma_s = np.array([symbols[s]['sigma_s'] for s in self.stocks], dtype=float)
+
+    if np.any(kappa < 0) or np.any(kappa >= 1):
+      raise ValueError("CorrelatedMeanRevertingOracle requires 0 <= kappa < 1")
+
+    if correlation is None:
+      correlation = np.eye(len(self.stocks))
+    elif isinstance(correlation, pd.DataFrame):
+      correlation = correlation.loc[self.stocks, self.stocks].values
+    correlation = np.asarray(correlation, dtype=float)
+
+    # Covariance of the shocks of one time step, and the log of the per-step decay of each symbol's
+    # deviation from r_bar.  The logarithms keep the moments accurate for tiny kappa.
+    self.cov = np.outer(np.sqrt(sigma_s), np.sqrt(sigma_s)) * correlation
+    self.log_a = np.log1p(-kappa)
+    self.log_aa = self.log_a[:, None] + self.log_a[None, :]
+
+    # With a common kappa, the covariance over k steps is the one step covariance times a scalar,
+    # so a single Cholesky factor serves every k.
+    self.common_kappa = bool(np.all(kappa == kappa[0])) if len(kappa) else True
+    self.chol = cholesky(self.cov)
+
+    self.random_state = random_state if random_state is not None else \
+                        np.random.RandomState(seed=np.random.randint(low=0, high=2**32))
+
+    # The time steps (ns after mkt_open) at which the state was sampled, in increasing order, and
+    # the (unrounded) stock values at each of them, in growable arrays of which the first n are
+    # valid.  The state starts from r_bar at the open.
+    self.t = np.zeros(1024, dtype=np.int64)
+    self.x = np.empty((1024, len(self.stocks)))
+    self.x[0] = self.r_bar
+    self.n = 1
+
+    self.f_log = {symbol: FundamentalLog(log_policy, log_freq) for symbol in symbols}
+    self.log_values(0, self.x[0])
+
+    now = dt.datetime.now()
+
+    log_print ("CorrelatedMeanRevertingOracle initialized for symbols {}", symbols)
+    log_print ("CorrelatedMeanRevertingOracle initialization took {}", now - then)
+
+  def transition(self, k):
+    # Returns the factors by which each deviation from r_bar decays over k time steps, and a
+    # Cholesky factor of the covariance of the shocks accumulated over those steps, whose
+    # entries are cov[i,j] * sum over m < k of ((1 - kappa_i) * (1 - kappa_j)) ** m.
+    decay = np.exp(k * self.log_a)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      steps = np.where(self.log_aa == 0, k, np.expm1(k * self.log_aa) / np.expm1(self.log_aa))
+
+    if self.common_kappa:
+      return decay, self.chol * sqrt(steps[0, 0]) if len(steps) else self.chol
+
+    return decay, cholesky(self.cov * steps)
+
+  def sample_fundamental_values(self, currentTime):
+    # Returns the (unrounded) values of all stock symbols at currentTime, advancing the state to
+    # it if it is later than the latest sampled time.  After the close, this is the state just
+    # before the close.
+    if currentTime >= self.mkt_close: currentTime = self.mkt_close - pd.Timedelta('1ns')
+    step = max(0, (currentTime - self.mkt_open).value)
+
+    latest = self.t[self.n - 1]
+    if step <= latest:
+      i = np.searchsorted(self.t[:self.n], step, side='right') - 1
+      return self.x[i]
+
+    decay, chol = self.transition(step - latest)
+    shocks = chol @ self.random_state.normal(size=len(self.stocks))
+
+    # The process is not permitted to become negative.
+    x = np.maximum(0, self.r_bar + decay * (self.x[self.n - 1] - self.r_bar) + shocks)
+
+    if self.n == len(self.t):
+      self.t = np.concatenate((self.t, np.empty(self.n, dtype=np.int64)))
+      self.x = np.concatenate((self.x, np.empty((self.n, len(self.stocks)))))
+    self.t[self.n], self.x[self.n] = step, x
+    self.n += 1
+
+    self.log_values(step, x)
+
+    return x
+
+  def log_values(self, step, x):
+    # Appends the values (in integer cents) of every symbol given the stock values x at a time
+    # step to the log.
+    ts = np.array([self.mkt_open.value + step], dtype=np.int64)
+    values = np.round(self.weights @ x)
+    for symbol, row in self.rows.items():
+      self.f_log[symbol].append(ts, values[row:row + 1])
+
+  def get_fundamental_values(self, symbols, currentTime):
+    # Returns the fundamental values of a list of symbols at currentTime in integer cents, from
+    # a single state update.
+    x = self.sample_fundamental_values(currentTime)
+    rows = [self.rows[symbol] for symbol in symbols]
+    return np.round(self.weights[rows] @ x).astype(np.int64)
+
+  def get_fundamental_value(self, symbol, currentTime):
+    # Returns the fundamental value of a symbol at currentTime in integer cents.
+    return int(self.get_fundamental_values([symbol], currentTime)[0])
+
+  def get_fundamental_log(self, symbol):
+    return self.f_log[symbol].to_frame()
+
+
+  # Return the daily open price for the symbol given.  As in the MeanRevertingOracle, this will
+  # simply be the first fundamental value, which is also the fundamental mean (or the weighted sum
+  # of the means for an ETF).
+  def getDailyOpenPrice (self, symbol, mkt_open=None):
+
+    # If we did not already know mkt_open, we should remember it.
+    if (mkt_open is not None) and (self.mkt_open is None):
+      self.mkt_open = mkt_open
+
+    log_print ("Oracle: client requested {} at market open: {}", symbol, self.mkt_open)
+
+    open = self.get_fundamental_value(symbol, self.mkt_open)
+    log_print ("Oracle: market open price was was {}", open)
+
+    return open
+
+
+  # Return a noisy observation of the current fundamental value.  sigma_n is experimental
+  # observation variance.  NOTE: NOT STANDARD DEVIATION.  Each agent must pass its RandomState
+  # object to observePrice.
+  def observePrice(self, symbol, currentTime, sigma_n = 1000, random_state = None):
+    return int(self.observePrices([symbol], currentTime, sigma_n = sigma_n, random_state = random_state)[0])
+
+
+  # Return noisy observations of the current fundamental values of a list of symbols (e.g. an ETF
+  # and its constituents), from a single state update.  The noise is drawn as the same number of
+  # calls to observePrice would draw it.
+  def observePrices(self, symbols, currentTime, sigma_n = 1000, random_state = None):
+    r_t = self.get_fundamental_values(symbols, currentTime)
+
+    # Generate noisy observations of fundamental value at the current time.
+    if sigma_n == 0:
+      obs = r_t
+    else:
+      obs = np.round(random_state.normal(loc=r_t, scale=sqrt(sigma_n))).astype(np.int64)
+
+    log_print ("Oracle: current fundamental values of {} are {} at {}", symbols, r_t, currentTime)
+    log_print ("Oracle: giving client value observations {}", obs)
+
+    # Reminder: all simulator prices are specified in integer cents.
+    return obs
+
+
+def cholesky(cov):
+  # Returns a factor L with L @ L.T equal to the covariance matrix cov: its Cholesky factor, or for
+  # a matrix that is only positive semi-definite (e.g. with a zero variance or perfectly correlated
+  # symbols), which has none, a square root from its eigendecomposition.
+  try:
+    return np.linalg.cholesky(cov)
+  except np.linalg.LinAlgError:
+    w, v = np.linalg.eigh(cov)
+    return v * np.sqrt(np.maximum(w, 0))
@@ -13,13 +13,33 @@ import pandas as pd
 import os, sys
 
 from math import sqrt
-from util.util import print, log_print
+from util.util import log_print
+from util.oracle.HistoricalDataCache import HistoricalDataCache, write_historical_cache, time_ns
 
-from joblib import Memory
-mem = Memory(cachedir='./cache', verbose=0)
+
+# Returns the paths of the historical trades and 1m OHLC bars files for a date.
+def historical_data_files(data_dir, historical_date):
+  h = historical_date
+  pre = 'ct' if h.year < 2015 else 'ctm'
+  trade_file = os.path.join(data_dir, 'trades', 'trades_{}'.format(h.year),
+                            '{}_{}{:02d}{:02d}.bgz'.format(pre, h.year, h.month, h.day))
+
+  bars_1m_file = os.path.join(data_dir, '1m_ohlc', '1m_ohlc_{}'.format(h.year),
+                            '{}{:02d}{:02d}_ohlc_1m.bgz'.format(h.year, h.month, h.day))
+
+  return trade_file, bars_1m_file
+
+
+# Converts the historical trades and 1m bars of a date into the binary cache under cache_dir
+# (see HistoricalDataCache), for all symbols in the files.
+def convert_historical_data(data_dir, historical_date, cache_dir):
+  trade_file, bars_1m_file = historical_data_files(data_dir, historical_date)
+
+  log_print ("Converting historical data for {} into cache {}", historical_date, cache_dir)
+  write_historical_cache(cache_dir, historical_date, pd.read_pickle(trade_file, compression='bz2'),
+                         pd.read_pickle(bars_1m_file, compression='bz2'))
 
 
-#@mem.cache
 def read_trades(trade_file, symbols):
   log_print ("Data not cached.  This will take a minute...")
 
@@ -39,27 +59,50 @@ def read_trades(trade_file, symbols):
 
 class DataOracle:
 
-  def __init__(self, historical_date = None, symbols = None, data_dir = None):
+  def __init__(self, historical_date = None, symbols = None, data_dir = None, cache_dir = None):
     self.historical_date = historical_date
     self.symbols = symbols
 
     self.mkt_open = None
 
-    # Read historical trades here...
-    h = historical_date
-    pre = 'ct' if h.year < 2015 else 'ctm'
-    trade_file = os.path.join(data_dir, 'trades', 'trades_{}'.format(h.year),
-                              '{}_{}{:02d}{:02d}.bgz'.format(pre, h.year, h.month, h.day))
+    # Trades are held per symbol as sorted arrays of times (integer ns since epoch) and prices,
+    # and the 1m bars as sorted arrays of times of day (integer ns since midnight) and open
+    # prices, so that a lookup is a binary search.  If cache_dir is given, they are memory-mapped
+    # from the binary cache of the historical date, which is first converted from the historical
+    # data files if necessary.  Otherwise the files are read for the requested symbols only.
+    self.trade_times, self.trade_prices = {}, {}
+    self.bar_times, self.bar_opens = {}, {}
+
+    then = dt.datetime.now()
 
-    bars_1m_file = os.path.join(data_dir, '1m_ohlc', '1m_ohlc_{}'.format(h.year),
-                              '{}{:02d}{:02d}_ohlc_1m.bgz'.format(h.year, h.month, h.day))
+    if cache_dir is not None:
+      if not HistoricalDataCache.exists(cache_dir, historical_date):
+        convert_historical_data(data_dir, historical_date, cache_dir)
 
-    log_print ("DataOracle initializing trades from file {}", trade_file)
-    log_print ("DataOracle initializing 1m bars from file {}", bars_1m_file)
+      log_print ("DataOracle initializing trades and 1m bars from cache {}", cache_dir)
+
+      cache = HistoricalDataCache(cache_dir, historical_date)
+      for symbol in symbols:
+        self.trade_times[symbol], cols = cache.load('trades', symbol, ['PRICE'])
+        self.trade_prices[symbol] = cols['PRICE']
+        self.bar_times[symbol], cols = cache.load('bars', symbol, ['open'])
+        self.bar_opens[symbol] = cols['open']
+
+    else:
+      # Read historical trades here...
+      trade_file, bars_1m_file = historical_data_files(data_dir, historical_date)
+
+      log_print ("DataOracle initializing trades from file {}", trade_file)
+      log_print ("DataOracle initializing 1m bars from file {}", bars_1m_file)
+
+      df_trades = read_trades(trade_file, symbols)
+      df_bars_1m = read_trades(bars_1m_file, symbols)
+
+      for symbol in symbols:
+        trades, bars = df_trades.loc[symbol], df_bars_1m.loc[symbol]
+        self.trade_times[symbol], self.trade_prices[symbol] = time_ns(trades.index), trades['PRICE'].values
+        self.bar_times[symbol], self.bar_opens[symbol] = time_ns(bars.index, time_of_day=True), bars['open'].values
 
-    then = dt.datetime.now()
-    self.df_trades = read_trades(trade_file, symbols)
-    self.df_bars_1m = read_trades(bars_1m_file, symbols)
     now = dt.datetime.now()
 
     log_print ("DataOracle initialized for {} with symbols {}", historical_date, symbols)
@@ -77,7 +120,12 @@ class DataOracle:
     log_print ("Oracle: client requested {} at market open: {}", symbol, mkt_open)
 
     # Find the opening historical price in the 1m OHLC bars for this symbol.
-    open = self.df_bars_1m.loc[(symbol,mkt_open.time()),'open']
+    bar_times = self.bar_times[symbol]
+    t = time_ns([mkt_open.time()], time_of_day=True)[0]
+    i = np.searchsorted(bar_times, t)
+    if i == len(bar_times) or bar_times[i] != t: raise KeyError((symbol, mkt_open.time()))
+
+    open = self.bar_opens[symbol][i]
     log_print ("Oracle: market open price was was {}", open)
 
     return int(round(open * 100)) if cents else open
@@ -89,18 +137,16 @@ class DataOracle:
 
     log_print ("Oracle: client requested {} as of {}", symbol, currentTime)
 
-    # See when the last historical trade was, prior to simulated currentTime.
-    dt_last_trade = self.df_trades.loc[symbol].index.asof(currentTime)
-    if pd.notnull(dt_last_trade):
-      last_trade = self.df_trades.loc[(symbol,dt_last_trade)]
-
-      price = last_trade['PRICE']
-      time = dt_last_trade
+    # See when the last historical trade was, at or prior to simulated currentTime.
+    i = np.searchsorted(self.trade_times[symbol], currentTime.value, side='right') - 1
+    if i >= 0:
+      price = self.trade_prices[symbol][i]
+      time = pd.Timestamp(self.trade_times[symbol][i])
 
     # If we know the market open time, and the last historical trade was before it, use
     # the market open price instead.  If there were no trades before the requested time,
     # also use the market open price.
-    if pd.isnull(dt_last_trade) or (self.mkt_open and time < self.mkt_open):
+    if i < 0 or (self.mkt_open and time < self.mkt_open):
       price = self.getDailyOpenPrice(symbol, self.mkt_open, cents=False)
       time = self.mkt_open
 
@@ -1,6 +1,8 @@
+import numpy as np
 import pandas as pd
+import os
 from util.util import log_print
-from bisect import bisect_left
+from util.oracle.FundamentalLog import FundamentalLog
 from math import sqrt
 
 
@@ -8,24 +10,44 @@ class ExternalFileOracle:
     """ Oracle using an external price series as the fundamental. The external series are specified files in the ABIDES
         config. If an agent requests the fundamental value in between two timestamps the returned fundamental value is
         linearly interpolated.
+
+        Each series is held as an int64 array of times (ns since epoch) and a float64 array of prices. If NumPy copies
+        of a series file exist (see save_fundamental_arrays), they are memory-mapped instead of unpickling the file.
+
+        Queried fundamental values are logged (see FundamentalLog) under log_policy ('all', 'dedup' or 'decimate' to a
+        grid of frequency log_freq) unless max_log is 0. If max_log is a positive integer, only the most recent max_log
+        logged queries per symbol are kept.
     """
-    def __init__(self, symbols):
+    def __init__(self, symbols, max_log=None, log_policy='all', log_freq=None):
         self.mkt_open = None
         self.symbols = symbols
+        self.times = {}
+        self.prices = {}
         self.fundamentals = self.load_fundamentals()
-        self.f_log = {symbol: [] for symbol in symbols}
+        self.f_log = {symbol: FundamentalLog(log_policy, log_freq, max_log) for symbol in symbols}
 
     def load_fundamentals(self):
-        """ Method extracts fundamentals for each symbol into DataFrames. Note that input files must be of the form
-            generated by util/formatting/mid_price_from_orderbook.py.
+        """ Method extracts fundamentals for each symbol into arrays of times and prices, and returns them as Series.
+            Note that input files must be of the form generated by util/formatting/mid_price_from_orderbook.py.
         """
         fundamentals = dict()
         log_print("Oracle: loading fundamental price series...")
         for symbol, params_dict in self.symbols.items():
             fundamental_file_path = params_dict['fundamental_file_path']
-            log_print("Oracle: loading {}", fundamental_file_path)
-            fundamental_df = pd.read_pickle(fundamental_file_path)
-            fundamentals.update({symbol: fundamental_df})
+            times_path, prices_path = fundamental_array_paths(fundamental_file_path)
+
+            if os.path.exists(times_path) and os.path.exists(prices_path):
+                log_print("Oracle: memory-mapping {} and {}", times_path, prices_path)
+                times = np.load(times_path, mmap_mode='r')
+                prices = np.load(prices_path, mmap_mode='r')
+            else:
+                log_print("Oracle: loading {}", fundamental_file_path)
+                fundamental_series = pd.read_pickle(fundamental_file_path)
+                times = fundamental_series.index.values.astype('datetime64[ns]').view(np.int64)
+                prices = fundamental_series.values.astype(np.float64)
+
+            self.times[symbol], self.prices[symbol] = times, prices
+            fundamentals.update({symbol: pd.Series(prices, index=pd.DatetimeIndex(times))})
 
         log_print("Oracle: loading fundamental price series complete!")
         return fundamentals
@@ -53,36 +75,45 @@ class ExternalFileOracle:
 
         log_print("Oracle: client requested {} as of {}", symbol, query_time)
 
-        fundamental_series = self.fundamentals[symbol]
-        time_of_query = pd.Timestamp(query_time)
+        price = float(self.getPricesAtTimes(symbol, np.array([pd.Timestamp(query_time).value]))[0])
+        log_print("Oracle: interpolated price is {}", price)
 
-        series_open_time = fundamental_series.index[0]
-        series_close_time = fundamental_series.index[-1]
+        return price
 
-        if time_of_query < series_open_time:  # time queried before open
-            return fundamental_series[0]
-        elif time_of_query > series_close_time:  # time queried after close
-            return fundamental_series[-1]
-        else:  # time queried during trading
+    def getPricesAtTimes(self, symbol, times):
+        """ Get the true prices of a symbol at an array of times, linearly interpolated between the nearest times of the
+            series before and after.  Times before the start (after the end) of the series get its first (last) price.
+            :param symbol: which symbol to query
+            :type symbol: str
+            :param times: at these times (ns since epoch)
+            :type times: np.ndarray of int64
+            :return np.ndarray of float prices:
+        """
+        series_times, series_prices = self.times[symbol], self.prices[symbol]
+
+        if len(series_times) == 1:
+            prices = np.full(len(times), float(series_prices[0]))
+            self.f_log[symbol].append(times, prices)
+            return prices
 
-            # find indices either side of requested time
-            lower_idx = bisect_left(fundamental_series.index, time_of_query) - 1
-            upper_idx = lower_idx + 1 if lower_idx < len(fundamental_series.index) - 1 else lower_idx
+        # Index of the first series time at or after each query time, clipped so that it and the one before it
+        # are valid.  Queries outside the series are then pinned to the first or last price by clipping x.
+        upper = np.clip(np.searchsorted(series_times, times, side='left'), 1, len(series_times) - 1)
+        lower = upper - 1
 
-            # interpolate between values
-            lower_val = fundamental_series[lower_idx]
-            upper_val = fundamental_series[upper_idx]
+        time_low, time_high = series_times[lower], series_times[upper]
+        price_low, price_high = series_prices[lower], series_prices[upper]
 
-            log_print(f"DEBUG: lower_idx: {lower_idx}, lower_val: {lower_val}, upper_idx: {upper_idx}, upper_val: {upper_val}")
+        delta_x = (time_high - time_low).astype(np.float64)
+        x_fwd = np.clip(times, time_low, time_high) - time_low
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(delta_x > 0, x_fwd / delta_x, 1.0)
 
-            interpolated_price = self.getInterpolatedPrice(query_time, fundamental_series.index[lower_idx],
-                                                           fundamental_series.index[upper_idx], lower_val, upper_val)
-            log_print("Oracle: latest historical trade was {} at {}. Next historical trade is {}. "
-                      "Interpolated price is {}", lower_val, query_time, upper_val, interpolated_price)
+        prices = price_low + frac * (price_high - price_low)
 
-            self.f_log[symbol].append({'FundamentalTime': query_time, 'FundamentalValue': interpolated_price})
+        self.f_log[symbol].append(times, prices)
 
-            return interpolated_price
+        return prices
 
     def observePrice(self, symbol, currentTime, sigma_n=0.0001, random_state=None):
         """ Make observation of price at a given time.
@@ -104,26 +135,46 @@ class ExternalFileOracle:
 
         return int(round(observed))
 
-    def getInterpolatedPrice(self, current_time, time_low, time_high, price_low, price_high):
-        """ Get the price at current_time, linearly interpolated between price_low and price_high measured at times
-            time_low and time_high
-            :param current_time: time for which price is to be interpolated
-            :type current_time: pd.Timestamp
-            :param time_low: time of first fundamental value
-            :type time_low: pd.Timestamp
-            :param time_high: time of first fundamental value
-            :type time_high: pd.Timestamp
-            :param price_low: first fundamental value
-            :type price_low: float
-            :param price_high: first fundamental value
-            :type price_high: float
-            :return float of interpolated price:
+    def observePrices(self, symbol, times, sigma_n=0.0001, random_state=None):
+        """ Make observations of price at several times, drawing the noise as the same number of calls to observePrice
+            would.
+        :param symbol: symbol for which to observe prices
+        :type symbol: str
+        :param times: times of observation
+        :type times: pd.DatetimeIndex, list of pd.Timestamp or np.ndarray of int64 ns since epoch
+        :param sigma_n: Observation noise parameter
+        :type sigma_n: float
+        :param random_state: random state for Agent making observation
+        :type random_state: np.RandomState
+        :return: np.ndarray of int64, prices in cents
+        """
+        true_prices = self.getPricesAtTimes(symbol, pd.DatetimeIndex(times).asi8)
+        if sigma_n == 0:
+            observed = true_prices
+        else:
+            observed = random_state.normal(loc=true_prices, scale=sqrt(sigma_n))
+
+        return np.round(observed).astype(np.int64)
+
+    def get_fundamental_log(self, symbol):
+        """ Returns the logged fundamental values for symbol, oldest first, as a DataFrame with columns
+            FundamentalTime and FundamentalValue.
         """
-        log_print(f'DEBUG: current_time: {current_time} time_low {time_low} time_high: {time_high} price_low:  {price_low} price_high: {price_high}' )
-        delta_y = price_high - price_low
-        delta_x = (time_high - time_low).total_seconds()
+        return self.f_log[symbol].to_frame()
+
+
+def fundamental_array_paths(fundamental_file_path):
+    """ Returns the paths of the NumPy copies (times and prices) of a fundamental series file. """
+    return fundamental_file_path + '.times.npy', fundamental_file_path + '.prices.npy'
 
-        slope = delta_y / delta_x if price_low != price_high else 0
-        x_fwd = (current_time - time_low).total_seconds()
 
-        return price_low + (x_fwd * slope)
+def save_fundamental_arrays(fundamental_file_path):
+    """ Saves NumPy copies of the fundamental series pickled at fundamental_file_path, as an int64 array of times
+        (ns since epoch) and a float64 array of prices, which ExternalFileOracle then memory-maps instead of
+        unpickling the series.
+    """
+    fundamental_series = pd.read_pickle(fundamental_file_path)
+    times_path, prices_path = fundamental_array_paths(fundamental_file_path)
+
+    np.save(times_path, fundamental_series.index.values.astype('datetime64[ns]').view(np.int64))
+    np.save(prices_path, fundamental_series.values.astype(np.float64))
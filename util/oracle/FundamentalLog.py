@@ -0,0 +1,103 @@
+# Columnar log of fundamental values kept by an oracle for one symbol, written out by the ExchangeAgent at the end of
+# the simulation (as fundamental_<symbol> through the kernel's writeLog).
+#
+# Times (integer ns since epoch) and values are held in preallocated arrays that double in size when full, and which
+# entries are kept is set by a policy:
+#
+#   'all'       every entry
+#   'dedup'     only the first of consecutive entries with the same time (e.g. several agents observing at once)
+#   'decimate'  only the first entry in each interval of a grid of frequency freq (e.g. '1s')
+#
+# If max_size is given, only the most recent max_size kept entries are retained, in a ring buffer.
+
+import numpy as np
+import pandas as pd
+
+LOG_POLICIES = ('all', 'dedup', 'decimate')
+
+
+def log_mask(times, policy='all', freq=None, last_time=None):
+    """ Returns a boolean mask of the entries at times (int64 array, ns since epoch) to keep under policy, given the
+        time of the last entry already kept (or None).
+    """
+    if policy == 'all': return np.ones(len(times), dtype=bool)
+
+    if policy == 'dedup':
+        keys, last_key = times, last_time
+    elif policy == 'decimate':
+        step = pd.Timedelta(freq).value
+        keys, last_key = times // step, None if last_time is None else last_time // step
+    else:
+        raise ValueError("Unknown fundamental log policy: {}".format(policy))
+
+    prev = np.empty(len(keys), dtype=np.int64)
+    prev[1:] = keys[:-1]
+    mask = prev != keys
+    if len(keys): mask[0] = last_key is None or keys[0] != last_key
+
+    return mask
+
+
+class FundamentalLog:
+
+    def __init__(self, policy='all', freq=None, max_size=None):
+        if policy not in LOG_POLICIES:
+            raise ValueError("Unknown fundamental log policy: {}".format(policy))
+        if policy == 'decimate' and freq is None:
+            raise ValueError("The decimate fundamental log policy requires freq")
+
+        self.policy = policy
+        self.freq = freq
+        self.max_size = max_size
+
+        size = 1024 if max_size is None else max_size
+        self.times = np.empty(size, dtype=np.int64)
+        self.values = np.empty(size)
+
+        # Number of valid entries, and (for a ring) the position of the next entry to write.
+        self.n = 0
+        self.i = 0
+        self.last_time = None
+
+    def __len__(self):
+        return self.n
+
+    def append(self, times, values):
+        """ Appends arrays of times (ns since epoch) and values, subject to the policy. """
+        if self.max_size == 0 or len(times) == 0: return
+
+        times = np.asarray(times, dtype=np.int64)
+        values = np.asarray(values)
+
+        if self.policy != 'all':
+            mask = log_mask(times, self.policy, self.freq, self.last_time)
+            times, values = times[mask], values[mask]
+            if len(times) == 0: return
+
+        self.last_time = int(times[-1])
+
+        if self.max_size is None:
+            m = self.n + len(times)
+            if m > len(self.times):
+                grow = max(len(self.times), len(times))
+                self.times = np.concatenate((self.times, np.empty(grow, dtype=np.int64)))
+                self.values = np.concatenate((self.values, np.empty(grow)))
+            self.times[self.n:m], self.values[self.n:m] = times, values
+            self.n = m
+            return
+
+        # Bounded: only the last max_size entries can survive, written around the ring.
+        times, values = times[-self.max_size:], values[-self.max_size:]
+        idx = (self.i + np.arange(len(times))) % self.max_size
+        self.times[idx], self.values[idx] = times, values
+        self.n = min(self.n + len(times), self.max_size)
+        self.i = (self.i + len(times)) % self.max_size
+
+    def to_frame(self):
+        """ Returns the log, oldest first, as a DataFrame with columns FundamentalTime and FundamentalValue. """
+        if self.max_size is None or self.n < self.max_size:
+            t, v = self.times[:self.n], self.values[:self.n]
+        else:
+            t, v = np.roll(self.times, -self.i), np.roll(self.values, -self.i)
+
+        return pd.DataFrame({'FundamentalTime': pd.to_datetime(t), 'FundamentalValue': v})
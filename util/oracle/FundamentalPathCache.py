@@ -0,0 +1,128 @@
+# On-disk cache of precomputed fundamental value paths, shared by the runs (and concurrent processes) of a sweep.
+#
+# A path is an int64 array of shape (2, n): times (integer ns since epoch) and fundamental values (integer cents).
+# It is stored as <key>.npy in the cache directory, where the key is a hash of everything the path depends on
+# (oracle class, symbol parameters, the state of the random state that generates it, time window and sampling
+# frequency), together with <key>.pkl holding the random state as it was after generating the path, so that a run
+# which loads the path continues with exactly the same random numbers as one which computed it.
+#
+# Paths are loaded as read-only memory maps, so concurrent processes share the same pages.  Entries are written to
+# a temporary file and renamed into place, so a reader never sees a partial entry and processes that compute the
+# same path at the same time simply replace it with an identical copy.  The cache can be bounded by total size and
+# number of entries, in which case the least recently used entries (by modification time, which is refreshed on
+# every load) are evicted after each store.
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+from util.util import log_print
+
+
+class FundamentalPathCache:
+
+    def __init__(self, cache_dir, max_bytes=None, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, oracle, params, random_state, mkt_open, mkt_close, freq):
+        """ Returns the cache key for the path generated by oracle (an instance) for one symbol's params (dict, any
+            random_state entry is ignored) from the current state of random_state, between mkt_open and mkt_close
+            at the sampling frequency freq.
+        """
+        h = hashlib.sha256()
+        h.update(type(oracle).__name__.encode())
+        h.update(repr(sorted((k, repr(v)) for k, v in params.items() if k != 'random_state')).encode())
+
+        name, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+        h.update(repr((name, pos, has_gauss, cached_gaussian)).encode())
+        h.update(np.ascontiguousarray(keys).tobytes())
+
+        h.update(repr((str(mkt_open), str(mkt_close), str(freq))).encode())
+
+        return h.hexdigest()
+
+    def load(self, key):
+        """ Returns (path, random state after generation) for key, with the path memory-mapped read-only, or None if
+            the key is not cached.
+        """
+        npy, pkl = self._paths(key)
+        try:
+            with open(pkl, 'rb') as f:
+                state = pickle.load(f)
+            path = np.load(npy, mmap_mode='r')
+            os.utime(npy)
+        except (FileNotFoundError, EOFError, ValueError):
+            return None
+
+        log_print("Fundamental path cache hit: {}", key)
+        return path, state
+
+    def store(self, key, path, state):
+        """ Stores path (int64 array of shape (2, n)) and the random state after its generation under key, then
+            evicts least recently used entries beyond the cache limits.
+        """
+        npy, pkl = self._paths(key)
+
+        # The random state goes first: an entry only exists once its path is in place.
+        self._replace(pkl, lambda f: pickle.dump(state, f))
+        self._replace(npy, lambda f: np.save(f, np.asarray(path, dtype=np.int64)))
+
+        log_print("Fundamental path cache store: {}", key)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """ Removes least recently used entries (other than keep) until the cache is within its limits. """
+        if self.max_bytes is None and self.max_entries is None: return
+
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.npy'): continue
+            key = filename[:-len('.npy')]
+            try:
+                size = sum(os.path.getsize(p) for p in self._paths(key) if os.path.exists(p))
+                entries.append((os.path.getmtime(os.path.join(self.cache_dir, filename)), key, size))
+            except FileNotFoundError:
+                continue
+
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        count = len(entries)
+
+        for _, key, size in entries:
+            if (self.max_bytes is None or total <= self.max_bytes) and \
+               (self.max_entries is None or count <= self.max_entries):
+                break
+            if key == keep: continue
+
+            # Processes that have the path mapped keep their mapping after the file is removed.
+            for p in self._paths(key):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+            log_print("Fundamental path cache evicted: {}", key)
+            total -= size
+            count -= 1
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.npy'), os.path.join(self.cache_dir, key + '.pkl')
+
+    def _replace(self, target, write):
+        # Writes a file via write(f) under a temporary name, then atomically renames it to target.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
@@ -0,0 +1,101 @@
+# Binary cache of the historical trades and 1-minute bars read by the DataOracle, so that a run loads only the
+# symbols it needs from memory-mapped arrays instead of decompressing and unpickling a whole day of data.
+#
+# The cache for one date is a directory <cache_dir>/<YYYYMMDD> holding, for each kind of data ('trades' and 'bars'),
+# one .npy file per column with the rows of all symbols, sorted by symbol and then time:
+#
+#   <kind>_time.npy       int64 time of each row: ns since epoch for trades, ns since midnight for bars
+#   <kind>_<COLUMN>.npy   the values of each numeric column of the source data (e.g. trades_PRICE, bars_open)
+#
+# and a small index.json giving, for each kind, its columns and the [start, end) rows of each symbol.  The index is
+# written last, so a directory without one is incomplete and is ignored.  Rows with a duplicate (symbol, time) are
+# dropped, keeping the first, as DataOracle.read_trades does.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+KINDS = ('trades', 'bars')
+
+
+def historical_cache_dir(cache_dir, historical_date):
+    """ Returns the cache directory for historical_date (pd.Timestamp). """
+    h = historical_date
+    return os.path.join(cache_dir, '{}{:02d}{:02d}'.format(h.year, h.month, h.day))
+
+
+def time_ns(times, time_of_day=False):
+    """ Returns times (datetimes, as a DatetimeIndex or any sequence pd.DatetimeIndex accepts) as an int64 array of
+        ns since epoch.  If time_of_day, returns ns since midnight instead, and times may also be datetime.time
+        objects.
+    """
+    if not time_of_day:
+        return pd.DatetimeIndex(times).asi8
+
+    if isinstance(times, pd.DatetimeIndex):
+        return times.asi8 - times.normalize().asi8
+
+    return np.array([((t.hour * 60 + t.minute) * 60 + t.second) * 10 ** 9 + t.microsecond * 1000 for t in times],
+                    dtype=np.int64)
+
+
+def write_historical_cache(cache_dir, historical_date, df_trades, df_bars):
+    """ Writes the cache for historical_date from the trades and 1-minute bars DataFrames of that date (indexed by
+        symbol and then time, as read from the historical data files).
+    """
+    path = historical_cache_dir(cache_dir, historical_date)
+    os.makedirs(path, exist_ok=True)
+
+    index = {}
+    for kind, df in zip(KINDS, (df_trades, df_bars)):
+        df = df[~df.index.duplicated(keep='first')].sort_index()
+        symbols = df.index.get_level_values(0)
+        names, starts = np.unique(np.asarray(symbols), return_index=True)
+        ends = np.append(starts[1:], len(df))
+
+        columns = [c for c in df.columns if np.issubdtype(df[c].dtype, np.number)]
+        np.save(os.path.join(path, '{}_time.npy'.format(kind)),
+                time_ns(df.index.get_level_values(1), time_of_day=(kind == 'bars')))
+        for c in columns:
+            np.save(os.path.join(path, '{}_{}.npy'.format(kind, c)), df[c].values)
+
+        index[kind] = {'columns': [str(c) for c in columns],
+                       'symbols': {str(s): [int(a), int(b)] for s, a, b in zip(names, starts, ends)}}
+
+    tmp = os.path.join(path, 'index.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(path, 'index.json'))
+
+
+class HistoricalDataCache:
+    """ Reader of the cache for one date.  Columns are memory-mapped, so loading a symbol reads only its rows. """
+
+    def __init__(self, cache_dir, historical_date):
+        self.path = historical_cache_dir(cache_dir, historical_date)
+
+        with open(os.path.join(self.path, 'index.json')) as f:
+            self.index = json.load(f)
+
+        self.arrays = {}
+
+    @staticmethod
+    def exists(cache_dir, historical_date):
+        return os.path.exists(os.path.join(historical_cache_dir(cache_dir, historical_date), 'index.json'))
+
+    def column(self, kind, column):
+        if (kind, column) not in self.arrays:
+            self.arrays[(kind, column)] = np.load(os.path.join(self.path, '{}_{}.npy'.format(kind, column)),
+                                                  mmap_mode='r')
+        return self.arrays[(kind, column)]
+
+    def load(self, kind, symbol, columns=None):
+        """ Returns (times, {column: values}) for the rows of symbol in kind ('trades' or 'bars'), for all columns or
+            only those requested.  Raises KeyError if the symbol is not in the cache.
+        """
+        start, end = self.index[kind]['symbols'][symbol]
+        if columns is None: columns = self.index[kind]['columns']
+
+        return self.column(kind, 'time')[start:end], {c: self.column(kind, c)[start:end] for c in columns}
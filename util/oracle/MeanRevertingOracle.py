@@ -1,6 +1,6 @@
 ### The MeanRevertingOracle requires three parameters: a mean fundamental value,
-### a mean reversion coefficient, and a shock variance.  It constructs and retains
-### a fundamental value time series for each requested symbol, and provides noisy
+### a mean reversion coefficient, and a shock variance.  It samples a fundamental
+### value time series for each requested symbol, and provides noisy
 ### observations of those values upon agent request.  The expectation is that
 ### agents using such an oracle will know the mean-reverting equation and all
 ### relevant parameters, but will not know the random shocks applied to the
@@ -9,16 +9,24 @@
 ### Historical dates are effectively meaningless to this oracle.  It is driven by
 ### the numpy random number seed contained within the experimental config file.
 ### This oracle uses the nanoseconds portion of the current simulation time as
-### discrete "time steps".  A suggestion: to keep wallclock runtime reasonable,
-### have the agents operate for only ~1000 nanoseconds, but interpret nanoseconds
-### as seconds or minutes.
+### discrete "time steps".
 
+### The series is never materialized one value per time step.  The mean-reverting
+### process has closed-form multi-step transition moments, so the value at any
+### requested time step is sampled exactly, given the values already sampled for
+### that symbol: forward from the latest one, or as a bridge between the two
+### neighbouring ones if an earlier time is requested.  Sampled values are
+### remembered, so memory depends on the number of distinct times queried rather
+### than on the length of the trading day.
+
+import bisect
 import datetime as dt
 import numpy as np
 import pandas as pd
+from scipy.signal import lfilter
 from util import util
 
-from math import sqrt
+from math import exp, expm1, log1p, sqrt
 from util.util import log_print
 
 
@@ -26,81 +34,147 @@ class MeanRevertingOracle:
 
   def __init__(self, mkt_open, mkt_close, symbols):
     # Symbols must be a dictionary of dictionaries with outer keys as symbol names and
-    # inner keys: r_bar, kappa, sigma_s.
+    # inner keys: r_bar, kappa, sigma_s, and optionally type (default stock).  ETF symbols
+    # also require a portfolio: the list of stock symbols whose values they sum.
     self.mkt_open = mkt_open
     self.mkt_close = mkt_close
     self.symbols = symbols
 
-    # The dictionary r holds the fundamenal value series for each symbol.
+    # For each stock symbol, the time steps (ns after mkt_open) at which the fundamental value
+    # has been sampled, in increasing order, and the (unrounded) values at those steps.  The
+    # series starts from r_bar at the open.
+    self.t = {}
     self.r = {}
 
-    then = dt.datetime.now()
-
-    # divide symbols upon their type
-    stock_symbols = []
-    etf_symbols = []
-    for s in symbols:
-      if symbols[s]["type"] == util.SymbolType.Stock:
-        stock_symbols += [s]
-      elif symbols[s]["type"] == util.SymbolType.ETF:
-        etf_symbols += [s]
-      else:
-        raise NameError('Type  ' + str(symbols[s]["type"]) + " is unkwonw")
+    # The random state used to sample each stock symbol's series.
+    self.random_state = {}
 
-    for symbol in stock_symbols:
-      s = symbols[symbol]
-      r_bar, kappa, sigma_s = s["r_bar"], s["kappa"], s["sigma_s"]
-      log_print ("MeanRevertingOracle computing fundamental value series for {}", symbol)
-      self.r[symbol] = self.generate_fundamental_value_series(symbol, r_bar, kappa, sigma_s )
+    # The portfolio of each ETF symbol.
+    self.portfolios = {}
 
-    for etf_symbol in etf_symbols:
-      underline_symbols = symbols[etf_symbol]["portfolio"]
-      out_fvalue = None
-      for un_sym in underline_symbols:
-        out_fvalue = np.asarray(self.r[un_sym]) if out_fvalue is None else out_fvalue + self.r[un_sym]
-      self.r[etf_symbol] = out_fvalue
+    then = dt.datetime.now()
 
-    #for s in symbols:
-    #  print("Fondamnetal ", s, self.r[s])
+    for symbol, s in symbols.items():
+      symbol_type = s.get("type", util.SymbolType.Stock)
+      if symbol_type == util.SymbolType.Stock:
+        self.t[symbol] = [0]
+        self.r[symbol] = [float(s["r_bar"])]
+
+        # Because the series is sampled lazily, only a seed is taken from the global np.random
+        # PRNG here.  It is still important to create the oracle BEFORE the agents, so that the
+        # addition of a new agent will not affect the series.  (Observations using the oracle will
+        # use an agent's PRNG and thus not cause a problem.)
+        self.random_state[symbol] = s["random_state"] if "random_state" in s else \
+                                    np.random.RandomState(seed=np.random.randint(low=0, high=2**32))
+      elif symbol_type == util.SymbolType.ETF:
+        self.portfolios[symbol] = s["portfolio"]
+      else:
+        raise NameError('Type  ' + str(symbol_type) + " is unkwonw")
 
     now = dt.datetime.now()
 
     log_print ("MeanRevertingOracle initialized for symbols {}", symbols)
     log_print ("MeanRevertingOracle initialization took {}", now - then)
 
-  def generate_fundamental_value_series(self, symbol, r_bar, kappa, sigma_s):
-    # Generates the fundamental value series for a single stock symbol.  r_bar is the
-    # mean fundamental value, kappa is the mean reversion coefficient, and sigma_s
-    # is the shock variance.  (Note: NOT STANDARD DEVIATION.)
-
-    # Because the oracle uses the global np.random PRNG to create the fundamental value
-    # series, it is important to create the oracle BEFORE the agents.  In this way the
-    # addition of a new agent will not affect the sequence created.  (Observations using
-    # the oracle will use an agent's PRNG and thus not cause a problem.)
+  def transition_moments(self, s, k):
+    # Returns the factor by which the deviation from r_bar decays over k time steps, and the
+    # variance of the shocks accumulated over those steps, for the process
+    # r[t] = kappa * r_bar + (1 - kappa) * r[t-1] + shock[t], where shock has variance sigma_s.
+    # (Note: NOT STANDARD DEVIATION.)  Logarithms keep both accurate for the tiny kappa
+    # typically used with nanosecond time steps.
+    kappa, sigma_s = s['kappa'], s['sigma_s']
+
+    if kappa == 0:
+      return 1.0, sigma_s * k
+    elif kappa < 1:
+      log_a = log1p(-kappa)
+      return exp(k * log_a), sigma_s * expm1(2 * k * log_a) / expm1(2 * log_a)
+    else:
+      a = 1 - kappa
+      return a ** k, sigma_s * (1 - a ** (2 * k)) / (1 - a * a)
+
+  def sample_fundamental_value(self, symbol, step):
+    # Returns the (unrounded) fundamental value of a stock symbol at a time step, sampling and
+    # remembering it if it has not been sampled before.
+    times, values = self.t[symbol], self.r[symbol]
+
+    # In a forward-running simulation, almost every new time is after the latest one sampled, and its
+    # value is simply appended.  Only earlier times need a search and an insertion.
+    if step > times[-1]:
+      i = len(times)
+    else:
+      i = bisect.bisect_left(times, step)
+      if times[i] == step: return values[i]
 
-    # Turn variance into std.
-    sigma_s = sqrt(sigma_s)
+    s = self.symbols[symbol]
+    r_bar = s['r_bar']
 
-    # Create the time series into which values will be projected and initialize the first value.
-    date_range = pd.date_range(self.mkt_open, self.mkt_close, closed='left', freq='N')
+    # The value is normally distributed given the previous sampled value...
+    decay, var = self.transition_moments(s, step - times[i-1])
+    mean = decay * (values[i-1] - r_bar)
 
-    s = pd.Series(index=date_range)
-    r = np.zeros(len(s.index))
-    r[0] = r_bar
+    # ...and, if a later value was already sampled, given that value as well.
+    if i < len(times) and var > 0:
+      decay_next, var_next = self.transition_moments(s, times[i] - step)
+      precision = 1 / var + decay_next ** 2 / var_next
+      mean = (mean / var + decay_next * (values[i] - r_bar) / var_next) / precision
+      var = 1 / precision
 
-    # Predetermine the random shocks for all time steps (at once, for computation speed).
-    shock = np.random.normal(scale=sigma_s, size=(r.shape[0]))
+    # The process is not permitted to become negative.
+    v = max(0, self.random_state[symbol].normal(loc = r_bar + mean, scale = sqrt(var)))
 
-    # Compute the mean reverting fundamental value series.
-    for t in range(1, r.shape[0]):
-      r[t] = max(0, (kappa * r_bar) + ( (1 - kappa) * r[t-1] ) + shock[t])
+    if i == len(times):
+      times.append(step)
+      values.append(v)
+    else:
+      times.insert(i, step)
+      values.insert(i, v)
+
+    return v
+
+  def get_fundamental_value(self, symbol, currentTime):
+    # Returns the fundamental value of a symbol at currentTime in integer cents.  After the
+    # close, this is the value just before the close.  An ETF's value is the sum of the values
+    # of its portfolio.
+    if symbol in self.portfolios:
+      return sum(self.get_fundamental_value(s, currentTime) for s in self.portfolios[symbol])
+
+    if currentTime >= self.mkt_close: currentTime = self.mkt_close - pd.Timedelta('1ns')
+    step = max(0, (currentTime - self.mkt_open).value)
+
+    return int(round(self.sample_fundamental_value(symbol, step)))
+
+  def generate_fundamental_value_series(self, symbol, freq='1min'):
+    # Returns the fundamental value series of a stock symbol on a grid of times from the open
+    # (inclusive) to the close (exclusive) at the given frequency, as a pd.Series of integer
+    # cents.  Grid times are sampled and remembered as if they had been observed, except that
+    # the part of the grid after the latest value sampled so far is drawn in one vectorized
+    # pass, applying the non-negative floor only to the resulting values.
+    s = self.symbols[symbol]
+    times, values = self.t[symbol], self.r[symbol]
+
+    grid = pd.date_range(self.mkt_open, self.mkt_close, closed='left', freq=freq)
+    steps = (grid - self.mkt_open).values.astype(np.int64)
+
+    # Grid times up to the latest value, and the first one after it, are sampled one at a time.
+    first_future = np.searchsorted(steps, times[-1], side='right')
+    for step in steps[:first_future + 1]: self.sample_fundamental_value(symbol, int(step))
+
+    future = steps[first_future + 1:]
+    if len(future) > 0:
+      gaps = np.diff(steps[first_future:])
+      if np.all(gaps == gaps[0]):
+        # The remaining grid is regular: deviations from r_bar follow a first order linear recursion.
+        decay, var = self.transition_moments(s, int(gaps[0]))
+        shocks = self.random_state[symbol].normal(scale = sqrt(var), size = len(future))
+        deviation, _ = lfilter([1], [1, -decay], shocks, zi = [decay * (values[-1] - s['r_bar'])])
+        times.extend(future.tolist())
+        values.extend(np.maximum(0, s['r_bar'] + deviation).tolist())
+      else:
+        for step in future: self.sample_fundamental_value(symbol, int(step))
 
-    # Replace the series values with the fundamental value series.  Round and convert to
-    # integer cents.
-    s[:] = np.round(r)
-    s = s.astype(int)
-    
-    return (s)
+    series = [self.sample_fundamental_value(symbol, int(step)) for step in steps]
+    return pd.Series(np.round(series).astype(int), index = grid)
 
 
   # Return the daily open price for the symbol given.  In the case of the MeanRevertingOracle,
@@ -114,7 +188,7 @@ class MeanRevertingOracle:
   
     log_print ("Oracle: client requested {} at market open: {}", symbol, self.mkt_open)
   
-    open = self.r[symbol].loc[self.mkt_open]
+    open = self.get_fundamental_value(symbol, self.mkt_open)
     log_print ("Oracle: market open price was was {}", open)
   
     return open
@@ -132,11 +206,8 @@ class MeanRevertingOracle:
   # each agent will receive the same answers across multiple same-seed simulations
   # even if a new agent has been added to the experiment.
   def observePrice(self, symbol, currentTime, sigma_n = 1000, random_state = None):
-    # If the request is made after market close, return the close price.
-    if currentTime >= self.mkt_close:
-      r_t = self.r[symbol].loc[self.mkt_close - pd.Timedelta('1ns')]
-    else:
-      r_t = self.r[symbol].loc[currentTime]
+    # If the request is made after market close, this is the close price.
+    r_t = self.get_fundamental_value(symbol, currentTime)
  
     # Generate a noisy observation of fundamental value at the current time.
     if sigma_n == 0:
@@ -20,6 +20,7 @@
 ### or minutes, spread out across the day.
 
 from util.oracle.MeanRevertingOracle import MeanRevertingOracle
+from util.oracle.FundamentalLog import LOG_POLICIES, log_mask
 
 import datetime as dt
 import numpy as np
@@ -34,18 +35,40 @@ from util import util
 
 class SparseMeanRevertingOracle(MeanRevertingOracle):
 
-  def __init__(self, mkt_open, mkt_close, symbols):
+  def __init__(self, mkt_open, mkt_close, symbols, path_freq=None, path_cache=None, log_policy='all', log_freq=None):
     # Symbols must be a dictionary of dictionaries with outer keys as symbol names and
     # inner keys: r_bar, kappa, sigma_s.
+    #
+    # If path_freq (e.g. '100ms') is given, the whole fundamental path from open to close is
+    # computed at construction on a grid of that frequency, with megashock arrivals drawn from
+    # the symbol's random_state rather than the global numpy PRNG, so the path depends only on
+    # the symbol parameters, random_state and time window.  Such a path can then be shared
+    # between runs through path_cache (a FundamentalPathCache): it is loaded read-only from
+    # the cache if present, and stored there otherwise.
+    #
+    # The fundamental log written at the end of the simulation holds every computed value, or
+    # only some of them under log_policy (see FundamentalLog): 'dedup' or 'decimate' to a grid
+    # of frequency log_freq.  The oracle itself keeps every value, which later queries may need.
     self.mkt_open = mkt_open
     self.mkt_close = mkt_close
     self.symbols = symbols
-    self.f_log = {}
-    self.t_log = {}
     self.fundamental_computed = {}
-    self.t_i = {}
-    self.t_j = {}
-
+    self.path_freq = path_freq
+    self.path_cache = path_cache
+    self.log_policy = log_policy
+    self.log_freq = log_freq
+
+    if log_policy not in LOG_POLICIES:
+      raise ValueError("Unknown fundamental log policy: {}".format(log_policy))
+    if log_policy == 'decimate' and log_freq is None:
+      raise ValueError("The decimate fundamental log policy requires log_freq")
+
+    # The log of computed fundamental values for each symbol: times (integer ns since epoch, increasing) in
+    # t_log and values (integer cents) in f_log.  Both are preallocated arrays that double in size when full,
+    # of which only the first n_log entries are valid, so a lookup is a binary search.
+    self.t_log = {}
+    self.f_log = {}
+    self.n_log = {}
 
     # The dictionary r holds the most recent fundamental values for each symbol.
     self.r = {}
@@ -60,28 +83,26 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
 
     then = dt.datetime.now()
 
-    # Note that each value in the self.r dictionary is a 2-tuple of the timestamp at
-    # which the series was computed and the true fundamental value at that time.
+    # Note that each value in the self.r dictionary is a 2-tuple of the time (integer ns since
+    # epoch) at which the series was computed and the true fundamental value at that time.
 
     for symbol in symbols:
       s = symbols[symbol]
+
+      if path_freq is not None:
+        self.compute_fundamental_path(symbol)
+        continue
+
       log_print ("SparseMeanRevertingOracle computing initial fundamental value for {}", symbol)
-      self.r[symbol] = (mkt_open, s['r_bar'])
-      self.f_log[symbol] = [{ 'FundamentalTime' : mkt_open, 'FundamentalValue' : s['r_bar'] }]
-      self.t_log[symbol] = [mkt_open]
+      self.r[symbol] = (mkt_open.value, s['r_bar'])
+      self.t_log[symbol] = np.empty(1024, dtype=np.int64)
+      self.f_log[symbol] = np.empty(1024, dtype=np.int64)
+      self.n_log[symbol] = 0
+      self.log_fundamental(symbol, mkt_open.value, s['r_bar'])
       self.fundamental_computed[symbol] = False
-      self.t_i[symbol] = 0
-      self.t_j[symbol] = 0
-
-      # Compute the time and value of the first megashock.  Note that while the values are
-      # mean-zero, they are intentionally bimodal (i.e. we always want to push the stock
-      # some, but we will tend to cancel out via pushes in opposite directions).
-      ms_time_delta = np.random.exponential(scale=1.0 / s['megashock_lambda_a'])
-      mst = self.mkt_open + pd.Timedelta(ms_time_delta, unit='ns')
-      msv = s['random_state'].normal(loc = s['megashock_mean'], scale = sqrt(s['megashock_var']))
-      msv = msv if s['random_state'].randint(2) == 0 else -msv
 
-      self.megashocks[symbol] = [{ 'MegashockTime' : mst, 'MegashockValue' : msv }]
+      # Compute the time and value of the first megashock.
+      self.init_megashocks(symbol, np.random)
 
 
     now = dt.datetime.now()
@@ -90,11 +111,106 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     log_print ("SparseMeanRevertingOracle initialization took {}", now - then)
 
 
+  # Draws the first megashock for symbol, with its arrival interval from the PRNG rng.  Note that
+  # while the values are mean-zero, they are intentionally bimodal (i.e. we always want to push the
+  # stock some, but we will tend to cancel out via pushes in opposite directions).  Megashock times
+  # are integer ns since epoch (the exponential interval truncated to whole ns).
+  def init_megashocks(self, symbol, rng):
+    s = self.symbols[symbol]
+
+    mst = self.mkt_open.value + int(rng.exponential(scale=1.0 / s['megashock_lambda_a']))
+    msv = s['random_state'].normal(loc = s['megashock_mean'], scale = sqrt(s['megashock_var']))
+    msv = msv if s['random_state'].randint(2) == 0 else -msv
+
+    self.megashocks[symbol] = [{ 'MegashockTime' : mst, 'MegashockValue' : msv }]
+
+
+  # Computes the whole fundamental path for symbol on the path_freq grid from open to close (the
+  # last point being one ns before the close), or attaches to it in the path cache.  Either way,
+  # the symbol's random_state is left in the same state and every later query is a lookup.
+  def compute_fundamental_path(self, symbol):
+    s = self.symbols[symbol]
+    freq = pd.Timedelta(self.path_freq).value
+
+    times = np.arange(self.mkt_open.value + freq, self.mkt_close.value - 1, freq, dtype=np.int64)
+    times = np.append(times, self.mkt_close.value - 1)
+
+    key = None
+    if self.path_cache is not None:
+      key = self.path_cache.key(self, s, s['random_state'], self.mkt_open, self.mkt_close, self.path_freq)
+      cached = self.path_cache.load(key)
+
+      if cached is not None:
+        path, state = cached
+        log_print ("SparseMeanRevertingOracle attached cached fundamental path for {}", symbol)
+
+        # The megashocks are not cached: they are only needed to extend a path.
+        self.t_log[symbol], self.f_log[symbol] = path[0], path[1]
+        self.n_log[symbol] = path.shape[1]
+        self.r[symbol] = (int(path[0, -1]), int(path[1, -1]))
+        self.megashocks[symbol] = []
+        self.fundamental_computed[symbol] = True
+        s['random_state'].set_state(state)
+        return
+
+    log_print ("SparseMeanRevertingOracle computing fundamental path for {}", symbol)
+
+    self.r[symbol] = (self.mkt_open.value, s['r_bar'])
+    self.t_log[symbol] = np.empty(len(times) + 1024, dtype=np.int64)
+    self.f_log[symbol] = np.empty(len(times) + 1024, dtype=np.int64)
+    self.n_log[symbol] = 0
+    self.log_fundamental(symbol, self.mkt_open.value, s['r_bar'])
+    self.init_megashocks(symbol, s['random_state'])
+    self.advance_fundamental_value_grid(symbol, times, rng = s['random_state'])
+    self.fundamental_computed[symbol] = True
+
+    if key is not None:
+      n = self.n_log[symbol]
+      self.path_cache.store(key, np.stack((self.t_log[symbol][:n], self.f_log[symbol][:n])),
+                            s['random_state'].get_state())
+
+
+  # Appends a time (integer ns since epoch) and fundamental value, or arrays of times and values,
+  # to the log for symbol.
+  def log_fundamental(self, symbol, ts, v):
+    n = self.n_log[symbol]
+    m = n + np.size(ts)
+    if m > len(self.t_log[symbol]):
+      grow = max(len(self.t_log[symbol]), m - n)
+      self.t_log[symbol] = np.concatenate((self.t_log[symbol], np.empty(grow, dtype=np.int64)))
+      self.f_log[symbol] = np.concatenate((self.f_log[symbol], np.empty(grow, dtype=np.int64)))
+
+    self.t_log[symbol][n:m] = ts
+    self.f_log[symbol][n:m] = v
+    self.n_log[symbol] = m
+
+
+  # Returns the logged fundamental value for symbol at time ts (integer ns since epoch), i.e. the
+  # value computed at the latest logged time no later than ts.
+  def lookup_fundamental(self, symbol, ts):
+    n = self.n_log[symbol]
+    i = np.searchsorted(self.t_log[symbol][:n], ts, side='right') - 1
+    return int(self.f_log[symbol][max(i, 0)])
+
+
+  # Returns the log of computed fundamental values for symbol, under the log policy, as a
+  # DataFrame with columns FundamentalTime and FundamentalValue.
+  def get_fundamental_log(self, symbol):
+    n = self.n_log[symbol]
+    t, f = self.t_log[symbol][:n], self.f_log[symbol][:n]
+
+    if self.log_policy != 'all':
+      mask = log_mask(t, self.log_policy, self.log_freq)
+      t, f = t[mask], f[mask]
+
+    return pd.DataFrame({ 'FundamentalTime' : pd.to_datetime(t), 'FundamentalValue' : f })
+
+
   # This method takes a requested timestamp to which we should advance the fundamental,
   # a value adjustment to apply after advancing time (must pass zero if none),
   # a symbol for which to advance time, a previous timestamp, and a previous fundamental
-  # value.  The last two parameters should relate to the most recent time this method
-  # was invoked.  It returns the new value.  As a side effect, it updates the log of
+  # value.  Timestamps are integer ns since epoch.  The last two parameters should relate
+  # to the most recent time this method was invoked.  It returns the new value.  As a side effect, it updates the log of
   # computed fundamental values.
 
   def compute_fundamental_at_timestamp(self, ts, v_adj, symbol, pt, pv):
@@ -105,7 +221,7 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     # (dense) MeanRevertingOracle.
 
     # Compute the time delta from the previous time to the requested time.
-    d = int((ts - pt) / np.timedelta64(1, 'ns'))
+    d = ts - pt
 
     # Extract the parameters for the OU process update.
     mu = s['r_bar']
@@ -130,8 +246,7 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     self.r[symbol] = (ts, v)
     
     # Append the change to the permanent log of fundamental values for this symbol.
-    self.f_log[symbol].append({ 'FundamentalTime' : ts, 'FundamentalValue' : v })
-    self.t_log[symbol].append(ts)
+    self.log_fundamental(symbol, ts, v)
 
     # Return the new value for the requested timestamp.
     return v
@@ -148,24 +263,16 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     # Agent observations using the oracle will use an agent's random state object.
     s = self.symbols[symbol]
 
-    # This is the previous fundamental time and value.
+    # This is the previous (most recent) fundamental time and value.
     pt, pv = self.r[symbol]
+    currentTime = currentTime.value
+
+    # If the fundamental has already been computed beyond the requested time, look up the value
+    # in effect at that time.
+    if currentTime < pt: return self.lookup_fundamental(symbol, currentTime)
+
     # If time hasn't changed since the last advance, just use the current value.
-    if self.t_log[symbol][self.t_i[symbol]] <= currentTime <= self.t_log[symbol][self.t_j[symbol]]:
-      return pv
-    elif self.t_log[symbol][self.t_j[symbol]] <= currentTime < self.t_log[symbol][-1]:
-      for j in range(self.t_j[symbol]+1, len(self.t_log[symbol])):
-        if currentTime < self.t_log[symbol][j]:
-          self.t_i[symbol] = j - 1
-          self.t_j[symbol] = np.min([j, len(self.t_log[symbol])-1])
-          break
-      r = self.f_log[symbol][self.t_i[symbol]]
-      pt = r['FundamentalTime']
-      pv = r['FundamentalValue']
-      self.r[symbol] = (pt, pv)
-      return pv
-
-    if currentTime <= pt: return pv
+    if currentTime == pt: return pv
 
     # Otherwise, we have some work to do, advancing time and computing the fundamental.
 
@@ -190,7 +297,7 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
       # Since we just surpassed the last megashock time, compute the next one, which we might or
       # might not immediately consume.  This works just like the first time (in __init__()).
 
-      mst = pt + pd.Timedelta('{}ns'.format(np.random.exponential(scale = 1.0 / s['megashock_lambda_a'])))
+      mst = pt + int(np.random.exponential(scale = 1.0 / s['megashock_lambda_a']))
       msv = s['random_state'].normal(loc = s['megashock_mean'], scale = sqrt(s['megashock_var']))
       msv = msv if s['random_state'].randint(2) == 0 else -msv
 
@@ -207,6 +314,63 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     return (v)
 
 
+  # This method advances the fundamental value series for a single stock symbol through each
+  # of an increasing array of times (integer ns since epoch, all after the most recent computed
+  # time) in one vectorized pass, applying the megashocks that arrive in between.  It draws all
+  # megashocks first and then all OU shocks, so the values are reproducible for a given seed
+  # but differ from those of advancing one time at a time.  Also unlike that, the non-negative
+  # floor and rounding to integer cents apply to the logged values only, not between steps.
+  # Megashock arrival intervals are drawn from rng (by default the global numpy PRNG).
+  def advance_fundamental_value_grid(self, symbol, times, rng = np.random):
+    s = self.symbols[symbol]
+    pt, pv = self.r[symbol]
+    mu, gamma, theta = s['r_bar'], s['kappa'], s['fund_vol']
+
+    # Draw megashock arrivals one at a time, as advance_fundamental_value does, until one
+    # arrives at or after the last time.  That one becomes the pending megashock.  Drawing
+    # exactly one interval per megashock leaves rng where the sequential path would, since
+    # rng is usually the global PRNG shared with the rest of the simulation.
+    arrivals = [self.megashocks[symbol][-1]['MegashockTime']]
+    while arrivals[-1] < times[-1]:
+      arrivals.append(arrivals[-1] + int(rng.exponential(scale = 1.0 / s['megashock_lambda_a'])))
+
+    applied = arrivals[:-1]
+    msv = s['random_state'].normal(loc = s['megashock_mean'], scale = sqrt(s['megashock_var']), size = len(applied))
+    msv = np.where(s['random_state'].randint(2, size = len(applied)) == 0, msv, -msv)
+    shock_values = [self.megashocks[symbol][-1]['MegashockValue']] + msv.tolist()
+
+    for mst, v in zip(arrivals[1:], shock_values[1:]):
+      self.megashocks[symbol].append({ 'MegashockTime' : mst, 'MegashockValue' : v })
+
+    # Merge the megashocks into the times at which the process is computed.  The value at
+    # a megashock time includes the megashock.
+    ts = np.concatenate((times, np.array(applied, dtype=np.int64)))
+    adj = np.concatenate((np.zeros(len(times)), shock_values[:-1]))
+    order = np.argsort(ts, kind='stable')
+    ts, adj = ts[order], adj[order]
+
+    # Each step is y[i] = a[i] * y[i-1] + b[i], with y the deviation from the mean, a the decay
+    # over the step and b its random shock plus any megashock (with the same OU moments as
+    # compute_fundamental_at_timestamp).  Unrolled, y[i] = A[i] * (y0 + sum over j <= i of
+    # b[j] / A[j]) where A[i] = exp(-gamma * (ts[i] - t0)), so the series is a cumulative sum.
+    # It is evaluated in blocks short enough that 1 / A cannot overflow.
+    d = np.diff(ts, prepend = pt)
+    b = s['random_state'].normal(scale = ((theta) / (2*gamma)) * (1 - np.exp(-2 * gamma * d))) + adj
+
+    y = np.empty(len(ts))
+    start, t0, y0 = 0, pt, pv - mu
+    while start < len(ts):
+      end = max(start + 1, np.searchsorted(ts, t0 + 100 / gamma, side='right'))
+      A = np.exp(-gamma * (ts[start:end] - t0))
+      y[start:end] = A * (y0 + np.cumsum(b[start:end] / A))
+      start, t0, y0 = end, ts[end - 1], y[end - 1]
+
+    v = np.round(np.maximum(0, mu + y)).astype(np.int64)
+
+    self.log_fundamental(symbol, ts, v)
+    self.r[symbol] = (int(ts[-1]), int(v[-1]))
+
+
   # Return the daily open price for the symbol given.  In the case of the MeanRevertingOracle,
   # this will simply be the first fundamental value, which is also the fundamental mean.
   # We will use the mkt_open time as given, however, even if it disagrees with this.
@@ -228,7 +392,7 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
     if currentTime >= self.mkt_close:
       curr_time = self.mkt_close - pd.Timedelta('1ns')
 
-    r_t = self.f_log[symbol][np.argwhere(np.asarray(self.t_log[symbol]).flatten() <= curr_time)[-1][0]]['FundamentalValue']
+    r_t = self.lookup_fundamental(symbol, curr_time.value)
 
     # Generate a noisy observation of fundamental value at the current time.
     if sigma_n == 0:
@@ -245,10 +409,14 @@ class SparseMeanRevertingOracle(MeanRevertingOracle):
   def compute_fundamental_value_series(self, symbol, currentTime, sigma_n = 1000, random_state = None):
     if self.fundamental_computed[symbol]:
       return
-    curr_time = currentTime
-    while curr_time < self.mkt_close:
-      self.observePrice(symbol, curr_time, sigma_n=sigma_n, random_state=random_state)
-      curr_time += pd.Timedelta(100000000, unit='ns')
+
+    # Compute the series every 100ms from currentTime until the close in one pass.  Grid times
+    # already computed are left as they are.
+    times = np.arange(currentTime.value, self.mkt_close.value, 100000000, dtype=np.int64)
+    times = times[times > self.r[symbol][0]]
+    if len(times) > 0: self.advance_fundamental_value_grid(symbol, times)
+
+    self.fundamental_computed[symbol] = True
 
   def observePrice(self, symbol, currentTime, sigma_n = 1000, random_state = None):
     # If the request is made after market close, return the close price.
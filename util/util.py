@@ -109,6 +109,21 @@ def ignored(warning_str, *exceptions):
             print(warning_str)
 
 
+def generate_uniform_random_points_on_line(left, right, num_points, random_state=None):
+    """ Uniformly generate points on an interval, and return numpy array of their coordinates. The points (and the
+        draws from random_state) are those of generate_uniform_random_pairwise_dist_on_line, so the coordinates may be
+        passed to model.LatencyTopology.LineTopology in place of the dense matrix of pairwise distances.
+
+    :param left: left endpoint of interval
+    :param right: right endpoint of interval
+    :param num_points: number of points to use
+    :param random_state: np.RandomState object
+
+    :return:
+    """
+    return random_state.uniform(low=left, high=right, size=num_points)
+
+
 def generate_uniform_random_pairwise_dist_on_line(left, right, num_points, random_state=None):
     """ Uniformly generate points on an interval, and return numpy array of pairwise distances between points.
 
@@ -121,7 +136,7 @@ def generate_uniform_random_pairwise_dist_on_line(left, right, num_points, rando
     :return:
     """
 
-    x_coords = random_state.uniform(low=left, high=right, size=num_points)
+    x_coords = generate_uniform_random_points_on_line(left, right, num_points, random_state=random_state)
     x_coords = x_coords.reshape((x_coords.size, 1))
     out = pdist(x_coords, 'euclidean')
     return squareform(out)